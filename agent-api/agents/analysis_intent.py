@@ -5,6 +5,8 @@ from pydantic import BaseModel
 from agno.agent import Agent
 from agno.models.openai import OpenAIChat
 
+from agents.prompt_layout import stable_prefix_enabled
+
 class AnalysisOutput(BaseModel):
     status: str = "success"  # Status of the analysis
     delay: int = 0  # Recommended delay in minutes
@@ -21,7 +23,7 @@ def get_analysis_intent_agent(
         agent_id="analysis_intent_agent",
         user_id=user_id,
         session_id=session_id,
-        model=OpenAIChat(id=model_id),
+        model=OpenAIChat(id=model_id, max_retries=0),
         description=dedent("""
             Expert in analyzing and interpreting data to derive actionable insights for decision-making.
         """),
@@ -64,6 +66,6 @@ def get_analysis_intent_agent(
 
         """),
         response_model = AnalysisOutput,
-        add_datetime_to_instructions = True,
+        add_datetime_to_instructions = not stable_prefix_enabled(),
         debug_mode=debug_mode,
     )
\ No newline at end of file
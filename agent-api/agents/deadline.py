@@ -0,0 +1,101 @@
+import asyncio
+import os
+import time
+from contextvars import ContextVar
+from typing import Any, Awaitable, Dict, List, Optional
+
+from agno.utils.log import logger
+
+_current: ContextVar[Optional["Deadline"]] = ContextVar("request_deadline", default=None)
+
+# Number of degraded answers per stage, for monitoring
+degradation_counts: Dict[str, int] = {}
+
+
+class DeadlineExceeded(Exception):
+    """Raised when a stage runs past the remaining time of the request deadline."""
+
+
+class Deadline:
+    """
+    Deadline of one request, propagated implicitly through a context variable.
+
+    Stages (input snapshot, provider calls) read the remaining time from `current_deadline()`,
+    and the degraded answers they fall back to are recorded in `reasons`.
+    """
+
+    def __init__(self, seconds: float, name: str = "") -> None:
+        self.name = name
+        self.seconds = seconds
+        self.expires_at = time.monotonic() + seconds
+        self.reasons: List[str] = []
+        self._token = None
+
+    def remaining(self) -> float:
+        return max(self.expires_at - time.monotonic(), 0.0)
+
+    @property
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    def budget(self, share: Optional[float] = None) -> float:
+        """Time for one stage: the whole remaining time, or a share of the initial deadline."""
+        if share is None:
+            return self.remaining()
+        return min(self.remaining(), self.seconds * share)
+
+    def degrade(self, stage: str, reason: str) -> None:
+        self.reasons.append(f"{stage}: {reason}")
+        degradation_counts[stage] = degradation_counts.get(stage, 0) + 1
+        logger.warning(f"Degraded {self.name}/{stage}: {reason}")
+
+    def __enter__(self) -> "Deadline":
+        self._token = _current.set(self)
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        _current.reset(self._token)
+
+
+def request_deadline_seconds(requested: Optional[float] = None) -> float:
+    """Deadline of a request: the requested value, or REQUEST_DEADLINE seconds."""
+    return requested if requested is not None else float(os.getenv("REQUEST_DEADLINE", "60"))
+
+
+def current_deadline() -> Optional[Deadline]:
+    return _current.get()
+
+
+def degrade(stage: str, reason: str) -> None:
+    """Record a degraded answer on the current deadline, if any."""
+    deadline = current_deadline()
+    if deadline is not None:
+        deadline.degrade(stage, reason)
+
+
+async def within(awaitable: Awaitable, stage: str, share: Optional[float] = None) -> Any:
+    """
+    Await `awaitable` within the stage budget; without a deadline it is awaited normally.
+
+    Args:
+        awaitable: Coroutine or future of the stage.
+        stage: Name of the stage, used in the error message.
+        share: Fraction of the initial deadline the stage may use.
+
+    Raises:
+        DeadlineExceeded: If the budget runs out; the awaitable is cancelled.
+    """
+    deadline = current_deadline()
+    if deadline is None:
+        return await awaitable
+    timeout = deadline.budget(share)
+    if timeout <= 0:
+        if asyncio.iscoroutine(awaitable):
+            awaitable.close()
+        elif isinstance(awaitable, asyncio.Future):
+            awaitable.cancel()
+        raise DeadlineExceeded(f"{stage} out of time")
+    try:
+        return await asyncio.wait_for(awaitable, timeout)
+    except asyncio.TimeoutError:
+        raise DeadlineExceeded(f"{stage} exceeded {timeout:.1f}s") from None
@@ -0,0 +1,223 @@
+import hashlib
+import json
+import os
+import random
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional, Tuple
+
+from agno.utils.log import logger
+
+from tools.components import PostgreSQLDatabase
+from tools.sensor_manager import EnvironmentSensorData, SensorEnvironmentManager
+from tools.weather_forecast import WeatherForecast
+
+# Quantization steps of the plant agent inputs
+EC_STEP = 0.1
+TEMPERATURE_STEP = 1.0
+HUMIDITY_STEP = 5.0
+ET0_STEP = 0.05
+# Number of recent output records folded into the history digest
+HISTORY_DIGEST_SIZE = 3
+
+
+def _bucket(value: float, step: float) -> int:
+    return int(round(float(value) / step))
+
+
+class PlantInputSnapshot:
+    """Inputs the plant agent would fetch through its tools, taken once before the run."""
+
+    def __init__(self, environment: EnvironmentSensorData, forecast: str, recent_ec: Tuple[float, ...]):
+        self.environment = environment
+        self.forecast = forecast
+        self.recent_ec = recent_ec
+
+    @classmethod
+    def capture(cls) -> "PlantInputSnapshot":
+        """
+        Read the current sensors, the forecast and the recent EC values.
+
+        Raises:
+            Exception: If any data source is unavailable; callers then bypass the cache.
+        """
+        environment = SensorEnvironmentManager().get_current_environment()
+        forecast = WeatherForecast().get_weather_forecast().description
+        db = PostgreSQLDatabase()
+        try:
+            records = db.get_recent_records(table_name="outputdata", num_records=HISTORY_DIGEST_SIZE)
+        finally:
+            db.close_connection()
+        recent_ec = tuple(float(record["ec"]) for record in reversed(records))
+        return cls(environment, forecast, recent_ec)
+
+    def features(self, zone_id: str) -> Tuple:
+        """Quantized feature vector used as the cache key."""
+        return (
+            zone_id,
+            tuple(_bucket(ec, EC_STEP) for ec in self.recent_ec),
+            _bucket(self.environment.ec, EC_STEP),
+            _bucket(self.environment.temperature, TEMPERATURE_STEP),
+            _bucket(self.environment.humidity, HUMIDITY_STEP),
+            _bucket(self.environment.et0, ET0_STEP),
+            self.forecast.strip().lower(),
+        )
+
+
+class PlantDecisionCache:
+    """LRU + TTL cache of plant agent outputs with an optional SQLite tier and divergence audits."""
+
+    def __init__(
+        self,
+        ttl_seconds: Optional[float] = None,
+        max_entries: Optional[int] = None,
+        disk_path: Optional[str] = None,
+        audit_rate: Optional[float] = None,
+        divergence_tolerance: int = 15,
+    ) -> None:
+        """
+        Args:
+            ttl_seconds: Maximum age of a cached decision.
+            max_entries: Number of decisions kept in memory.
+            disk_path: SQLite file for the on-disk tier, empty to disable it.
+            audit_rate: Fraction of hits that still run the agent to measure divergence.
+            divergence_tolerance: Difference in waiting time (minutes) counted as a divergence.
+        """
+        self.ttl_seconds = (
+            ttl_seconds if ttl_seconds is not None else float(os.getenv("PLANT_DECISION_CACHE_TTL", "21600"))
+        )
+        self.max_entries = (
+            max_entries if max_entries is not None else int(os.getenv("PLANT_DECISION_CACHE_SIZE", "512"))
+        )
+        disk_path = disk_path if disk_path is not None else os.getenv("PLANT_DECISION_CACHE_FILE", "")
+        self.audit_rate = (
+            audit_rate if audit_rate is not None else float(os.getenv("PLANT_DECISION_CACHE_AUDIT_RATE", "0.05"))
+        )
+        self.divergence_tolerance = divergence_tolerance
+        self.disabled_zones = {
+            zone.strip() for zone in os.getenv("PLANT_DECISION_CACHE_DISABLED_ZONES", "").split(",") if zone.strip()
+        }
+
+        self._entries: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn = None
+        if disk_path:
+            self._conn = sqlite3.connect(disk_path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS decisions "
+                "(key TEXT PRIMARY KEY, created REAL NOT NULL, decision TEXT NOT NULL)"
+            )
+            self._conn.commit()
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.bypassed = 0
+        self.audits = 0
+        self.divergences = 0
+        self.total_divergence = 0
+
+    def enabled_for(self, zone_id: str) -> bool:
+        return zone_id not in self.disabled_zones
+
+    @staticmethod
+    def key(features: Tuple) -> str:
+        return hashlib.sha1(json.dumps(features).encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None and self._conn is not None:
+                row = self._conn.execute("SELECT created, decision FROM decisions WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    entry = (row[0], json.loads(row[1]))
+                    self._store_memory(key, entry)
+                    self.disk_hits += 1
+            if entry is None:
+                self.misses += 1
+                return None
+            created, decision = entry
+            if now - created > self.ttl_seconds:
+                self._entries.pop(key, None)
+                if self._conn is not None:
+                    self._conn.execute("DELETE FROM decisions WHERE key = ?", (key,))
+                    self._conn.commit()
+                self.expired += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return dict(decision)
+
+    def _store_memory(self, key: str, entry: Tuple[float, Dict[str, Any]]) -> None:
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def put(self, key: str, decision: Dict[str, Any]) -> None:
+        entry = (time.time(), dict(decision))
+        with self._lock:
+            self._store_memory(key, entry)
+            if self._conn is not None:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO decisions (key, created, decision) VALUES (?, ?, ?)",
+                    (key, entry[0], json.dumps(entry[1], ensure_ascii=False)),
+                )
+                self._conn.commit()
+
+    def should_audit(self) -> bool:
+        return random.random() < self.audit_rate
+
+    def record_audit(self, cached: Dict[str, Any], live: Dict[str, Any]) -> None:
+        """Compare a cached decision with a live one for the same quantized inputs."""
+        difference = abs(cached["time_waiting"] - live["time_waiting"])
+        with self._lock:
+            self.audits += 1
+            self.total_divergence += difference
+            if difference > self.divergence_tolerance:
+                self.divergences += 1
+        if difference > self.divergence_tolerance:
+            logger.warning(f"Cached plant decision diverged from live run by {difference} minutes")
+
+    def refresh(self, decision: Dict[str, Any], snapshot: PlantInputSnapshot) -> Dict[str, Any]:
+        """Rebase a cached decision on the current time and sensor readings."""
+        decision["next_time_watering"] = (datetime.now() + timedelta(minutes=decision["time_waiting"])).isoformat()
+        decision["environ_sensor_data"] = snapshot.environment.model_dump()
+        decision["reason"] = f"{decision['reason']} (cached decision)"
+        return decision
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "expired": self.expired,
+            "bypassed": self.bypassed,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "audits": self.audits,
+            "divergences": self.divergences,
+            "divergence_rate": self.divergences / self.audits if self.audits else 0.0,
+            "mean_divergence_minutes": self.total_divergence / self.audits if self.audits else 0.0,
+        }
+
+
+_plant_decision_cache: Optional[PlantDecisionCache] = None
+
+
+def get_plant_decision_cache() -> Optional[PlantDecisionCache]:
+    """Process-wide plant decision cache, or None when PLANT_DECISION_CACHE is off."""
+    global _plant_decision_cache
+    if os.getenv("PLANT_DECISION_CACHE", "false").lower() != "true":
+        return None
+    if _plant_decision_cache is None:
+        _plant_decision_cache = PlantDecisionCache()
+    return _plant_decision_cache
@@ -0,0 +1,69 @@
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional
+
+from agno.utils.log import logger
+
+from tools.components import PostgreSQLDatabase
+from tools.sensor_manager import SensorEnvironmentManager
+
+# Deterministic plant decision: waiting time shrinks as EC rises above the target
+TARGET_EC = 4.0
+BASE_WAIT = 120
+GAIN = 60
+MIN_WAIT = 60
+MAX_WAIT = 300
+
+
+def plant_fallback(reason: str) -> Dict[str, Any]:
+    """
+    Proportional waiting time from the current sensor EC, shaped like PlantOutput.
+
+    Args:
+        reason: Why the model was not used.
+
+    Returns:
+        Dict[str, Any]: A PlantOutput-compatible decision.
+    """
+    environment = SensorEnvironmentManager().get_current_environment()
+    error = environment.ec - TARGET_EC
+    wait = int(max(MIN_WAIT, min(MAX_WAIT, BASE_WAIT - GAIN * error)))
+    return {
+        "time_waiting": wait,
+        "next_time_watering": (datetime.now() + timedelta(minutes=wait)).isoformat(timespec="minutes"),
+        "reason": f"Deterministic fallback ({reason}): EC {environment.ec:.2f} vs target {TARGET_EC}, wait {wait} minutes",
+        "environ_sensor_data": environment.model_dump(),
+    }
+
+
+def reflection_fallback(reason: str) -> Dict[str, Any]:
+    """
+    Template reflection on the last measured EC, shaped like ReflectionOutput.
+
+    Args:
+        reason: Why the model was not used.
+
+    Returns:
+        Dict[str, Any]: A ReflectionOutput-compatible reflection.
+    """
+    ec: Optional[float] = None
+    try:
+        db = PostgreSQLDatabase()
+        try:
+            ec = db.get_last_record(table_name="outputdata").get("ec")
+        finally:
+            db.close_connection()
+    except Exception as e:
+        logger.warning(f"Last EC unavailable for the reflection fallback: {e}")
+    if ec is None:
+        text = "EC of the last cycle is unavailable; keep the current waiting time and review it next cycle."
+    elif ec > TARGET_EC:
+        text = f"EC {ec:.2f} is above the target {TARGET_EC}; consider reducing the waiting time."
+    else:
+        text = f"EC {ec:.2f} is at or below the target {TARGET_EC}; consider increasing the waiting time."
+    return {"reflection_text": f"{text} (deterministic fallback: {reason})"}
+
+
+FALLBACKS = {
+    "plant_agent": plant_fallback,
+    "reflection_agent": reflection_fallback,
+}
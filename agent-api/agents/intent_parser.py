@@ -0,0 +1,185 @@
+import os
+import re
+import threading
+import time
+import unicodedata
+from typing import Dict, List, Optional
+
+from agents.analysis_intent import AnalysisOutput
+
+# Number words accepted before a time unit
+NUMBER_WORDS = {
+    "one": 1,
+    "two": 2,
+    "three": 3,
+    "four": 4,
+    "five": 5,
+    "ten": 10,
+    "fifteen": 15,
+    "twenty": 20,
+    "thirty": 30,
+    "forty five": 45,
+    "an": 1,
+    "a": 1,
+    "một": 1,
+    "hai": 2,
+    "ba": 3,
+    "bốn": 4,
+    "năm": 5,
+    "mười": 10,
+    "mười lăm": 15,
+    "hai mươi": 20,
+    "ba mươi": 30,
+    "bốn mươi lăm": 45,
+}
+UNIT_MINUTES = {
+    "m": 1,
+    "min": 1,
+    "mins": 1,
+    "minute": 1,
+    "minutes": 1,
+    "p": 1,
+    "phút": 1,
+    "phut": 1,
+    "h": 60,
+    "hr": 60,
+    "hrs": 60,
+    "hour": 60,
+    "hours": 60,
+    "giờ": 60,
+    "gio": 60,
+    "tiếng": 60,
+    "tieng": 60,
+}
+HALF_HOUR = ("half an hour", "nửa tiếng", "nửa giờ", "nua tieng", "nua gio")
+# Units that also name a time of day ("8 giờ", "8 h")
+CLOCK_UNITS = {"h", "giờ", "gio"}
+
+# Words that set the direction of a time shift
+EARLIER_WORDS = {"earlier", "sooner", "before", "sớm", "som", "trước", "truoc"}
+LATER_WORDS = {
+    "later", "after", "in", "delay", "postpone", "wait", "more", "another",
+    "sau", "muộn", "muon", "trễ", "tre", "chậm", "lùi", "hoãn", "thêm", "nữa", "nua", "đợi", "doi", "chờ",
+}  # fmt: skip
+# Direction words that also precede a time of day: "tưới trước 8 giờ" is "water before 8 o'clock"
+CLOCK_WORDS = {"before", "trước", "truoc", "after", "sau"}
+# Words of an agreement, and polite or filler words that carry no intent
+AGREE_WORDS = {
+    "ok", "okay", "oke", "okie", "yes", "yeah", "yep", "sure", "agree", "agreed", "fine", "good", "great",
+    "sounds", "go", "ahead", "alright", "now", "right", "đồng", "ý", "dong", "y", "được", "duoc", "đc",
+    "ừ", "ừm", "vâng", "dạ", "có", "luôn", "ngay", "đúng", "chuẩn", "tuyệt", "hợp", "lý",
+}  # fmt: skip
+FILLER_WORDS = {
+    "please", "pls", "let's", "lets", "let", "us", "can", "could", "we", "you", "i", "the", "plants", "plant",
+    "it", "irrigate", "irrigation", "water", "watering", "them", "bit", "do", "to", "then", "and", "about",
+    "around", "than", "hãy", "làm", "ơn", "giúp", "nhé", "nhe", "nha", "đi", "cho", "cây", "tưới", "tuoi",
+    "vườn", "mình", "tôi", "em", "anh", "chị", "bạn", "khoảng", "tầm", "chừng", "hơn", "lại", "khi", "và",
+    "rồi", "thì", "vậy", "ạ", "nhá",
+}  # fmt: skip
+
+_NUMBER = r"\d+(?:[.,]\d+)?|" + "|".join(sorted(map(re.escape, NUMBER_WORDS), key=len, reverse=True))
+_UNIT = "|".join(sorted(map(re.escape, UNIT_MINUTES), key=len, reverse=True))
+DURATION = re.compile(rf"(?<!\w)({_NUMBER})\s*({_UNIT})(?!\w)")
+HALF_HOUR_PATTERN = re.compile("|".join(map(re.escape, HALF_HOUR)))
+
+
+def _normalize(message: str) -> str:
+    text = unicodedata.normalize("NFC", message).lower().replace("\u2019", "'")
+    text = re.sub(r"[^\w\s'.,-]", " ", text)
+    return re.sub(r"[.,](?!\d)", " ", text)
+
+
+def _number(token: str) -> float:
+    return float(NUMBER_WORDS[token]) if token in NUMBER_WORDS else float(token.replace(",", "."))
+
+
+class IntentParser:
+    """
+    Rule-based parser of the user's reply to a proposed irrigation, in Vietnamese and English.
+
+    It resolves agreements ("ok", "đồng ý") and relative time shifts ("tưới sau 20 phút",
+    "water 10 minutes earlier") into an AnalysisOutput, and returns None whenever a word of the reply
+    is outside its vocabulary (negations, conditions, mixed directions), so that the LLM decides.
+    Hours after "trước/before/sau/after" may be a time of day ("sau 5 giờ"), so they are only resolved
+    with a relative marker ("sau 5 giờ nữa", "sớm hơn 1 giờ", "in 2 h", "2 h later").
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.parsed: Dict[str, int] = {"success": 0, "adjust": 0}
+        self.unresolved = 0
+        self.total_seconds = 0.0
+
+    @staticmethod
+    def _resolve(message: str) -> Optional[AnalysisOutput]:
+        text = _normalize(message)
+        minutes = 30.0 * len(HALF_HOUR_PATTERN.findall(text))
+        text = HALF_HOUR_PATTERN.sub(" ", text)
+        durations = DURATION.findall(text)
+        for number, unit in durations:
+            minutes += _number(number) * UNIT_MINUTES[unit]
+        words: List[str] = DURATION.sub(" ", text).split()
+        if not words and not minutes:
+            return None
+
+        earlier = [word for word in words if word in EARLIER_WORDS]
+        later = [word for word in words if word in LATER_WORDS]
+        known = EARLIER_WORDS | LATER_WORDS | AGREE_WORDS | FILLER_WORDS
+        if any(word not in known for word in words):
+            return None
+
+        if not minutes:
+            # A direction without an amount ("later") is left to the LLM
+            if earlier or later or not any(word in AGREE_WORDS for word in words):
+                return None
+            return AnalysisOutput(status="success", delay=0)
+        if bool(earlier) == bool(later):
+            # No direction ("20 phút") or both directions
+            return None
+        if any(unit in CLOCK_UNITS for _, unit in durations) and set(earlier + later) <= CLOCK_WORDS:
+            # "trước 8 giờ" is a time of day unless a relative marker says otherwise
+            return None
+        delay = int(round(minutes))
+        return AnalysisOutput(status="adjust", delay=-delay if earlier else delay)
+
+    def parse(self, message: str) -> Optional[AnalysisOutput]:
+        """
+        Resolve a reply without the LLM.
+
+        Args:
+            message: The user reply, without the volatile context block.
+
+        Returns:
+            The analysis, or None when the reply is not resolved with confidence.
+        """
+        started = time.perf_counter()
+        output = self._resolve(message)
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            self.total_seconds += elapsed
+            if output is None:
+                self.unresolved += 1
+            else:
+                self.parsed[output.status] += 1
+        return output
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            resolved = sum(self.parsed.values())
+            total = resolved + self.unresolved
+            return {
+                "replies": total,
+                "parsed_success": self.parsed["success"],
+                "parsed_adjust": self.parsed["adjust"],
+                "sent_to_llm": self.unresolved,
+                "parse_rate": resolved / total if total else 0.0,
+                "mean_parse_microseconds": self.total_seconds / total * 1e6 if total else 0.0,
+            }
+
+
+def intent_fast_path_enabled() -> bool:
+    """Whether replies to the analysis intent agent are parsed locally before calling the LLM."""
+    return os.getenv("INTENT_FAST_PATH", "true").lower() == "true"
+
+
+intent_parser = IntentParser()
@@ -0,0 +1,237 @@
+import asyncio
+import os
+import random
+import threading
+import time
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Optional
+
+from agno.utils.log import logger
+
+from agents.deadline import DeadlineExceeded, current_deadline, within
+
+# HTTP status codes treated as transient provider errors
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
+
+
+class CircuitOpenError(Exception):
+    """Raised when the provider's circuit breaker rejects a call."""
+
+
+def is_retryable(error: Exception) -> bool:
+    """Timeouts, connection errors, rate limits and 5xx responses."""
+    if isinstance(error, (asyncio.TimeoutError, TimeoutError, ConnectionError)):
+        return True
+    return getattr(error, "status_code", None) in RETRYABLE_STATUS
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker over consecutive transient failures.
+
+    The breaker opens after `failure_threshold` consecutive failures, lets a single probe through
+    once `reset_timeout` seconds have passed (half open), and closes again when the probe succeeds.
+    A probe that fails, or ends without a recorded outcome (`release_probe`), opens it again.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0) -> None:
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.failures = 0
+        self.opens = 0
+        self.opened_at: Optional[float] = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open" and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state, self._probing = "half_open", False
+            if self.state == "half_open" and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.state, self.failures, self._probing = "closed", 0, False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            if self.state == "half_open" or self.failures >= self.failure_threshold:
+                if self.state != "open":
+                    self.opens += 1
+                    logger.warning(f"Circuit breaker opened after {self.failures} consecutive failures")
+                self.state, self.opened_at, self._probing = "open", time.monotonic(), False
+
+    def release_probe(self) -> None:
+        """
+        Reopen the breaker, with a fresh reset timeout, when the probe ends without an outcome.
+
+        Called when a call is cancelled or runs out of the request deadline before the provider
+        answers, so that the breaker is not left half open with a probe that never reports back.
+        """
+        with self._lock:
+            if self.state == "half_open" and self._probing:
+                self.state, self.opened_at, self._probing = "open", time.monotonic(), False
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"state": self.state, "consecutive_failures": self.failures, "opens": self.opens}
+
+
+class ProviderGuard:
+    """Concurrency limit, jittered retries and circuit breaker for one model provider."""
+
+    def __init__(
+        self,
+        provider: str,
+        max_concurrency: Optional[int] = None,
+        retries: Optional[int] = None,
+        timeout: Optional[float] = None,
+        base_delay: float = 0.5,
+        max_delay: float = 8.0,
+    ) -> None:
+        """
+        Args:
+            provider: Name of the model provider.
+            max_concurrency: Maximum in-flight requests to the provider.
+            retries: Retries for transient errors.
+            timeout: Timeout of each attempt in seconds.
+            base_delay: Base of the exponential backoff, with full jitter.
+            max_delay: Maximum backoff in seconds.
+        """
+        self.provider = provider
+        self.max_concurrency = max_concurrency or int(os.getenv("LLM_MAX_CONCURRENCY", "16"))
+        self.retries = retries if retries is not None else int(os.getenv("LLM_RETRIES", "2"))
+        self.timeout = timeout or float(os.getenv("LLM_TIMEOUT", "60"))
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.breaker = CircuitBreaker(
+            failure_threshold=int(os.getenv("LLM_BREAKER_THRESHOLD", "5")),
+            reset_timeout=float(os.getenv("LLM_BREAKER_RESET", "30")),
+        )
+        self._slots = asyncio.Semaphore(self.max_concurrency)
+        self.in_flight = 0
+        self.calls = 0
+        self.retried = 0
+        self.failures = 0
+        self.rejected = 0
+
+    def admit(self) -> None:
+        """
+        Raises:
+            CircuitOpenError: If the breaker does not allow a call.
+        """
+        if not self.breaker.allow():
+            self.rejected += 1
+            raise CircuitOpenError(f"Circuit breaker for {self.provider} is open")
+
+    @asynccontextmanager
+    async def slot(self) -> AsyncIterator[None]:
+        """Hold one of the provider's concurrency slots, waiting no longer than the request deadline."""
+        await within(self._slots.acquire(), "provider queue")
+        self.in_flight += 1
+        self.calls += 1
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+            self._slots.release()
+
+    def record_error(self, error: Exception) -> bool:
+        """Record a failed attempt and return whether it is transient."""
+        if not is_retryable(error):
+            # The provider answered (e.g. 400), which says nothing about its health
+            self.breaker.record_success()
+            return False
+        self.failures += 1
+        self.breaker.record_failure()
+        return True
+
+    async def call(self, run: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Run `run()` under the concurrency limit with retries and the circuit breaker.
+
+        Within a request deadline, each attempt is capped by the remaining time and no retry is
+        started once the backoff would outlast it; such overruns are not counted against the provider.
+
+        Args:
+            run: Factory of the awaitable to run, called once per attempt.
+
+        Returns:
+            The result of the first successful attempt.
+
+        Raises:
+            CircuitOpenError: If the breaker is open.
+            DeadlineExceeded: If the request deadline runs out.
+            Exception: The last error when it is not transient or retries are exhausted.
+        """
+        deadline = current_deadline()
+        for attempt in range(self.retries + 1):
+            self.admit()
+            # Cancellation or the deadline, while queued or in flight, leaves the attempt without an outcome
+            recorded = False
+            try:
+                async with self.slot():
+                    timeout = min(self.timeout, deadline.remaining()) if deadline else self.timeout
+                    try:
+                        result = await asyncio.wait_for(run(), timeout)
+                    except Exception as e:
+                        if isinstance(e, asyncio.TimeoutError) and timeout < self.timeout:
+                            raise DeadlineExceeded(
+                                f"{self.provider} call exceeded the remaining {timeout:.1f}s"
+                            ) from None
+                        recorded = True
+                        transient = self.record_error(e)
+                        if not transient or attempt >= self.retries or self.breaker.state == "open":
+                            raise
+                        self.retried += 1
+                        logger.warning(f"Retrying {self.provider} after transient error: {e}")
+                    else:
+                        recorded = True
+                        self.breaker.record_success()
+                        return result
+            finally:
+                if not recorded:
+                    self.breaker.release_probe()
+            delay = random.uniform(0, min(self.max_delay, self.base_delay * 2**attempt))
+            if deadline is not None and delay >= deadline.remaining():
+                raise DeadlineExceeded(f"No time left to retry {self.provider}")
+            await asyncio.sleep(delay)
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "provider": self.provider,
+            "in_flight": self.in_flight,
+            "max_concurrency": self.max_concurrency,
+            "calls": self.calls,
+            "retried": self.retried,
+            "failures": self.failures,
+            "rejected": self.rejected,
+            "breaker": self.breaker.snapshot(),
+        }
+
+
+_guards: Dict[str, ProviderGuard] = {}
+
+
+def provider_key(agent: Any) -> str:
+    """Guard key of an agent's model, e.g. `OpenAI:gpt-4.1`."""
+    return f"{agent.model.provider}:{agent.model.id}"
+
+
+def get_provider_guard(provider: str) -> ProviderGuard:
+    """Shared guard of a model provider."""
+    if provider not in _guards:
+        _guards[provider] = ProviderGuard(provider)
+    return _guards[provider]
+
+
+def provider_guards_status() -> Dict[str, Dict[str, Any]]:
+    """Monitoring state of every provider guard."""
+    return {provider: guard.status() for provider, guard in _guards.items()}
@@ -0,0 +1,262 @@
+import asyncio
+import json
+import os
+import statistics
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional, Tuple
+
+from agno.utils.log import logger
+
+from agents.decision_cache import PlantInputSnapshot
+from agents.fallback import TARGET_EC
+
+# Forecast words that make a plant decision a hard case
+UNSTABLE_WEATHER = ("rain", "storm", "thunder", "shower", "wind", "mưa", "giông", "bão", "gió")
+
+
+class ModelRouter:
+    """
+    Pick the model of a run from the difficulty of the request, and optionally hedge it.
+
+    Routine plant decisions (small EC error, steady recent EC, stable weather) and all intent analysis
+    go to the small model; the other runs use the large model. A hedged run starts the same request on
+    the other model once the first exceeds the observed p95 latency of its model, and keeps whichever
+    answer arrives first. Routes, latencies and hedge outcomes are kept for tuning.
+    """
+
+    def __init__(
+        self,
+        small_model: Optional[str] = None,
+        large_model: Optional[str] = None,
+        easy_ec_error: Optional[float] = None,
+        hedge_quantile: float = 0.95,
+        hedge_min_samples: int = 20,
+        default_hedge_delay: Optional[float] = None,
+        window: int = 200,
+        log_path: Optional[str] = None,
+    ) -> None:
+        """
+        Args:
+            small_model: Cheaper, faster model for routine runs.
+            large_model: Model reserved for hard cases.
+            easy_ec_error: Largest EC error (and recent EC spread) of a routine plant decision.
+            hedge_quantile: Latency quantile of the primary model after which the hedge starts.
+            hedge_min_samples: Latency samples needed before the quantile replaces the default delay.
+            default_hedge_delay: Hedge delay in seconds until enough samples are recorded.
+            window: Number of recent latencies kept per model.
+            log_path: JSONL file receiving one line per routed run, empty to disable it.
+        """
+        self.small_model = small_model or os.getenv("MODEL_ROUTER_SMALL", "o4-mini")
+        self.large_model = large_model or os.getenv("MODEL_ROUTER_LARGE", "gpt-4.1")
+        self.easy_ec_error = (
+            easy_ec_error if easy_ec_error is not None else float(os.getenv("MODEL_ROUTER_EASY_EC_ERROR", "0.3"))
+        )
+        self.hedge_quantile = hedge_quantile
+        self.hedge_min_samples = hedge_min_samples
+        self.default_hedge_delay = default_hedge_delay or float(os.getenv("MODEL_ROUTER_HEDGE_DELAY", "8"))
+        self.window = window
+        self.log_path = log_path if log_path is not None else os.getenv("MODEL_ROUTER_LOG", "")
+
+        self._lock = threading.Lock()
+        self._log_lock = threading.Lock()
+        self._latencies: Dict[str, Deque[float]] = {}
+        self.routes: Dict[str, int] = {}
+        self.runs = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+        self.failures = 0
+
+    def other(self, model_id: str) -> str:
+        return self.small_model if model_id == self.large_model else self.large_model
+
+    def route(self, agent_id: str, snapshot: Optional[PlantInputSnapshot] = None) -> Tuple[str, str]:
+        """
+        Choose the model of a run.
+
+        Args:
+            agent_id: The agent to run.
+            snapshot: Current plant inputs, None when they could not be read.
+
+        Returns:
+            Tuple[str, str]: The model id and the reason of the choice.
+        """
+        if agent_id == "analysis_intent_agent":
+            model_id, reason = self.small_model, "intent analysis"
+        elif agent_id != "plant_agent":
+            model_id, reason = self.large_model, "free-form analysis"
+        elif snapshot is None:
+            model_id, reason = self.large_model, "plant inputs unavailable"
+        else:
+            model_id, reason = self._route_plant(snapshot)
+        with self._lock:
+            key = f"{agent_id}:{model_id}:{reason}"
+            self.routes[key] = self.routes.get(key, 0) + 1
+        return model_id, reason
+
+    def _route_plant(self, snapshot: PlantInputSnapshot) -> Tuple[str, str]:
+        error = abs(snapshot.environment.ec - TARGET_EC)
+        if error > self.easy_ec_error:
+            return self.large_model, f"EC error {error:.2f}"
+        spread = max(snapshot.recent_ec) - min(snapshot.recent_ec) if snapshot.recent_ec else 0.0
+        if spread > self.easy_ec_error:
+            return self.large_model, f"recent EC spread {spread:.2f}"
+        forecast = snapshot.forecast.lower()
+        if any(word in forecast for word in UNSTABLE_WEATHER):
+            return self.large_model, "unstable weather"
+        return self.small_model, "routine decision"
+
+    def hedge_delay(self, model_id: str) -> float:
+        """Observed latency quantile of the model, or the default delay while samples are few."""
+        with self._lock:
+            samples = list(self._latencies.get(model_id, ()))
+        if len(samples) < self.hedge_min_samples:
+            return self.default_hedge_delay
+        return statistics.quantiles(samples, n=100)[int(self.hedge_quantile * 100) - 1]
+
+    def observe(self, model_id: str, seconds: float) -> None:
+        """
+        Add a latency sample of a model, from its own request start to its answer.
+
+        Attempts cancelled before answering are added too, with their elapsed time as a lower bound, so that a
+        model that keeps losing hedges does not keep the fast quantile of its few answered runs.
+        """
+        with self._lock:
+            self._latencies.setdefault(model_id, deque(maxlen=self.window)).append(seconds)
+
+    async def record(
+        self,
+        agent_id: str,
+        model_id: str,
+        reason: str,
+        latency: Optional[float],
+        hedged: bool = False,
+        winner: Optional[str] = None,
+    ) -> None:
+        """
+        Record the outcome of a routed run.
+
+        Args:
+            agent_id: The agent that ran.
+            model_id: The model chosen by the route.
+            reason: Why the model was chosen.
+            latency: Seconds from the start of the run until the answer, None when every attempt failed.
+            hedged: Whether a second request was started on the other model.
+            winner: Model whose answer was used, None when every attempt failed.
+
+        The log line is appended from a worker thread to keep file I/O off the event loop.
+        """
+        with self._lock:
+            self.runs += 1
+            if hedged:
+                self.hedged += 1
+                if winner is not None and winner != model_id:
+                    self.hedge_wins += 1
+            if winner is None:
+                self.failures += 1
+        if self.log_path:
+            entry = {
+                "time": datetime.now().isoformat(timespec="seconds"),
+                "agent_id": agent_id,
+                "model": model_id,
+                "reason": reason,
+                "latency": latency,
+                "hedged": hedged,
+                "winner": winner,
+            }
+            await asyncio.to_thread(self._append_log, json.dumps(entry, ensure_ascii=False) + "\n")
+
+    def _append_log(self, line: str) -> None:
+        with self._log_lock, open(self.log_path, "a", encoding="utf-8") as log:
+            log.write(line)
+
+    async def run(
+        self,
+        agent_id: str,
+        model_id: str,
+        reason: str,
+        primary: Callable[[], Awaitable[Any]],
+        secondary: Optional[Callable[[], Awaitable[Any]]] = None,
+    ) -> Any:
+        """
+        Run a routed request, hedged on the other model when `secondary` is given.
+
+        The hedge starts when the primary exceeds the hedge delay of its model, or at once if it fails.
+
+        Args:
+            agent_id: The agent to run.
+            model_id: The model chosen by the route.
+            reason: Why the model was chosen.
+            primary: Factory of the run on the chosen model.
+            secondary: Factory of the same run on the other model.
+
+        Returns:
+            The first successful answer.
+
+        Raises:
+            Exception: The error of the primary when no attempt succeeds.
+        """
+        started = time.monotonic()
+        if secondary is None:
+            try:
+                result = await primary()
+            except asyncio.CancelledError:
+                self.observe(model_id, time.monotonic() - started)
+                raise
+            except Exception:
+                await self.record(agent_id, model_id, reason, None)
+                raise
+            self.observe(model_id, time.monotonic() - started)
+            await self.record(agent_id, model_id, reason, time.monotonic() - started, winner=model_id)
+            return result
+
+        first = asyncio.ensure_future(primary())
+        tasks = {first: (model_id, started)}
+        try:
+            await asyncio.wait({first}, timeout=self.hedge_delay(model_id))
+            if not first.done() or first.exception() is not None:
+                other_model = self.other(model_id)
+                logger.info(f"Hedging {agent_id} on {other_model} after {time.monotonic() - started:.1f}s")
+                tasks[asyncio.ensure_future(secondary())] = (other_model, time.monotonic())
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        winner, task_started = tasks[task]
+                        self.observe(winner, time.monotonic() - task_started)
+                        await self.record(
+                            agent_id, model_id, reason, time.monotonic() - started, len(tasks) > 1, winner
+                        )
+                        return task.result()
+            await self.record(agent_id, model_id, reason, None, hedged=len(tasks) > 1)
+            raise first.exception()
+        finally:
+            for task, (task_model, task_started) in tasks.items():
+                if not task.done():
+                    # The losing or interrupted attempt took at least this long
+                    self.observe(task_model, time.monotonic() - task_started)
+                    task.cancel()
+                elif not task.cancelled():
+                    task.exception()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            latencies = {model_id: list(samples) for model_id, samples in self._latencies.items()}
+            stats = {
+                "runs": self.runs,
+                "routes": dict(self.routes),
+                "hedged": self.hedged,
+                "hedge_wins": self.hedge_wins,
+                "failures": self.failures,
+            }
+        stats["median_latency"] = {model_id: statistics.median(samples) for model_id, samples in latencies.items()}
+        stats["hedge_delay"] = {
+            model_id: self.hedge_delay(model_id) for model_id in (self.small_model, self.large_model)
+        }
+        return stats
+
+
+model_router = ModelRouter()
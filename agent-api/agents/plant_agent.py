@@ -5,6 +5,8 @@ from pydantic import BaseModel
 from agno.agent import Agent
 from agno.models.openai import OpenAIChat
 
+from agents.prompt_layout import stable_prefix_enabled
+
 from db.session import db_url
 from tools.tool import GetRecentIrrigationDataTool, GetCurrentEnviromentTool, GetWeatherForecastTool, GetLastIrrigationDataTool
 from tools.sensor_manager import EnvironmentSensorData
@@ -27,7 +29,7 @@ def get_plant_agent(
         agent_id = "plant_agent",
         user_id = user_id,
         session_id = session_id,
-        model = OpenAIChat(id=model_id),
+        model = OpenAIChat(id=model_id, max_retries=0),
         description = dedent("""
             Agricultural expert with 20+ years of experience in analyzing and optimizing crop irrigation cycles to improve water efficiency, increase yields, and promote sustainable farming.              
         """),
@@ -44,10 +46,10 @@ def get_plant_agent(
             - **last_reflection** → *(From `GetLastIrrigationDataTool`)*  
             A qualitative summary and insights from the most recent irrigation cycle.
 
-            - **history_summary** → *(From `GetRecentIrrigationDataTool`)*  
-            A structured JSON summary of recent irrigation cycles, including EC trends and system adjustments.
+            - **history_summary** → *(From `GetRecentIrrigationDataTool`, prefer `get_recent_irrigation_table`)*  
+            A compact table of recent irrigation cycles, including EC trends and system adjustments; older cycles are summarized in its last line.
 
-            - **current_env** → *(From `GetCurrentEnviromentTool`)*  
+            - **current_env** → *(From `GetCurrentEnviromentTool`, or the `current_env` line of the `<context>` block at the end of the message when present)*  
             Real-time environmental data such as temperature, humidity, and the current EC value from sensors.
 
             - **forecast** → *(From `GetWeatherForecastTool`)*  
@@ -70,7 +72,7 @@ def get_plant_agent(
             GetRecentIrrigationDataTool(), 
             GetCurrentEnviromentTool(), 
             GetWeatherForecastTool()],
-        add_datetime_to_instructions = True,
+        add_datetime_to_instructions = not stable_prefix_enabled(),
         response_model = PlantOutput,
         show_tool_calls = True,
         debug_mode = debug_mode
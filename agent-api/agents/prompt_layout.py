@@ -0,0 +1,97 @@
+import os
+import threading
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from agno.utils.log import logger
+
+from tools.sensor_manager import SensorEnvironmentManager
+
+
+def stable_prefix_enabled() -> bool:
+    """
+    Whether agents keep their system instructions byte-stable.
+
+    In this layout the instructions carry no datetime, so providers can reuse the cached
+    prompt prefix across runs; volatile data is appended to the end of the user turn instead.
+    """
+    return os.getenv("STABLE_PROMPT_PREFIX", "true").lower() == "true"
+
+
+def with_volatile_context(message: str, agent_id: str) -> str:
+    """
+    Append the volatile context (current datetime, sensor readings) after the user message.
+
+    Args:
+        message: The user message.
+        agent_id: The agent the message is sent to.
+
+    Returns:
+        The message unchanged when the stable layout is off, otherwise the message followed by a context block.
+    """
+    if not stable_prefix_enabled():
+        return message
+    lines = [f"current_datetime: {datetime.now().astimezone().isoformat(timespec='minutes')}"]
+    if agent_id == "plant_agent":
+        try:
+            environment = SensorEnvironmentManager().get_current_environment()
+            lines.append("current_env: " + " ".join(f"{k}={v:.2f}" for k, v in environment.model_dump().items()))
+        except Exception as e:
+            logger.warning(f"Current environment not added to the message: {e}")
+    return f"{message}\n\n<context>\n" + "\n".join(lines) + "\n</context>"
+
+
+class PromptCacheStats:
+    """Prompt and cached token counts reported by the provider, per agent."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._agents: Dict[str, Dict[str, float]] = {}
+
+    @staticmethod
+    def _total(metrics: Dict[str, Any], key: str) -> float:
+        values: List[Any] = metrics.get(key) or []
+        return sum(value for value in values if isinstance(value, (int, float)))
+
+    def record(self, agent_id: str, metrics: Optional[Dict[str, Any]]) -> None:
+        """
+        Record the metrics of one run.
+
+        Args:
+            agent_id: The agent that ran.
+            metrics: RunResponse.metrics, lists of per-message values keyed by metric name.
+        """
+        if not metrics:
+            return
+        input_tokens = self._total(metrics, "input_tokens")
+        cached_tokens = self._total(metrics, "cached_tokens")
+        first_token = metrics.get("time_to_first_token") or []
+        with self._lock:
+            entry = self._agents.setdefault(
+                agent_id, {"runs": 0, "input_tokens": 0, "cached_tokens": 0, "time_to_first_token": 0.0, "timed": 0}
+            )
+            entry["runs"] += 1
+            entry["input_tokens"] += input_tokens
+            entry["cached_tokens"] += cached_tokens
+            if first_token and first_token[0] is not None:
+                entry["time_to_first_token"] += first_token[0]
+                entry["timed"] += 1
+        logger.debug(f"{agent_id}: {cached_tokens:.0f}/{input_tokens:.0f} prompt tokens served from cache")
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            return {
+                agent_id: {
+                    "runs": entry["runs"],
+                    "input_tokens": entry["input_tokens"],
+                    "cached_tokens": entry["cached_tokens"],
+                    "cache_hit_ratio": entry["cached_tokens"] / entry["input_tokens"] if entry["input_tokens"] else 0.0,
+                    "mean_time_to_first_token": (
+                        entry["time_to_first_token"] / entry["timed"] if entry["timed"] else None
+                    ),
+                }
+                for agent_id, entry in self._agents.items()
+            }
+
+
+prompt_cache_stats = PromptCacheStats()
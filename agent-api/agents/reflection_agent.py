@@ -5,6 +5,8 @@ from pydantic import BaseModel
 from agno.agent import Agent
 from agno.models.openai import OpenAIChat
 
+from agents.prompt_layout import stable_prefix_enabled
+
 
 class ReflectionOutput(BaseModel):
     reflection_text: str
@@ -20,7 +22,7 @@ def get_reflection_agent(
         agent_id = "reflection_agent",
         user_id = user_id,
         session_id = session_id,
-        model = OpenAIChat(id=model_id),
+        model = OpenAIChat(id=model_id, max_retries=0),
         description = dedent("""
             Agricultural expert with 20+ years of experience in analyzing and optimizing crop irrigation cycles to improve water efficiency, increase yields, and promote sustainable farming.                     
         """),
@@ -56,7 +58,7 @@ def get_reflection_agent(
 
         """),
         markdown = True,
-        add_datetime_to_instructions = True,
+        add_datetime_to_instructions = not stable_prefix_enabled(),
         debug_mode = debug_mode,
         response_model = ReflectionOutput,
     )
\ No newline at end of file
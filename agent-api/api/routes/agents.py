@@ -1,12 +1,28 @@
+import asyncio
+import json
 from enum import Enum
 from logging import getLogger
-from typing import AsyncGenerator, List, Optional
+from typing import Any, AsyncGenerator, Callable, Dict, List, Optional, Tuple
 
 from agno.agent import Agent
-from fastapi import APIRouter, HTTPException, status
+from fastapi import APIRouter, HTTPException, Response, status
 from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 
+from agents.deadline import (
+    Deadline,
+    DeadlineExceeded,
+    degradation_counts,
+    degrade,
+    request_deadline_seconds,
+    within,
+)
+from agents.decision_cache import PlantInputSnapshot, get_plant_decision_cache
+from agents.fallback import FALLBACKS
+from agents.intent_parser import intent_fast_path_enabled, intent_parser
+from agents.llm_resilience import CircuitOpenError, get_provider_guard, provider_guards_status, provider_key
+from agents.model_router import model_router
+from agents.prompt_layout import prompt_cache_stats, with_volatile_context
 from agents.selector import AgentType, get_agent, get_available_agents
 
 logger = getLogger(__name__)
@@ -19,6 +35,7 @@ agents_router = APIRouter(prefix="/agents", tags=["Agents"])
 
 
 class Model(str, Enum):
+    auto = "auto"
     gpt_4_1 = "gpt-4.1"
     o4_mini = "o4-mini"
 
@@ -34,23 +51,86 @@ async def list_agents():
     return get_available_agents()
 
 
-async def chat_response_streamer(agent: Agent, message: str) -> AsyncGenerator:
+async def chat_response_streamer(agent: Agent, agent_id: str, message: str, deadline: Deadline) -> AsyncGenerator:
     """
     Stream agent responses chunk by chunk.
 
     Args:
         agent: The agent instance to interact with
+        agent_id: The ID of the agent, used to record prompt cache metrics
         message: User message to process
+        deadline: Request deadline; the stream stops (or falls back before the first chunk) when it runs out
 
     Yields:
         Text chunks from the agent response
     """
-    run_response = await agent.arun(message, stream=True)
-    async for chunk in run_response:
-        # chunk.content only contains the text response from the Agent.
-        # For advanced use cases, we should yield the entire chunk
-        # that contains the tool calls and intermediate steps.
-        yield chunk.content
+    # The generator runs after the route handler returned, so the deadline is entered here: the slot wait
+    # and the provider call read it through current_deadline()
+    with deadline:
+        guard = get_provider_guard(provider_key(agent))
+        try:
+            guard.admit()
+        except CircuitOpenError as e:
+            yield await fallback_content(agent_id, e)
+            return
+
+        streamed = False
+        # Set once the provider's answer or error reaches the breaker; otherwise a half-open probe is released
+        recorded = False
+        try:
+            async with guard.slot():
+                try:
+                    run_response = await asyncio.wait_for(agent.arun(message, stream=True), deadline.remaining())
+                    chunks = run_response.__aiter__()
+                    while True:
+                        try:
+                            chunk = await asyncio.wait_for(chunks.__anext__(), deadline.remaining())
+                        except StopAsyncIteration:
+                            break
+                        # chunk.content only contains the text response from the Agent.
+                        # For advanced use cases, we should yield the entire chunk
+                        # that contains the tool calls and intermediate steps.
+                        streamed = True
+                        yield chunk.content
+                except asyncio.TimeoutError:
+                    # The deadline, not the provider, cut the stream short
+                    guard.breaker.release_probe()
+                    deadline.degrade("stream", "deadline exceeded" + ("" if streamed else ", deterministic fallback"))
+                    if not streamed:
+                        yield await fallback_content(agent_id, DeadlineExceeded("deadline exceeded"))
+                    return
+                except Exception as e:
+                    recorded = True
+                    guard.record_error(e)
+                    logger.error(f"Streaming run of {agent_id} failed: {e}")
+                    if not streamed:
+                        yield await fallback_content(agent_id, e)
+                    return
+            recorded = True
+            guard.breaker.record_success()
+        except DeadlineExceeded as e:
+            # No provider slot freed up before the deadline
+            guard.breaker.release_probe()
+            deadline.degrade("stream", f"{e}, deterministic fallback")
+            yield await fallback_content(agent_id, e)
+            return
+        finally:
+            if not recorded:
+                guard.breaker.release_probe()
+        prompt_cache_stats.record(agent_id, agent.run_response.metrics)
+
+
+async def fallback_content(agent_id: str, error: Exception) -> str:
+    """
+    Deterministic answer of an agent when its model is unavailable, serialized as JSON.
+
+    The stream has already started, so agents without a fallback get an error object instead of a 503.
+    Fallbacks read the sensors and the database synchronously, so they run in a worker thread.
+    """
+    fallback = FALLBACKS.get(agent_id)
+    if fallback is None:
+        return json.dumps({"error": f"Model unavailable: {error}"})
+    return json.dumps(await asyncio.to_thread(fallback, str(error)))
 
 
 class RunRequest(BaseModel):
@@ -58,46 +138,273 @@ class RunRequest(BaseModel):
 
     message: str
     stream: bool = True
-    model: Model = Model.gpt_4_1
+    model: Model = Model.auto
+    hedge: bool = False
     user_id: Optional[str] = None
     session_id: Optional[str] = None
+    zone_id: str = "default"
+    use_cache: bool = True
+    deadline_seconds: Optional[float] = None
+
+
+async def run_agent(
+    agent: Agent,
+    agent_id: str,
+    message: str,
+    stale: Optional[Any] = None,
+    reason: str = "requested",
+    hedge_agent: Optional[Callable[[], Agent]] = None,
+) -> Any:
+    """
+    Run an agent without streaming and record its prompt cache metrics.
+
+    The call goes through the provider guard (concurrency limit, retries, circuit breaker) within
+    the request deadline; when it fails, the best available answer is returned instead of an error:
+    the stale answer if given, then the agent's deterministic fallback.
+
+    Args:
+        agent: The agent instance to run
+        agent_id: The ID of the agent
+        message: User message, including the volatile context block
+        stale: Previously computed answer for the same inputs, e.g. a cached decision
+        reason: Why the agent's model was chosen, recorded by the model router
+        hedge_agent: Factory of the same agent on the other model, to hedge a slow run
+
+    Returns:
+        The content of the agent response
+    """
+
+    def guarded(target: Agent) -> Any:
+        return get_provider_guard(provider_key(target)).call(lambda: target.arun(message, stream=False))
+
+    secondary = (lambda: guarded(hedge_agent())) if hedge_agent is not None else None
+    try:
+        response = await model_router.run(agent_id, agent.model.id, reason, lambda: guarded(agent), secondary)
+    except Exception as e:
+        logger.error(f"Run of {agent_id} failed: {e}")
+        if stale is not None:
+            degrade(agent_id, f"{e}, cached answer")
+            return stale
+        fallback = FALLBACKS.get(agent_id)
+        if fallback is None:
+            overrun = isinstance(e, DeadlineExceeded)
+            code = status.HTTP_504_GATEWAY_TIMEOUT if overrun else status.HTTP_503_SERVICE_UNAVAILABLE
+            raise HTTPException(status_code=code, detail=f"Model unavailable: {e}")
+        degrade(agent_id, f"{e}, deterministic fallback")
+        return await asyncio.to_thread(fallback, str(e))
+    prompt_cache_stats.record(agent_id, response.metrics)
+    return response.content
+
+
+async def capture_plant_inputs() -> Optional[PlantInputSnapshot]:
+    """
+    Read the plant agent inputs within a share of the request deadline.
+
+    Returns:
+        The snapshot, or None when a data source is unavailable or too slow
+    """
+    try:
+        return await within(asyncio.to_thread(PlantInputSnapshot.capture), "snapshot", share=0.25)
+    except DeadlineExceeded as e:
+        degrade("snapshot", f"{e}, inputs skipped")
+    except Exception as e:
+        logger.warning(f"Plant inputs unavailable: {e}")
+    return None
+
+
+async def route_request(agent_id: AgentType, body: RunRequest) -> Tuple[str, str, Optional[PlantInputSnapshot]]:
+    """
+    Resolve the model of a run; `auto` lets the model router choose from the request difficulty.
+
+    Args:
+        agent_id: The agent to run
+        body: Request parameters including the model
+
+    Returns:
+        Tuple of the model id, the reason of the choice and the plant inputs read to make it
+    """
+    snapshot = None
+    if agent_id == AgentType.PLANT_AGENT and not body.stream and (body.model == Model.auto or body.use_cache):
+        snapshot = await capture_plant_inputs()
+    if body.model != Model.auto:
+        return body.model.value, "requested", snapshot
+    model_id, reason = model_router.route(agent_id.value, snapshot)
+    return model_id, reason, snapshot
+
+
+async def run_plant_agent_cached(
+    agent: Agent,
+    body: RunRequest,
+    message: str,
+    snapshot: Optional[PlantInputSnapshot],
+    reason: str = "requested",
+    hedge_agent: Optional[Callable[[], Agent]] = None,
+):
+    """
+    Run the plant agent through the decision cache when it is enabled for the zone.
+
+    The cache key is a quantized snapshot of the inputs the agent would fetch through its tools.
+    A sampled fraction of hits still runs the agent so that cached/live divergence is measured.
+
+    Args:
+        agent: The plant agent instance
+        body: Request parameters including the zone
+        message: User message, including the volatile context block
+        snapshot: Current plant inputs, None when they could not be read (the cache is then bypassed)
+        reason: Why the agent's model was chosen
+        hedge_agent: Factory of the plant agent on the other model, to hedge a slow run
+
+    Returns:
+        The plant agent output, either cached or from a live run
+    """
+    plant_agent_id = AgentType.PLANT_AGENT.value
+    cache = get_plant_decision_cache()
+    if cache is None or not body.use_cache or not cache.enabled_for(body.zone_id):
+        return await run_agent(agent, plant_agent_id, message, reason=reason, hedge_agent=hedge_agent)
+    if snapshot is None:
+        cache.bypassed += 1
+        return await run_agent(agent, plant_agent_id, message, reason=reason, hedge_agent=hedge_agent)
+
+    key = cache.key(snapshot.features(body.zone_id))
+    cached = cache.get(key)
+    if cached is not None and not cache.should_audit():
+        return cache.refresh(cached, snapshot)
+
+    stale = cache.refresh(dict(cached), snapshot) if cached is not None else None
+    content = await run_agent(agent, plant_agent_id, message, stale=stale, reason=reason, hedge_agent=hedge_agent)
+    if isinstance(content, BaseModel):
+        live = content.model_dump()
+        if cached is not None:
+            cache.record_audit(cached, live)
+        cache.put(key, live)
+    return content
+
+
+@agents_router.get("/degradations", response_model=Dict[str, int])
+async def get_degradations():
+    """
+    Returns how many answers were degraded (cached or fallback) because a stage overran its deadline.
+
+    Returns:
+        Dict[str, int]: Number of degraded answers per stage
+    """
+    return degradation_counts
+
+
+@agents_router.get("/router", response_model=Dict[str, Any])
+async def get_router_stats():
+    """
+    Returns model routing and hedging outcomes.
+
+    Returns:
+        Dict[str, Any]: Runs per route, hedges started and won by the other model, latencies and hedge delays
+    """
+    return model_router.stats()
+
+
+@agents_router.get("/llm-health", response_model=Dict[str, Dict[str, Any]])
+async def get_llm_health():
+    """
+    Returns the state of every model provider guard.
+
+    Returns:
+        Dict[str, Dict[str, Any]]: In-flight requests, retries, failures and circuit breaker state per provider
+    """
+    return provider_guards_status()
+
+
+@agents_router.get("/prompt-cache", response_model=Dict[str, Dict[str, Any]])
+async def get_prompt_cache_stats():
+    """
+    Returns per-agent prompt and cached token counts reported by the model provider.
+
+    Returns:
+        Dict[str, Dict[str, Any]]: Token counts, cache hit ratio and mean time to first token per agent
+    """
+    return prompt_cache_stats.stats()
+
+
+@agents_router.get("/analysis_intent_agent/parser", response_model=Dict[str, Any])
+async def get_intent_parser_stats():
+    """
+    Returns how many replies the local intent parser resolved and how many went to the LLM.
+
+    Returns:
+        Dict[str, Any]: Parse-path counts, parse rate and mean parse time, with `enabled` False when it is off
+    """
+    return {"enabled": intent_fast_path_enabled(), **intent_parser.stats()}
+
+
+@agents_router.get("/plant_agent/cache", response_model=Dict[str, Any])
+async def get_plant_cache_stats():
+    """
+    Returns hit/miss and divergence statistics of the plant decision cache.
+
+    Returns:
+        Dict[str, Any]: Cache statistics, with `enabled` False when the cache is off
+    """
+    cache = get_plant_decision_cache()
+    if cache is None:
+        return {"enabled": False}
+    return {"enabled": True, **cache.stats()}
 
 
 @agents_router.post("/{agent_id}/runs", status_code=status.HTTP_200_OK)
-async def create_agent_run(agent_id: AgentType, body: RunRequest):
+async def create_agent_run(agent_id: AgentType, body: RunRequest, response: Response):
     """
     Sends a message to a specific agent and returns the response.
 
+    The run is bounded by the request deadline; degraded answers carry their reasons
+    in the `X-Degraded-Reason` header.
+
     Args:
         agent_id: The ID of the agent to interact with
         body: Request parameters including the message
+        response: Response whose headers carry the degradation reasons
 
     Returns:
         Either a streaming response or the complete agent response
     """
     logger.debug(f"RunRequest: {body}")
 
+    if agent_id == AgentType.ANALYSIS_INTENT_AGENT and intent_fast_path_enabled():
+        # Simple agreements and time shifts are parsed locally; the LLM only sees the other replies
+        parsed = intent_parser.parse(body.message)
+        if parsed is not None:
+            if body.stream:
+                return StreamingResponse(iter([parsed.model_dump_json()]), media_type="text/event-stream")
+            return parsed
+
+    deadline = Deadline(request_deadline_seconds(body.deadline_seconds), agent_id.value)
+    with deadline:
+        model_id, reason, snapshot = await route_request(agent_id, body)
+
+    def create_agent(model: str) -> Agent:
+        return get_agent(model_id=model, agent_id=agent_id, user_id=body.user_id, session_id=body.session_id)
+
     try:
-        agent: Agent = get_agent(
-            model_id=body.model.value,
-            agent_id=agent_id,
-            user_id=body.user_id,
-            session_id=body.session_id,
-        )
+        agent: Agent = create_agent(model_id)
     except ValueError as e:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=str(e))
 
+    # The context block reads the sensors synchronously
+    message = await asyncio.to_thread(with_volatile_context, body.message, agent_id.value)
     if body.stream:
         return StreamingResponse(
-            chat_response_streamer(agent, body.message),
+            chat_response_streamer(agent, agent_id.value, message, deadline),
             media_type="text/event-stream",
         )
-    else:
-        response = await agent.arun(body.message, stream=False)
-        # In this case, the response.content only contains the text response from the Agent.
-        # For advanced use cases, we should yield the entire response
-        # that contains the tool calls and intermediate steps.
-        return response.content
-
-
 
+    hedge_agent = (lambda: create_agent(model_router.other(model_id))) if body.hedge else None
+    with deadline:
+        if agent_id == AgentType.PLANT_AGENT:
+            content = await run_plant_agent_cached(agent, body, message, snapshot, reason, hedge_agent)
+        else:
+            # In this case, the response.content only contains the text response from the Agent.
+            # For advanced use cases, we should yield the entire response
+            # that contains the tool calls and intermediate steps.
+            content = await run_agent(agent, agent_id.value, message, reason=reason, hedge_agent=hedge_agent)
+    if deadline.reasons:
+        # Header values must be latin-1; provider errors may not be
+        response.headers["X-Degraded-Reason"] = "; ".join(deadline.reasons).encode("ascii", "replace").decode()
+    return content
@@ -0,0 +1,72 @@
+import pytest
+
+from agents.intent_parser import IntentParser
+
+
+@pytest.mark.parametrize(
+    "message",
+    ["ok", "Đồng ý", "ừ, tưới luôn đi", "yes please", "Sounds good!", "được nhé"],
+)
+def test_agreements(message: str) -> None:
+    output = IntentParser().parse(message)
+    assert output is not None
+    assert (output.status, output.delay) == ("success", 0)
+
+
+@pytest.mark.parametrize(
+    "message, delay",
+    [
+        ("tưới sau 20 phút", 20),
+        ("water 10 minutes earlier", -10),
+        ("lùi thêm nửa tiếng", 30),
+        ("sớm hơn 15 phút nhé", -15),
+        ("in 2 hours", 120),
+        ("wait another 1.5 h", 90),
+        ("sau 2 tiếng", 120),
+        ("after 2 hours", 120),
+        ("đợi mười lăm phút", 15),
+        # Hours with a relative marker are a shift, not a time of day
+        ("sau 5 giờ nữa", 300),
+        ("sớm hơn 1 giờ", -60),
+        ("muộn hơn 2 giờ", 120),
+        ("water 1 h earlier", -60),
+        ("2 h later", 120),
+        ("in 3 h", 180),
+    ],
+)
+def test_time_shifts(message: str, delay: int) -> None:
+    output = IntentParser().parse(message)
+    assert output is not None
+    assert (output.status, output.delay) == ("adjust", delay)
+
+
+@pytest.mark.parametrize(
+    "message",
+    [
+        # Times of day
+        "tưới trước 8 giờ",
+        "water before 8 h",
+        "sau 5 giờ",
+        "after 6 h",
+        "tưới lúc 8 giờ",
+        "trước 8h30",
+        # Negations, conditions, missing or mixed directions
+        "không, đừng tưới",
+        "nếu trời mưa thì hoãn",
+        "later",
+        "20 phút",
+        "sớm 10 phút rồi sau 20 phút",
+        "",
+    ],
+)
+def test_unresolved_replies_go_to_the_llm(message: str) -> None:
+    assert IntentParser().parse(message) is None
+
+
+def test_stats() -> None:
+    parser = IntentParser()
+    for message in ("ok", "tưới sau 20 phút", "tưới trước 8 giờ"):
+        parser.parse(message)
+    stats = parser.stats()
+    assert (stats["parsed_success"], stats["parsed_adjust"], stats["sent_to_llm"]) == (1, 1, 1)
+    assert stats["parse_rate"] == pytest.approx(2 / 3)
@@ -0,0 +1,110 @@
+import asyncio
+import time
+
+import pytest
+
+from agents.deadline import Deadline, DeadlineExceeded
+from agents.llm_resilience import CircuitBreaker, CircuitOpenError, ProviderGuard
+
+
+class TransientError(Exception):
+    status_code = 503
+
+
+def open_guard(retries: int = 0) -> ProviderGuard:
+    """A guard whose breaker is open and due for a probe."""
+    guard = ProviderGuard("test", max_concurrency=1, retries=retries, timeout=10, base_delay=0)
+    for _ in range(guard.breaker.failure_threshold):
+        guard.breaker.record_failure()
+    guard.breaker.opened_at = time.monotonic() - guard.breaker.reset_timeout
+    return guard
+
+
+async def hang() -> None:
+    await asyncio.sleep(3600)
+
+
+def test_breaker_transitions() -> None:
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=30)
+    breaker.record_failure()
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == "open" and not breaker.allow()
+
+    breaker.opened_at -= 30
+    assert breaker.allow()
+    assert breaker.state == "half_open" and not breaker.allow()
+    breaker.release_probe()
+    assert breaker.state == "open" and not breaker.allow()
+
+    breaker.opened_at -= 30
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.snapshot() == {"state": "closed", "consecutive_failures": 0, "opens": 1}
+
+
+def test_transient_errors_are_retried() -> None:
+    guard = ProviderGuard("test", retries=2, timeout=10, base_delay=0)
+    outcomes = [TransientError(), "ok"]
+
+    async def run() -> str:
+        outcome = outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    assert asyncio.run(guard.call(run)) == "ok"
+    assert guard.retried == 1 and guard.breaker.state == "closed"
+
+
+def test_open_breaker_rejects_calls() -> None:
+    guard = open_guard()
+    guard.breaker.opened_at = time.monotonic()
+    with pytest.raises(CircuitOpenError):
+        asyncio.run(guard.call(hang))
+    assert guard.rejected == 1
+
+
+def test_probe_cut_by_deadline_is_released() -> None:
+    guard = open_guard()
+
+    async def main() -> None:
+        with Deadline(0.05, "test"):
+            await guard.call(hang)
+
+    with pytest.raises(DeadlineExceeded):
+        asyncio.run(main())
+    assert guard.breaker.state == "open" and not guard.breaker.allow()
+    assert guard.failures == 0 and guard.in_flight == 0
+
+
+def test_cancelled_probe_is_released() -> None:
+    guard = open_guard()
+
+    async def main() -> None:
+        task = asyncio.ensure_future(guard.call(hang))
+        await asyncio.sleep(0.01)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(main())
+    assert guard.breaker.state == "open" and not guard.breaker.allow()
+    assert guard.in_flight == 0
+
+
+def test_probe_queued_past_the_deadline_is_released() -> None:
+    guard = ProviderGuard("test", max_concurrency=1, retries=0, timeout=10)
+
+    async def main() -> None:
+        busy = asyncio.ensure_future(guard.call(hang))
+        await asyncio.sleep(0.01)
+        for _ in range(guard.breaker.failure_threshold):
+            guard.breaker.record_failure()
+        guard.breaker.opened_at -= guard.breaker.reset_timeout
+        with Deadline(0.05, "test"), pytest.raises(DeadlineExceeded):
+            await guard.call(hang)
+        busy.cancel()
+
+    asyncio.run(main())
+    assert guard.breaker.state == "open" and not guard.breaker._probing
@@ -0,0 +1,65 @@
+import asyncio
+import json
+import threading
+
+import pytest
+
+pytest.importorskip("psycopg2")
+
+from agents.model_router import ModelRouter  # noqa: E402
+
+
+def test_losing_attempt_is_observed_as_a_lower_bound() -> None:
+    router = ModelRouter(small_model="small", large_model="large", default_hedge_delay=0.05, log_path="")
+
+    async def slow() -> str:
+        await asyncio.sleep(3600)
+        return "slow"
+
+    async def fast() -> str:
+        await asyncio.sleep(0.05)
+        return "fast"
+
+    assert asyncio.run(router.run("plant_agent", "small", "routine decision", slow, fast)) == "fast"
+    assert router.hedge_wins == 1
+    assert len(router._latencies["large"]) == 1
+    # The cancelled primary ran past the hedge delay and the answer of the hedge
+    [censored] = router._latencies["small"]
+    assert censored >= 0.1
+
+
+def test_cancelled_run_is_observed() -> None:
+    router = ModelRouter(small_model="small", large_model="large", log_path="")
+
+    async def hanging() -> str:
+        await asyncio.sleep(3600)
+        return "never"
+
+    async def main() -> None:
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(router.run("plant_agent", "small", "routine decision", hanging), 0.05)
+
+    asyncio.run(main())
+    [censored] = router._latencies["small"]
+    assert censored >= 0.05
+
+
+def test_log_line_is_written_off_the_event_loop(tmp_path, monkeypatch) -> None:
+    log_path = tmp_path / "routes.jsonl"
+    router = ModelRouter(small_model="small", large_model="large", log_path=str(log_path))
+    writers = []
+    append_log = ModelRouter._append_log
+
+    def tracked(self, line: str) -> None:
+        writers.append(threading.current_thread())
+        append_log(self, line)
+
+    monkeypatch.setattr(ModelRouter, "_append_log", tracked)
+
+    async def answer() -> str:
+        return "ok"
+
+    assert asyncio.run(router.run("plant_agent", "small", "routine decision", answer)) == "ok"
+    assert writers and writers[0] is not threading.main_thread()
+    entry = json.loads(log_path.read_text(encoding="utf-8"))
+    assert entry["winner"] == "small"
@@ -0,0 +1,56 @@
+import asyncio
+import json
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("psycopg2")
+pytest.importorskip("sqlalchemy")
+
+from agents.deadline import Deadline  # noqa: E402
+from agents.llm_resilience import get_provider_guard  # noqa: E402
+from api.routes.agents import chat_response_streamer  # noqa: E402
+
+
+class HangingAgent:
+    """Agent whose run never starts streaming."""
+
+    def __init__(self, model_id: str) -> None:
+        self.model = SimpleNamespace(provider="Test", id=model_id)
+
+    async def arun(self, message: str, stream: bool = True) -> None:
+        await asyncio.sleep(3600)
+
+
+async def collect(agent: HangingAgent, deadline: Deadline) -> list:
+    return [chunk async for chunk in chat_response_streamer(agent, "test_agent", "hi", deadline)]
+
+
+def test_saturated_provider_falls_back_within_the_deadline() -> None:
+    agent = HangingAgent("saturated")
+    guard = get_provider_guard("Test:saturated")
+    guard.max_concurrency = 1
+    guard._slots = asyncio.Semaphore(1)
+
+    async def main() -> list:
+        async def hold() -> None:
+            async with guard.slot():
+                await asyncio.sleep(3600)
+
+        busy = asyncio.ensure_future(hold())
+        await asyncio.sleep(0.01)
+        try:
+            return await asyncio.wait_for(collect(agent, Deadline(0.1, "test_agent")), 5)
+        finally:
+            busy.cancel()
+
+    chunks = asyncio.run(main())
+    assert len(chunks) == 1 and "error" in json.loads(chunks[0])
+    assert guard.breaker.state == "closed"
+
+
+def test_run_that_never_starts_streaming_falls_back() -> None:
+    deadline = Deadline(0.1, "test_agent")
+    chunks = asyncio.run(asyncio.wait_for(collect(HangingAgent("hanging"), deadline), 5))
+    assert len(chunks) == 1 and "error" in json.loads(chunks[0])
+    assert deadline.reasons
@@ -0,0 +1,84 @@
+import json
+import math
+import os
+from typing import Any, Dict, List, Optional
+
+# Rough characters-per-token ratio used to budget tool output without a tokenizer
+CHARS_PER_TOKEN = 3.0
+
+
+def estimate_tokens(text: str) -> int:
+    """Estimate the number of tokens of a text."""
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def _cell(value: Any) -> str:
+    if isinstance(value, float):
+        return f"{value:.2f}"
+    if isinstance(value, dict):
+        return " ".join(f"{key}={_cell(item)}" for key, item in value.items())
+    if hasattr(value, "isoformat"):
+        return value.isoformat(timespec="minutes")
+    return " ".join(str(value).split())
+
+
+def _summary(records: List[Dict[str, Any]]) -> str:
+    """One line of min/mean/max for the numeric columns of the older records."""
+    parts = []
+    for column in records[0]:
+        values = [record[column] for record in records if isinstance(record[column], (int, float))]
+        if column == "id" or not values:
+            continue
+        parts.append(f"{column} {min(values):.2f}/{sum(values) / len(values):.2f}/{max(values):.2f}")
+    return f"{len(records)} older rows (min/mean/max): " + ", ".join(parts)
+
+
+def compact_table(records: List[Dict[str, Any]], token_budget: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Encode records as a dense pipe-separated table within a token budget.
+
+    Rows are kept newest first until the budget is reached; the remaining older
+    rows are folded into a single aggregate line.
+
+    Args:
+        records: Rows as returned by PostgreSQLDatabase.get_recent_records (newest first).
+        token_budget: Maximum tokens of the table, defaults to PLANT_CONTEXT_TOKENS.
+
+    Returns:
+        Dict with the `table` text and its estimated `tokens`.
+    """
+    token_budget = token_budget or int(os.getenv("PLANT_CONTEXT_TOKENS", "400"))
+    if not records:
+        return {"table": "", "tokens": 0}
+
+    header = "|".join(records[0].keys())
+    rows = ["|".join(_cell(value) for value in record.values()) for record in records]
+    kept = 0
+    used = estimate_tokens(header)
+    for row in rows:
+        cost = estimate_tokens(row) + 1
+        if used + cost > token_budget:
+            break
+        kept += 1
+        used += cost
+
+    table = _render(header, rows, records, kept)
+    # The aggregate line is not budgeted above, make room for it
+    while kept > 0 and estimate_tokens(table) > token_budget:
+        kept -= 1
+        table = _render(header, rows, records, kept)
+    return {"table": table, "tokens": estimate_tokens(table)}
+
+
+def _render(header: str, rows: List[str], records: List[Dict[str, Any]], kept: int) -> str:
+    lines = [header] + rows[:kept]
+    if kept < len(records):
+        lines.append(_summary(records[kept:]))
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    sample = [{"id": i, "time_full": 30 + i, "ec": 4.0 + i / 100, "reason": "EC above target"} for i in range(40, 0, -1)]
+    result = compact_table(sample, token_budget=120)
+    print(result["table"])
+    print(f"{result['tokens']} tokens vs {estimate_tokens(json.dumps(sample, indent=2))} as JSON")
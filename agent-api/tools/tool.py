@@ -5,6 +5,7 @@ from agno.tools import Toolkit
 from agno.utils.log import logger
 
 from tools.components import PostgreSQLDatabase
+from tools.context_builder import compact_table
 from tools.sensor_manager import SensorEnvironmentManager
 from tools.weather_forecast import WeatherForecast
 
@@ -54,6 +55,7 @@ class GetRecentIrrigationDataTool(Toolkit):
     ):
         super().__init__(name = "get_recent_irrigation_data")    
         self.register(self.get_recent_irrigation_data)
+        self.register(self.get_recent_irrigation_table)
         logger.info(f"GetRecentIrrigationDataTool initialized successfully.")
 
     def get_recent_irrigation_data(
@@ -84,6 +86,29 @@ class GetRecentIrrigationDataTool(Toolkit):
             logger.error(f"Error retrieving recent irrigation data: {e}")
             raise RuntimeError(f"Failed to retrieve recent irrigation data: {e}")
 
+    def get_recent_irrigation_table(
+        self,
+        table_name: str,
+        num_records: int = 20
+    ) -> str:
+        """
+        Retrieve recent irrigation cycle data as a compact table.
+        
+        Newest rows are listed one per line (columns separated by `|`) within the
+        token budget; older rows are summarized in a final min/mean/max line.
+        
+        Args:
+            table_name: The table to read.
+            num_records: The number of recent records to cover.
+
+        Returns:
+            str: The compact table.
+        """
+        records = self.get_recent_irrigation_data(table_name = table_name, num_records = num_records)
+        result = compact_table(records)
+        logger.info(f"Recent irrigation table for {table_name}: {len(records)} rows, ~{result['tokens']} tokens")
+        return result["table"]
+
 
 class GetCurrentEnviromentTool(Toolkit):
     """Tool to retrieve current environment sensors data."""
@@ -1,37 +1,51 @@
+import asyncio
+import itertools
 import os
-from typing import Dict, List
+from typing import Dict, List, Optional, Tuple
 from agno.agent import Agent
 from agno.models.openai.like import OpenAILike
 from dotenv import load_dotenv
 import json
 
+from deadline import DeadlineExceeded, degrade
+from decision_cache import DecisionCache, plan_features, shared_decision_cache
+from llm_client import CircuitOpenError, get_llm_client
+from prompt_context import PlanContextBuilder, estimate_tokens
+from surrogate_planner import SurrogatePlanner, load_surrogate_planner
+from wait_controller import WaitTimeController
+
 # Load environment variables
 load_dotenv()
 
+# Lỗi do hạn chót hoặc cầu dao: câu trả lời suy giảm có chủ đích, không phải lỗi LLM
+DEGRADED_ERRORS = (DeadlineExceeded, CircuitOpenError)
+
 # Shared LLM instance
 shared_llm = OpenAILike(
     id="gemini-1.5-flash",
     api_key=os.getenv("OPENAI_API_KEY"),
-    base_url=os.getenv("OPENAI_BASE_URL")
+    base_url=os.getenv("OPENAI_BASE_URL"),
+    timeout=float(os.getenv("LLM_TIMEOUT", "30")),
+    max_retries=0  # Thử lại do llm_client đảm nhận
 )
 
 class ReflectionAgent:
     """Agent phản tư - tạo nhận xét định tính"""
     
-    def __init__(self):
+    def __init__(self, target_ec: float = 4.0):
+        self.target_ec = target_ec
         self.agent = Agent(
             model=shared_llm,
             name="Reflection Agent",
             description="Chuyên gia nông học phân tích chu trình tưới",
         )
+        self.llm_client = get_llm_client(shared_llm.id)
     
-    def create_reflection(self, input_data: Dict, output_data: Dict) -> str:
-        """Tạo nhận xét định tính cho chu trình vừa kết thúc"""
-        
-        prompt = f"""Bạn là một chuyên gia nông học có nhiệm vụ phân tích và tạo nhận xét để ghi vào nhật ký hệ thống.
+    def _build_prompt(self, input_data: Dict, output_data: Dict) -> str:
+        return f"""Bạn là một chuyên gia nông học có nhiệm vụ phân tích và tạo nhận xét để ghi vào nhật ký hệ thống.
 
 **Mục tiêu:**
-Đánh giá chu trình tưới vừa kết thúc dựa trên mục tiêu EC=4.0. Nhận xét của bạn sẽ được Plan Agent sử dụng trong chu trình tiếp theo để ra quyết định.
+Đánh giá chu trình tưới vừa kết thúc dựa trên mục tiêu EC={self.target_ec}. Nhận xét của bạn sẽ được Plan Agent sử dụng trong chu trình tiếp theo để ra quyết định.
 
 **Dữ liệu chu trình vừa kết thúc:**
 - Thời gian chờ đã dùng: {input_data['T_chờ_phút']} phút
@@ -40,65 +54,336 @@ class ReflectionAgent:
 
 **Yêu cầu:**
 Tạo một chuỗi văn bản nhận xét ngắn gọn, súc tích và mang tính gợi ý (không quá 100 từ).
-Tập trung vào việc so sánh EC với mục tiêu 4.0 và đánh giá thời gian chờ có phù hợp không.
+Tập trung vào việc so sánh EC với mục tiêu {self.target_ec} và đánh giá thời gian chờ có phù hợp không.
 
 Chỉ trả về văn bản nhận xét, không cần giải thích thêm."""
 
+    def _fallback(self, input_data: Dict, output_data: Dict, error: Exception) -> str:
+        if isinstance(error, DEGRADED_ERRORS):
+            degrade("reflection", f"{error}, dùng nhận xét mẫu")
+        else:
+            print(f"❌ Lỗi Reflection Agent: {error}")
+        return f"EC={output_data['EC_đo_được']} so với mục tiêu {self.target_ec}. Thời gian chờ {input_data['T_chờ_phút']} phút cần được đánh giá lại."
+
+    def create_reflection(self, input_data: Dict, output_data: Dict) -> str:
+        """Tạo nhận xét định tính cho chu trình vừa kết thúc"""
+        try:
+            response = self.llm_client.call(self.agent, self._build_prompt(input_data, output_data))
+            return response.content.strip()
+        except Exception as e:
+            return self._fallback(input_data, output_data, e)
+
+    async def acreate_reflection(self, input_data: Dict, output_data: Dict) -> str:
+        """Như create_reflection nhưng không chặn event loop (agent.arun)"""
         try:
-            response = self.agent.run(prompt)
+            response = await self.llm_client.acall(self.agent, self._build_prompt(input_data, output_data))
             return response.content.strip()
         except Exception as e:
-            print(f"❌ Lỗi Reflection Agent: {e}")
-            return f"EC={output_data['EC_đo_được']} so với mục tiêu 4.0. Thời gian chờ {input_data['T_chờ_phút']} phút cần được đánh giá lại."
+            return self._fallback(input_data, output_data, e)
+
+
+class BatchReflectionAgent:
+    """
+    Phản tư gộp: nhiều chu trình (có thể của nhiều vùng) trong một lần gọi LLM
+
+    Các chu trình kết thúc trong cùng một cửa sổ ngắn được gom lại, gửi một
+    yêu cầu duy nhất trả về mảng nhận xét theo id chu trình rồi chia lại cho
+    từng vùng; phần hướng dẫn dài chỉ gửi một lần cho cả lô.
+    """
+
+    def __init__(self, window_seconds: Optional[float] = None, max_batch: Optional[int] = None):
+        """
+        window_seconds: thời gian gom chu trình trước khi gửi lô (giây thực)
+        max_batch: số chu trình tối đa mỗi lô, đủ thì gửi ngay
+        """
+        self.window_seconds = (window_seconds if window_seconds is not None
+                               else float(os.getenv("BATCH_REFLECTION_WINDOW", "2.0")))
+        self.max_batch = max_batch or int(os.getenv("BATCH_REFLECTION_MAX", "20"))
+        self.agent = Agent(
+            model=shared_llm,
+            name="Batch Reflection Agent",
+            description="Chuyên gia nông học phân tích nhiều chu trình tưới cùng lúc",
+        )
+        self.llm_client = get_llm_client(shared_llm.id)
+        self._ids = itertools.count(1)
+        # Lô đang gom và tác vụ hẹn giờ gửi, theo từng event loop
+        self._batches: Dict[asyncio.AbstractEventLoop, List[Tuple[Dict, asyncio.Future]]] = {}
+        self._flushers: Dict[asyncio.AbstractEventLoop, asyncio.Task] = {}
+        self.requests = 0
+        self.reflections = 0
+        self.fallbacks = 0
+
+    def for_zone(self, target_ec: float = 4.0) -> "ZoneReflectionAgent":
+        """Giao diện ReflectionAgent cho một vùng, dùng chung lô với các vùng khác"""
+        return ZoneReflectionAgent(self, target_ec)
+
+    def make_item(self, input_data: Dict, output_data: Dict, target_ec: float,
+                  cycle_id: Optional[str] = None) -> Dict:
+        return {
+            "id": cycle_id or f"c{next(self._ids)}",
+            "target_ec": target_ec,
+            "input_data": input_data,
+            "output_data": output_data,
+        }
+
+    def _build_prompt(self, items: List[Dict]) -> str:
+        rows = "\n".join(
+            f"{item['id']} | {item['target_ec']} | {item['input_data']['T_chờ_phút']} | "
+            f"{item['output_data']['T_đầy_giây']} | {item['output_data']['EC_đo_được']}"
+            for item in items
+        )
+        return f"""Bạn là một chuyên gia nông học có nhiệm vụ phân tích và tạo nhận xét để ghi vào nhật ký hệ thống.
+
+**Mục tiêu:**
+Đánh giá TỪNG chu trình tưới vừa kết thúc dựa trên EC mục tiêu của chính chu trình đó. Nhận xét sẽ được Plan Agent của vùng tương ứng sử dụng trong chu trình tiếp theo.
+
+**Các chu trình vừa kết thúc** (id | EC mục tiêu | T_chờ phút | T_đầy giây | EC đo được):
+{rows}
+
+**Yêu cầu:**
+Với mỗi chu trình, tạo một nhận xét ngắn gọn, súc tích và mang tính gợi ý (không quá 100 từ).
+Tập trung vào việc so sánh EC với mục tiêu và đánh giá thời gian chờ có phù hợp không.
+
+**Format trả lời phải là một JSON object:**
+{{
+  "nhận_xét": [{{"id": "<id chu trình>", "nội_dung": "<nhận xét>"}}]
+}}
+
+Chỉ trả về JSON object, không thêm text nào khác."""
+
+    @staticmethod
+    def _parse(content: str) -> Dict[str, str]:
+        result = json.loads(content.strip())
+        return {
+            str(entry["id"]): entry["nội_dung"].strip()
+            for entry in result["nhận_xét"]
+            if isinstance(entry.get("nội_dung"), str) and entry["nội_dung"].strip()
+        }
+
+    @staticmethod
+    def _fallback(item: Dict) -> str:
+        return (f"EC={item['output_data']['EC_đo_được']} so với mục tiêu {item['target_ec']}. "
+                f"Thời gian chờ {item['input_data']['T_chờ_phút']} phút cần được đánh giá lại.")
+
+    def _complete(self, items: List[Dict], results: Dict[str, str]) -> Dict[str, str]:
+        """Chu trình LLM bỏ sót dùng nhận xét fallback"""
+        self.requests += 1
+        reflections = {}
+        for item in items:
+            if item["id"] in results:
+                reflections[item["id"]] = results[item["id"]]
+                self.reflections += 1
+            else:
+                reflections[item["id"]] = self._fallback(item)
+                self.fallbacks += 1
+        return reflections
+
+    def create_batch(self, items: List[Dict]) -> Dict[str, str]:
+        """Phản tư cho một lô chu trình; Returns: {id chu trình: nhận xét}"""
+        try:
+            response = self.llm_client.call(self.agent, self._build_prompt(items))
+            results = self._parse(response.content)
+        except Exception as e:
+            print(f"❌ Lỗi Batch Reflection Agent ({len(items)} chu trình): {e}")
+            results = {}
+        return self._complete(items, results)
+
+    async def acreate_batch(self, items: List[Dict]) -> Dict[str, str]:
+        """Như create_batch nhưng không chặn event loop (agent.arun)"""
+        try:
+            response = await self.llm_client.acall(self.agent, self._build_prompt(items))
+            results = self._parse(response.content)
+        except Exception as e:
+            print(f"❌ Lỗi Batch Reflection Agent ({len(items)} chu trình): {e}")
+            results = {}
+        return self._complete(items, results)
+
+    # ---------- Gom lô theo cửa sổ thời gian ----------
+
+    async def areflect(self, input_data: Dict, output_data: Dict, target_ec: float,
+                       cycle_id: Optional[str] = None) -> str:
+        """Đưa một chu trình vào lô đang gom và chờ nhận xét của nó"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        batch = self._batches.setdefault(loop, [])
+        batch.append((self.make_item(input_data, output_data, target_ec, cycle_id), future))
+        if len(batch) >= self.max_batch:
+            self._dispatch(loop)
+        elif loop not in self._flushers:
+            self._flushers[loop] = loop.create_task(self._dispatch_after_window(loop))
+        return await future
+
+    async def _dispatch_after_window(self, loop: asyncio.AbstractEventLoop):
+        await asyncio.sleep(self.window_seconds)
+        self._dispatch(loop)
+
+    def _dispatch(self, loop: asyncio.AbstractEventLoop):
+        flusher = self._flushers.pop(loop, None)
+        if flusher is not None and flusher is not asyncio.current_task():
+            flusher.cancel()
+        batch = self._batches.pop(loop, [])
+        if batch:
+            loop.create_task(self._send(batch))
+
+    async def _send(self, batch: List[Tuple[Dict, asyncio.Future]]):
+        reflections = await self.acreate_batch([item for item, _ in batch])
+        for item, future in batch:
+            if not future.done():
+                future.set_result(reflections[item["id"]])
+
+    # ---------- Bổ sung phản tư cho lịch sử ----------
+
+    def backfill(self, database, output_path: str, overwrite: bool = False) -> int:
+        """
+        Tạo phản tư cho các bản ghi vận hành chưa có nhận xét (hoặc tất cả nếu
+        overwrite) theo từng lô, ghi toàn bộ lịch sử ra nhật ký JSONL mới
+        EC mục tiêu lấy từ database.target_ec nếu có, mặc định 4.0
+        Returns: số bản ghi đã được bổ sung phản tư
+        """
+        target_ec = getattr(database, "target_ec", 4.0)
+        filled = 0
+        buffered: List[Dict] = []  # giữ nguyên thứ tự bản ghi trong lúc chờ lô
+        missing: Dict[str, Dict] = {}
+
+        tmp_path = output_path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            def flush():
+                nonlocal filled
+                if missing:
+                    items = [self.make_item(record["input_data"], record["output_data"], target_ec, cycle_id)
+                             for cycle_id, record in missing.items()]
+                    for cycle_id, reflection in self.create_batch(items).items():
+                        missing[cycle_id]["reflection_text"] = reflection
+                    filled += len(missing)
+                    missing.clear()
+                for record in buffered:
+                    f.write(json.dumps(record, ensure_ascii=False) + "\n")
+                buffered.clear()
+
+            for record in database.iter_records():
+                buffered.append(record)
+                if record["phase"] != "calibration" and (overwrite or not record["reflection_text"]):
+                    missing[f"r{record['id']}"] = record
+                    if len(missing) >= self.max_batch:
+                        flush()
+                elif not missing:
+                    flush()
+            flush()
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, output_path)
+
+        print(f"📝 Đã bổ sung phản tư cho {filled} bản ghi, ghi ra {output_path}")
+        return filled
+
+    def stats(self) -> Dict:
+        total = self.reflections + self.fallbacks
+        return {
+            "requests": self.requests,
+            "reflections": self.reflections,
+            "fallbacks": self.fallbacks,
+            "cycles_per_request": total / self.requests if self.requests else 0.0,
+        }
+
+
+class ZoneReflectionAgent:
+    """Giao diện ReflectionAgent của một vùng, gửi qua BatchReflectionAgent dùng chung"""
+
+    def __init__(self, batcher: BatchReflectionAgent, target_ec: float = 4.0):
+        self.batcher = batcher
+        self.target_ec = target_ec
+
+    def create_reflection(self, input_data: Dict, output_data: Dict) -> str:
+        item = self.batcher.make_item(input_data, output_data, self.target_ec)
+        return self.batcher.create_batch([item])[item["id"]]
+
+    async def acreate_reflection(self, input_data: Dict, output_data: Dict) -> str:
+        return await self.batcher.areflect(input_data, output_data, self.target_ec)
+
+
+_shared_batch_reflection_agent: Optional[BatchReflectionAgent] = None
+
+
+def shared_batch_reflection_agent() -> BatchReflectionAgent:
+    """Lô phản tư dùng chung cho mọi vùng trong tiến trình"""
+    global _shared_batch_reflection_agent
+    if _shared_batch_reflection_agent is None:
+        _shared_batch_reflection_agent = BatchReflectionAgent()
+    return _shared_batch_reflection_agent
+
 
 class PlanAgent:
     """Agent lập kế hoạch - quyết định thời gian chờ tiếp theo"""
     
-    def __init__(self):
+    def __init__(self,
+                 target_ec: float = 4.0,
+                 fast_path: Optional[WaitTimeController] = None,
+                 decision_cache: Optional[DecisionCache] = None,
+                 use_cache: Optional[bool] = None,
+                 context_builder: Optional[PlanContextBuilder] = None,
+                 surrogate: Optional[SurrogatePlanner] = None,
+                 surrogate_mode: Optional[str] = None):
+        """
+        fast_path: bộ điều khiển số quyết định trước, chỉ gọi LLM khi nó từ chối;
+        mặc định tắt, bật bằng FAST_PATH_PLANNER=1
+        decision_cache, use_cache: bộ nhớ đệm quyết định LLM (mặc định dùng chung
+        giữa các vùng) và công tắc riêng của vùng này (mặc định theo DECISION_CACHE)
+        context_builder: dựng lịch sử/nhận xét trong ngân sách token (PLAN_CONTEXT_TOKENS)
+        surrogate, surrogate_mode: mô hình thay thế học từ lịch sử (SURROGATE_PLANNER):
+        "primary" quyết định trước cả fast path, "check" kiểm tra quyết định LLM, "off" tắt
+        """
+        self.target_ec = target_ec
+        if fast_path is None and os.getenv("FAST_PATH_PLANNER", "0") == "1":
+            fast_path = WaitTimeController(target_ec)
+        self.fast_path = fast_path
+        self.use_cache = (use_cache if use_cache is not None
+                          else os.getenv("DECISION_CACHE", "0") == "1")
+        self.decision_cache = decision_cache or (shared_decision_cache() if self.use_cache else None)
+        self.context_builder = context_builder or PlanContextBuilder()
+        self.surrogate_mode = surrogate_mode or os.getenv("SURROGATE_PLANNER", "off")
+        if surrogate is None and self.surrogate_mode != "off":
+            surrogate = load_surrogate_planner(target_ec)
+        self.surrogate = surrogate
+        self.prompts = 0
+        self.prompt_tokens = 0
         self.agent = Agent(
             model=shared_llm,
             name="Plan Agent",
             description="Chuyên gia điều khiển hệ thống tưới thông minh",
         )
+        self.llm_client = get_llm_client(shared_llm.id)
     
-    def decide_next_wait_time(self, 
-                            last_reflection: str,
-                            history: List[Dict], 
-                            current_env: Dict,
-                            forecast: str) -> Dict:
-        """Quyết định thời gian chờ tiếp theo"""
-        
-        # Chuẩn bị dữ liệu lịch sử
-        history_summary = []
-        for record in history[-5:]:  # Chỉ lấy 5 bản ghi gần nhất
-            history_summary.append({
-                "T_chờ_phút": record["input_data"]["T_chờ_phút"],
-                "EC_đo_được": record["output_data"]["EC_đo_được"],
-                "reflection": record["reflection_text"][:50] + "..." if record["reflection_text"] else ""
-            })
-        
+    def _build_prompt(self,
+                      last_reflection: str,
+                      history: List[Dict],
+                      current_env: Dict,
+                      forecast: str) -> str:
+        context = self.context_builder.build(last_reflection, history, current_env, self.target_ec)
         prompt = f"""Bạn là một chuyên gia điều khiển hệ thống tưới thông minh, có khả năng kết hợp phân tích dữ liệu định lượng và nhận định định tính để ra quyết định tối ưu.
 
 **Mục tiêu chính:**
-Điều chỉnh khoảng thời gian chờ (T_chờ) để đưa giá trị EC về gần mức mục tiêu là 4.0.
+Điều chỉnh khoảng thời gian chờ (T_chờ) để đưa giá trị EC về gần mức mục tiêu là {self.target_ec}.
 
 **Dữ liệu cung cấp:**
 
 1. **Nhận xét từ chu trình gần nhất:**
 {last_reflection}
 
-2. **Lịch sử vận hành gần đây:**
-{json.dumps(history_summary, ensure_ascii=False, indent=2)}
+2. **Lịch sử vận hành gần đây** (sai_số = EC - {self.target_ec}):
+{context.history}
 
-3. **Dữ liệu môi trường hiện tại:**
-{json.dumps(current_env, ensure_ascii=False, indent=2)}
+3. **Nhận xét đáng chú ý của các chu trình trước:**
+{context.reflections}
 
-4. **Dự báo thời tiết:**
+4. **Dữ liệu môi trường hiện tại:**
+{context.environment}
+
+5. **Dự báo thời tiết:**
 {forecast}
 
 **Quy tắc quan trọng:**
-- EC cao (>4.0): Cần giảm thời gian chờ để tưới sớm hơn
-- EC thấp (<4.0): Cần tăng thời gian chờ để nước bay hơi nhiều hơn  
+- EC cao (>{self.target_ec}): Cần giảm thời gian chờ để tưới sớm hơn
+- EC thấp (<{self.target_ec}): Cần tăng thời gian chờ để nước bay hơi nhiều hơn  
 - Thời gian chờ nên trong khoảng 60-300 phút
 - Thay đổi từng bước, không nhảy vọt quá lớn
 
@@ -112,37 +397,135 @@ Dựa trên cả nhận xét định tính và dữ liệu định lượng, hã
 }}
 
 Chỉ trả về JSON object, không thêm text nào khác."""
+        tokens = estimate_tokens(prompt)
+        self.prompts += 1
+        self.prompt_tokens += tokens
+        print(f"🧮 Prompt Plan Agent ≈ {tokens} token (dữ liệu {context.tokens}/{self.context_builder.token_budget})")
+        return prompt
+
+    def prompt_stats(self) -> Dict:
+        return {
+            "prompts": self.prompts,
+            "prompt_tokens": self.prompt_tokens,
+            "mean_prompt_tokens": self.prompt_tokens / self.prompts if self.prompts else 0.0,
+        }
+
+    @staticmethod
+    def _parse(content: str) -> Dict:
+        result = json.loads(content.strip())
+
+        # Validate kết quả
+        if not isinstance(result.get("T_chờ_đề_xuất"), (int, float)):
+            raise ValueError("T_chờ_đề_xuất không hợp lệ")
+
+        # Đảm bảo thời gian chờ trong khoảng hợp lý
+        wait_time = max(60, min(300, int(result["T_chờ_đề_xuất"])))
+        result["T_chờ_đề_xuất"] = wait_time
+        return result
+
+    def _fallback(self, history: List[Dict], current_env: Dict, error: Exception,
+                  cached: Optional[Dict] = None) -> Dict:
+        """Câu trả lời tốt nhất khi LLM lỗi/vượt hạn: quyết định đệm, rồi bước PI"""
+        if isinstance(error, DEGRADED_ERRORS):
+            degrade("plan", f"{error}, dùng {'quyết định đệm' if cached is not None else 'fallback PI'}")
+        else:
+            print(f"❌ Lỗi Plan Agent: {error}")
+        if cached is not None:
+            cached["lý_do"] = f"{cached['lý_do']} (bộ nhớ đệm)"
+            return cached
+        # Fallback tất định: một bước PI từ chu trình cuối
+        if history:
+            decision = (self.fast_path or WaitTimeController(self.target_ec)).step(history, current_env)
+            decision["lý_do"] = f"{decision['lý_do']} (fallback do lỗi LLM)"
+            return decision
+        return {
+            "T_chờ_đề_xuất": 120,
+            "lý_do": "Sử dụng logic fallback do lỗi LLM"
+        }
+
+    def _fast_decision(self, history: List[Dict], current_env: Dict, forecast: str) -> Optional[Dict]:
+        """Quyết định của mô hình thay thế hoặc bộ điều khiển số, None nếu cần chuyển lên LLM"""
+        if self.surrogate is not None and self.surrogate_mode == "primary":
+            decision, reason = self.surrogate.decide(history, current_env)
+            if decision is not None:
+                return decision
+            print(f"🔼 Mô hình thay thế chuyển tiếp: {reason}")
+        if self.fast_path is None:
+            return None
+        decision, reason = self.fast_path.decide(history, current_env, forecast)
+        if decision is None:
+            print(f"🔼 Chuyển Plan Agent lên LLM: {reason}")
+        return decision
+
+    def _lookup_cache(self, history: List[Dict], current_env: Dict, forecast: str) -> Tuple[Optional[str], Optional[Dict]]:
+        """(khóa, quyết định đệm) cho đầu vào đã lượng tử hóa; (None, None) nếu vùng tắt bộ nhớ đệm"""
+        if not self.use_cache or self.decision_cache is None:
+            return None, None
+        key = DecisionCache.key(plan_features(history, current_env, forecast, self.target_ec))
+        return key, self.decision_cache.get(key)
 
+    def _checked(self, decision: Dict, history: List[Dict], current_env: Dict) -> Dict:
+        """Quyết định LLM sau khi mô hình thay thế kiểm tra (nếu có)"""
+        if self.surrogate is None:
+            return decision
+        return self.surrogate.check(decision, history, current_env)
+
+    def _remember(self, key: Optional[str], cached: Optional[Dict], decision: Dict):
+        if key is None:
+            return
+        if cached is not None:
+            self.decision_cache.record_audit(cached, decision)
+        self.decision_cache.put(key, decision)
+
+    def _serve_cached(self, cached: Optional[Dict]) -> Optional[Dict]:
+        """Trả quyết định đệm, trừ các lần được chọn để đối chiếu với LLM"""
+        if cached is None or self.decision_cache.should_audit():
+            return None
+        cached["lý_do"] = f"{cached['lý_do']} (bộ nhớ đệm)"
+        return cached
+
+    def decide_next_wait_time(self,
+                            last_reflection: str,
+                            history: List[Dict],
+                            current_env: Dict,
+                            forecast: str) -> Dict:
+        """Quyết định thời gian chờ tiếp theo"""
+        decision = self._fast_decision(history, current_env, forecast)
+        if decision is not None:
+            return decision
+        key, cached = self._lookup_cache(history, current_env, forecast)
+        decision = self._serve_cached(cached)
+        if decision is not None:
+            return decision
+        prompt = self._build_prompt(last_reflection, history, current_env, forecast)
         try:
-            response = self.agent.run(prompt)
-            # Parse JSON response
-            result = json.loads(response.content.strip())
-            
-            # Validate kết quả
-            if not isinstance(result.get("T_chờ_đề_xuất"), (int, float)):
-                raise ValueError("T_chờ_đề_xuất không hợp lệ")
-                
-            # Đảm bảo thời gian chờ trong khoảng hợp lý
-            wait_time = max(60, min(300, int(result["T_chờ_đề_xuất"])))
-            result["T_chờ_đề_xuất"] = wait_time
-            
-            return result
-            
+            response = self.llm_client.call(self.agent, prompt)
+            decision = self._parse(response.content)
         except Exception as e:
-            print(f"❌ Lỗi Plan Agent: {e}")
-            # Fallback strategy
-            if history:
-                last_ec = history[-1]["output_data"]["EC_đo_được"]
-                last_wait = history[-1]["input_data"]["T_chờ_phút"]
-                
-                if last_ec > 4.0:
-                    new_wait = max(60, last_wait - 30)
-                else:
-                    new_wait = min(300, last_wait + 30)
-            else:
-                new_wait = 120
-                
-            return {
-                "T_chờ_đề_xuất": new_wait,
-                "lý_do": "Sử dụng logic fallback do lỗi LLM"
-            }
+            return self._fallback(history, current_env, e, cached)
+        decision = self._checked(decision, history, current_env)
+        self._remember(key, cached, decision)
+        return decision
+
+    async def adecide_next_wait_time(self,
+                                     last_reflection: str,
+                                     history: List[Dict],
+                                     current_env: Dict,
+                                     forecast: str) -> Dict:
+        """Như decide_next_wait_time nhưng không chặn event loop (agent.arun)"""
+        decision = self._fast_decision(history, current_env, forecast)
+        if decision is not None:
+            return decision
+        key, cached = self._lookup_cache(history, current_env, forecast)
+        decision = self._serve_cached(cached)
+        if decision is not None:
+            return decision
+        prompt = self._build_prompt(last_reflection, history, current_env, forecast)
+        try:
+            response = await self.llm_client.acall(self.agent, prompt)
+            decision = self._parse(response.content)
+        except Exception as e:
+            return self._fallback(history, current_env, e, cached)
+        decision = self._checked(decision, history, current_env)
+        self._remember(key, cached, decision)
+        return decision
@@ -0,0 +1,140 @@
+"""
+Đồng hồ dùng chung cho hệ thống tưới: mọi lệnh chờ và timestamp đều đi qua đây
+- RealClock: thời gian thực
+- AcceleratedClock: thời gian trôi nhanh gấp `speed` lần
+- SimulatedClock: sự kiện rời rạc, sleep() nhảy tức thì tới thời điểm đích
+"""
+
+import asyncio
+import heapq
+import os
+import time
+from datetime import datetime, timedelta
+from typing import List, Optional, Tuple
+
+
+class RealClock:
+    """Đồng hồ thời gian thực"""
+
+    def now(self) -> datetime:
+        return datetime.now()
+
+    def time(self) -> float:
+        return time.time()
+
+    def sleep(self, seconds: float):
+        time.sleep(max(seconds, 0))
+
+    async def asleep(self, seconds: float):
+        await asyncio.sleep(max(seconds, 0))
+
+
+class AcceleratedClock(RealClock):
+    """Thời gian mô phỏng trôi nhanh gấp `speed` lần thời gian thực"""
+
+    def __init__(self, speed: float = 60.0, start: Optional[datetime] = None):
+        self.speed = speed
+        self._start = start or datetime.now()
+        self._started = time.monotonic()
+
+    def now(self) -> datetime:
+        elapsed = (time.monotonic() - self._started) * self.speed
+        return self._start + timedelta(seconds=elapsed)
+
+    def time(self) -> float:
+        return self.now().timestamp()
+
+    def sleep(self, seconds: float):
+        time.sleep(max(seconds, 0) / self.speed)
+
+    async def asleep(self, seconds: float):
+        await asyncio.sleep(max(seconds, 0) / self.speed)
+
+
+class SimulatedClock(RealClock):
+    """
+    Đồng hồ sự kiện rời rạc: sleep() chỉ cộng thời gian, không chờ thật
+
+    Khi được một bộ lập lịch điều khiển (set_driven), asleep() không tự nhảy
+    thời gian mà xếp hàng chờ; bộ lập lịch gọi advance_to() khi mọi tác vụ
+    đều đang chờ đồng hồ, nhờ vậy nhiều vùng chạy song song vẫn đúng thời điểm
+    """
+
+    def __init__(self, start: Optional[datetime] = None):
+        self._now = start or datetime.now()
+        self._driven = False
+        self._waiters: List[Tuple[datetime, int, asyncio.Future]] = []
+        self._sequence = 0
+        self._waiter_added = asyncio.Event()
+
+    def now(self) -> datetime:
+        return self._now
+
+    def time(self) -> float:
+        return self._now.timestamp()
+
+    def sleep(self, seconds: float):
+        self.advance(seconds)
+
+    async def asleep(self, seconds: float):
+        if not self._driven or seconds <= 0:
+            self.advance(seconds)
+            await asyncio.sleep(0)  # Nhường event loop cho các tác vụ khác
+            return
+        future = asyncio.get_running_loop().create_future()
+        wake = self._now + timedelta(seconds=seconds)
+        heapq.heappush(self._waiters, (wake, self._sequence, future))
+        self._sequence += 1
+        self._waiter_added.set()
+        await future
+
+    def advance(self, seconds: float):
+        self._now += timedelta(seconds=max(seconds, 0))
+
+    # ---------- Điều khiển bởi bộ lập lịch ----------
+
+    def set_driven(self, driven: bool):
+        self._driven = driven
+        if not driven:
+            # Trả lại các tác vụ còn chờ theo đúng thứ tự thời điểm
+            while self._waiters:
+                self.advance_to(self._waiters[0][0])
+
+    @property
+    def waiting(self) -> int:
+        """Số tác vụ đang chờ đồng hồ"""
+        return sum(1 for _, _, future in self._waiters if not future.done())
+
+    def next_wakeup(self) -> Optional[datetime]:
+        while self._waiters and self._waiters[0][2].done():
+            heapq.heappop(self._waiters)
+        return self._waiters[0][0] if self._waiters else None
+
+    async def wait_for_waiter(self):
+        """Chờ đến khi có tác vụ mới bắt đầu chờ đồng hồ"""
+        self._waiter_added.clear()
+        await self._waiter_added.wait()
+
+    def advance_to(self, moment: datetime):
+        """Nhảy tới `moment` (không lùi) và đánh thức mọi tác vụ đến hạn"""
+        self._now = max(self._now, moment)
+        while self._waiters and self._waiters[0][0] <= self._now:
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                future.set_result(None)
+
+
+def create_clock(mode: Optional[str] = None, speed: Optional[float] = None) -> RealClock:
+    """
+    Tạo đồng hồ theo cấu hình CLOCK_MODE (real | accelerated | simulated), mặc định
+    thời gian thực: đồng hồ tăng tốc ghi timestamp ở tương lai, chỉ dùng khi
+    người gọi chủ động chọn (mô phỏng, demo)
+    """
+    mode = mode or os.getenv("CLOCK_MODE") or "real"
+    if mode == "real":
+        return RealClock()
+    if mode == "accelerated":
+        return AcceleratedClock(speed or float(os.getenv("CLOCK_SPEED", "2400")))
+    if mode == "simulated":
+        return SimulatedClock()
+    raise ValueError(f"Chế độ đồng hồ không hợp lệ: {mode}")
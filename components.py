@@ -1,30 +1,67 @@
+import asyncio
+import bisect
 import json
-import time
-from datetime import datetime
-from typing import Dict, List, Optional
+import os
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
 from dataclasses import dataclass, asdict
 import random
+import sqlite3
+import threading
 
-@dataclass
+import record_codec
+from clock import RealClock
+from cycle_aggregates import CycleAggregates
+from history_columns import ColumnarHistory, HistoryWindow
+from history_segments import SegmentStore
+
+# File mặc định cho từng chế độ lưu trữ lịch sử
+STORAGE_FILES = {
+    "json": "irrigation_history.json",
+    "jsonl": "irrigation_history.jsonl",
+    "segmented": "irrigation_history_segments",  # thư mục phân đoạn
+    "binary": "irrigation_history.bin",          # xem record_codec
+}
+
+# File mặc định cho chế độ SQLite (SQLiteDatabase)
+SQLITE_FILE = "irrigation_history.db"
+
+# Hậu tố file thống kê tích lũy lưu cạnh lịch sử
+AGGREGATES_SUFFIX = ".agg.json"
+
+# Kích thước khối khi đọc ngược từ cuối nhật ký
+TAIL_BLOCK_SIZE = 64 * 1024
+
+@dataclass(slots=True)
 class EnvironmentData:
     """Dữ liệu môi trường"""
     nhiệt_độ: float
     độ_ẩm: float
     et0: float
 
-@dataclass
+@dataclass(slots=True)
 class InputData:
     """Dữ liệu đầu vào của chu trình"""
     T_chờ_phút: int
     môi_trường_tb: EnvironmentData
 
-@dataclass
+@dataclass(slots=True)
 class OutputData:
     """Kết quả đo được của chu trình"""
     T_đầy_giây: int
     EC_đo_được: float
 
-@dataclass
+@dataclass(slots=True)
+class CyclePlan:
+    """Quyết định của một chu trình trước khi chờ: tách lập kế hoạch khỏi tưới/lưu trữ"""
+    phase: str
+    T_chờ_phút: int
+    lý_do: str
+    môi_trường: EnvironmentData
+    dự_báo: str = ""
+    suy_giảm: str = ""  # lý do suy giảm khi có bước vượt hạn chót, rỗng nếu không
+
+@dataclass(slots=True)
 class CycleRecord:
     """Bản ghi hoàn chỉnh của một chu trình tưới"""
     id: int
@@ -44,12 +81,46 @@ class CycleRecord:
             "output_data": asdict(self.output_data),
             "reflection_text": self.reflection_text
         }
+        
+    @classmethod
+    def from_dict(cls, data: Dict) -> "CycleRecord":
+        """Dựng lại bản ghi từ dictionary đã lưu"""
+        input_data = data["input_data"]
+        return cls(
+            id=data["id"],
+            timestamp=data["timestamp"],
+            phase=data["phase"],
+            input_data=InputData(
+                T_chờ_phút=input_data["T_chờ_phút"],
+                môi_trường_tb=EnvironmentData(**input_data["môi_trường_tb"])
+            ),
+            output_data=OutputData(**data["output_data"]),
+            reflection_text=data.get("reflection_text", "")
+        )
+
+def parse_timestamp(timestamp: Optional[str]) -> Optional[float]:
+    """Phân tích timestamp ISO của bản ghi thành epoch giây, None nếu không hợp lệ"""
+    try:
+        return datetime.fromisoformat(timestamp).timestamp()
+    except (TypeError, ValueError):
+        return None
 
 class Controller:
     """Bộ điều khiển thiết bị tưới (mô phỏng)"""
     
-    def __init__(self):
+    def __init__(self, clock=None):
+        """clock: đồng hồ dùng để chờ trong lúc tưới (mặc định thời gian thực)"""
         self.tank_capacity = 100  # Dung tích bình chứa
+        self.clock = clock or RealClock()
+        
+    def _measure(self) -> tuple[int, float]:
+        """Mô phỏng thời gian tưới và EC đo được"""
+        # Mô phỏng thời gian tưới (30-60 giây)
+        T_đầy = random.randint(30, 60)
+        
+        # Mô phỏng đo EC (3.5-4.5)
+        EC = round(random.uniform(3.5, 4.5), 1)
+        return T_đầy, EC
         
     def tưới_cho_đến_khi_đầy(self) -> tuple[int, float]:
         """
@@ -57,49 +128,390 @@ class Controller:
         Returns: (T_đầy_giây, EC_đo_được)
         """
         print("🚿 Bắt đầu tưới...")
+        T_đầy, EC = self._measure()
         
-        # Mô phỏng thời gian tưới (30-60 giây)
-        T_đầy = random.randint(30, 60)
+        # Mô phỏng quá trình tưới
+        self.clock.sleep(T_đầy)  # Chờ đúng thời gian tưới theo đồng hồ
         
-        # Mô phỏng đo EC (3.5-5.5)
-        EC = round(random.uniform(3.5, 4.5), 0.5)
+        print(f"✅ Tưới hoàn thành! Thời gian: {T_đầy}s, EC: {EC}")
+        return T_đầy, EC
         
-        # Mô phỏng quá trình tưới
-        time.sleep(2)  # Mô phỏng thời gian thực tế
+    async def atưới_cho_đến_khi_đầy(self) -> tuple[int, float]:
+        """Như tưới_cho_đến_khi_đầy nhưng chờ bằng asyncio, không chặn event loop"""
+        print("🚿 Bắt đầu tưới...")
+        T_đầy, EC = self._measure()
+        await self.clock.asleep(T_đầy)
         
         print(f"✅ Tưới hoàn thành! Thời gian: {T_đầy}s, EC: {EC}")
         return T_đầy, EC
 
+
+async def await_device(device, method: str, *args):
+    """
+    Gọi thiết bị từ event loop: dùng phiên bản async `a<method>` nếu có,
+    ngược lại chạy phương thức đồng bộ trong thread để không chặn loop
+    """
+    async_method = getattr(device, "a" + method, None)
+    if async_method is not None:
+        return await async_method(*args)
+    return await asyncio.to_thread(getattr(device, method), *args)
+
 class Database:
     """Cơ sở dữ liệu lưu trữ lịch sử"""
     
-    def __init__(self, file_path: str = "irrigation_history.json"):
-        self.file_path = file_path
+    def __init__(self, 
+                 file_path: Optional[str] = None,
+                 storage: Optional[str] = None,
+                 fsync_every: Optional[int] = None,
+                 hot_window: Optional[int] = None,
+                 segment_options: Optional[Dict] = None,
+                 target_ec: float = 4.0,
+                 aggregates_every: Optional[int] = None):
+        """
+        storage: "json" (ghi lại toàn bộ file mỗi lần lưu),
+                 "jsonl" (nhật ký chỉ ghi thêm, mỗi dòng một bản ghi),
+                 "segmented" (thư mục các file JSONL theo ngày/dung lượng) hoặc
+                 "binary" (nhật ký nhị phân gọn, xem record_codec)
+        fsync_every: số bản ghi giữa hai lần fsync ở chế độ jsonl/segmented/binary
+                     (1 = mỗi bản ghi, 0 = để hệ điều hành tự flush)
+        hot_window: số bản ghi gần nhất giữ trong bộ nhớ ở chế độ jsonl/segmented
+                    (0 = giữ toàn bộ); phần cũ hơn được đọc từ đĩa khi cần
+        segment_options: tham số cho SegmentStore (segment_by, retention_days, ...)
+        target_ec: EC mục tiêu của vùng sở hữu lịch sử, cho thống kê tích lũy
+        aggregates_every: số bản ghi giữa hai lần ghi file thống kê tích lũy (ngoài
+                          sync/close); file cũ hơn lịch sử sẽ được dựng lại khi mở
+        """
+        self.storage = storage or os.getenv("HISTORY_STORAGE", "json")
+        if self.storage not in STORAGE_FILES:
+            raise ValueError(f"Chế độ lưu trữ không hợp lệ: {self.storage}")
+        self.file_path = file_path or STORAGE_FILES[self.storage]
+        self.fsync_every = (fsync_every if fsync_every is not None
+                            else int(os.getenv("HISTORY_FSYNC_EVERY", "1")))
+        self.hot_window = (hot_window if hot_window is not None
+                           else int(os.getenv("HISTORY_HOT_WINDOW", "0")))
+        if self.hot_window and self.storage in ("json", "binary"):
+            raise ValueError(f"hot_window không hỗ trợ chế độ lưu trữ {self.storage}")
+        self._segments: Optional[SegmentStore] = None
+        if self.storage == "segmented":
+            options = {
+                "segment_by": os.getenv("HISTORY_SEGMENT_BY", "day"),
+                "retention_days": int(os.getenv("HISTORY_RETENTION_DAYS", "0")),
+                "retention_action": os.getenv("HISTORY_RETENTION_ACTION", "archive"),
+                "fsync_every": self.fsync_every,
+            }
+            options.update(segment_options or {})
+            self._segments = SegmentStore(self.file_path, **options)
+        self._journal = None
+        self._unsynced = 0
+        self._cold_end_offset = 0
+        self._cold_count: Optional[int] = None
+        self._evicted = 0
         self.data: List[Dict] = self._load_data()
         
+        # Chỉ mục thời gian: epoch đã sắp xếp và vị trí tương ứng trong self.data,
+        # cùng kho cột NumPy cho phân tích
+        self._index_times: List[float] = []
+        self._index_positions: List[int] = []
+        self._build_time_index()
+        self.target_ec = target_ec
+        self.aggregates_every = (aggregates_every if aggregates_every is not None
+                                 else int(os.getenv("HISTORY_AGGREGATES_EVERY", "100")))
+        self._unsaved_aggregates = 0
+        self.aggregates = CycleAggregates.load_or_rebuild(self.file_path + AGGREGATES_SUFFIX, self, target_ec)
+        
     def _load_data(self) -> List[Dict]:
         """Tải dữ liệu từ file JSON"""
+        if self._segments is not None:
+            return self._segments.load_tail(self.hot_window)
+        if self.storage == "jsonl":
+            return self._load_journal()
+        if self.storage == "binary":
+            return self._load_binary()
         try:
             with open(self.file_path, 'r', encoding='utf-8') as f:
                 return json.load(f)
         except FileNotFoundError:
             return []
             
+    def _load_journal(self) -> List[Dict]:
+        """Tải nhật ký JSONL, bỏ dòng cuối bị ghi dở nếu có"""
+        try:
+            if self.hot_window:
+                # +1 dòng dự phòng cho trường hợp dòng cuối bị ghi dở
+                start, lines = self._read_tail_lines(self.hot_window + 1)
+            else:
+                with open(self.file_path, 'rb') as f:
+                    start, lines = 0, f.readlines()
+        except FileNotFoundError:
+            return []
+            
+        records = []
+        offsets = []
+        good_offset = start
+        for number, line in enumerate(lines):
+            if line.strip():
+                try:
+                    records.append(json.loads(line))
+                    offsets.append(good_offset)
+                except json.JSONDecodeError:
+                    # Chỉ dòng cuối mới có thể bị ghi dở khi mất điện
+                    if number < len(lines) - 1:
+                        raise
+                    print(f"⚠️ Bỏ qua dòng cuối bị hỏng trong {self.file_path}")
+                    break
+            good_offset += len(line)
+            
+        if good_offset < os.path.getsize(self.file_path):
+            with open(self.file_path, 'r+b') as f:
+                f.truncate(good_offset)
+                
+        if self.hot_window and len(records) > self.hot_window:
+            records = records[-self.hot_window:]
+            offsets = offsets[-self.hot_window:]
+        self._cold_end_offset = offsets[0] if offsets else good_offset
+        return records
+        
+    def _load_binary(self) -> List[Dict]:
+        """
+        Tải file nhị phân, cắt bỏ khung cuối bị ghi dở nếu có
+        Raises: ValueError nếu có khung hỏng giữa file (không cắt để giữ các bản ghi phía sau)
+        """
+        try:
+            with open(self.file_path, 'rb') as f:
+                content = f.read()
+        except FileNotFoundError:
+            return []
+            
+        records = []
+        header_size = len(record_codec.file_header())
+        good_offset = header_size if len(content) >= header_size else 0
+        for good_offset, record in record_codec.iter_frames(content):
+            records.append(record)
+        if good_offset < len(content):
+            print(f"⚠️ Bỏ qua bản ghi cuối bị hỏng trong {self.file_path}")
+            with open(self.file_path, 'r+b') as f:
+                f.truncate(good_offset)
+        return records
+        
+    def _read_tail_lines(self, n: int) -> Tuple[int, List[bytes]]:
+        """
+        Đọc ngược từ cuối file đến khi đủ n dòng, không chạm vào phần dữ liệu cũ
+        Returns: (offset byte của dòng đầu tiên, các dòng)
+        """
+        with open(self.file_path, 'rb') as f:
+            f.seek(0, os.SEEK_END)
+            position = f.tell()
+            chunk = b""
+            while position > 0 and chunk.count(b"\n") <= n:
+                step = min(TAIL_BLOCK_SIZE, position)
+                position -= step
+                f.seek(position)
+                chunk = f.read(step) + chunk
+                
+        lines = chunk.splitlines(keepends=True)
+        if position > 0 and lines:
+            # Dòng đầu tiên của khối có thể chỉ là phần đuôi của một dòng cũ
+            position += len(lines[0])
+            lines = lines[1:]
+        while len(lines) > n:
+            position += len(lines[0])
+            lines = lines[1:]
+        return position, lines
+        
+    def iter_records(self) -> Iterator[Dict]:
+        """Duyệt tuần tự toàn bộ lịch sử trên đĩa mà không giữ trong bộ nhớ"""
+        if self._segments is not None:
+            yield from self._segments.iter_all()
+            return
+        if self.storage != "jsonl":
+            yield from self.data
+            return
+        try:
+            with open(self.file_path, 'rb') as f:
+                for line in f:
+                    if line.strip():
+                        try:
+                            yield json.loads(line)
+                        except json.JSONDecodeError:
+                            return
+        except FileNotFoundError:
+            return
+            
+    def count_records(self) -> int:
+        """Tổng số bản ghi, kể cả phần chỉ nằm trên đĩa"""
+        if self._segments is not None:
+            return self._segments.count()
+        if self._cold_count is None:
+            self._cold_count = 0
+            if self._cold_end_offset:
+                with open(self.file_path, 'rb') as f:
+                    remaining = self._cold_end_offset
+                    while remaining:
+                        block = f.read(min(TAIL_BLOCK_SIZE, remaining))
+                        self._cold_count += block.count(b"\n")
+                        remaining -= len(block)
+        return self._cold_count + self._evicted + len(self.data)
+        
+    def history_mark(self) -> int:
+        """
+        Dấu hiệu rẻ của lịch sử đã lưu, ghi cùng thống kê tích lũy để phát hiện file
+        thống kê cũ mà không quét phần lạnh: số bản ghi trong manifest phân đoạn,
+        hoặc kích thước file ở các chế độ còn lại
+        """
+        if self._segments is not None:
+            return self._segments.count()
+        try:
+            return os.path.getsize(self.file_path)
+        except FileNotFoundError:
+            return 0
+            
+    def _update_aggregates(self, record_dict: Dict):
+        """Cộng bản ghi vào thống kê; chỉ ghi file thống kê sau mỗi aggregates_every bản ghi"""
+        self.aggregates.add(record_dict)
+        self._unsaved_aggregates += 1
+        if self._unsaved_aggregates >= max(self.aggregates_every, 1):
+            self._save_aggregates()
+            
+    def _save_aggregates(self):
+        if self._unsaved_aggregates:
+            self.aggregates.history_mark = self.history_mark()
+            self.aggregates.save(self.file_path + AGGREGATES_SUFFIX)
+            self._unsaved_aggregates = 0
+        
+    def _evict_cold(self):
+        """Đẩy nửa cũ của cửa sổ nóng ra khỏi bộ nhớ (khấu hao O(1) mỗi lần thêm)"""
+        if not self.hot_window or len(self.data) < 2 * self.hot_window:
+            return
+        evicted = len(self.data) - self.hot_window
+        del self.data[:evicted]
+        self._evicted += evicted
+        self._build_time_index()
+        
     def _save_data(self):
         """Lưu dữ liệu vào file JSON"""
         with open(self.file_path, 'w', encoding='utf-8') as f:
             json.dump(self.data, f, ensure_ascii=False, indent=2)
             
+    def _append_journal(self, record_dict: Dict):
+        """Ghi thêm một dòng vào nhật ký, chi phí không phụ thuộc độ dài lịch sử"""
+        if self._journal is None:
+            self._journal = open(self.file_path, 'ab')
+            if self.storage == "binary":
+                if not self._journal.tell():
+                    self._journal.write(record_codec.file_header())
+            elif self._journal.tell() and not self._ends_with_newline():
+                self._journal.write(b"\n")
+        if self.storage == "binary":
+            self._journal.write(record_codec.frame(record_codec.encode_record(record_dict)))
+        else:
+            self._journal.write((json.dumps(record_dict, ensure_ascii=False) + "\n").encode('utf-8'))
+        self._journal.flush()
+        
+        self._unsynced += 1
+        if self.fsync_every and self._unsynced >= self.fsync_every:
+            self._fsync()
+            
+    def _ends_with_newline(self) -> bool:
+        """Kiểm tra byte cuối của nhật ký"""
+        with open(self.file_path, 'rb') as f:
+            f.seek(-1, os.SEEK_END)
+            return f.read(1) == b"\n"
+            
+    def _fsync(self):
+        if self._segments is not None:
+            self._segments.sync()
+        if self._journal is not None and self._unsynced:
+            self._journal.flush()
+            os.fsync(self._journal.fileno())
+        self._unsynced = 0
+        
+    def sync(self):
+        """Đẩy các bản ghi chưa fsync xuống đĩa và ghi file thống kê tích lũy"""
+        self._fsync()
+        self._save_aggregates()
+        
+    def close(self):
+        """Đóng nhật ký sau khi fsync phần còn lại"""
+        if self._segments is not None:
+            self._segments.close()
+        if self._journal is not None:
+            self._fsync()
+            self._journal.close()
+            self._journal = None
+        self._save_aggregates()
+            
     def add_record(self, record: CycleRecord):
         """Thêm bản ghi mới"""
-        self.data.append(record.to_dict())
-        self._save_data()
+        record_dict = record.to_dict()
+        self.data.append(record_dict)
+        self._index_record(len(self.data) - 1)
+        if self._segments is not None:
+            self._segments.append(record_dict, parse_timestamp(record_dict["timestamp"]))
+            self._evict_cold()
+        elif self.storage in ("jsonl", "binary"):
+            self._append_journal(record_dict)
+            self._evict_cold()
+        else:
+            self._save_data()
+        self._update_aggregates(record_dict)
         print(f"💾 Đã lưu bản ghi #{record.id}")
         
-    def get_recent_records(self, days: int = 3) -> List[Dict]:
+    def _build_time_index(self):
+        """Phân tích timestamp một lần khi tải và sắp xếp chỉ mục"""
+        epochs = [parse_timestamp(record.get("timestamp")) for record in self.data]
+        entries = sorted((epoch, position) for position, epoch in enumerate(epochs) if epoch is not None)
+        self._index_times = [epoch for epoch, _ in entries]
+        self._index_positions = [position for _, position in entries]
+        self.columns = ColumnarHistory.from_records(self.data, epochs)
+        
+    def _index_record(self, position: int):
+        """Thêm bản ghi vào chỉ mục, chấp nhận timestamp đến không theo thứ tự"""
+        epoch = parse_timestamp(self.data[position].get("timestamp"))
+        self.columns.append(self.data[position], epoch)
+        if epoch is None:
+            return
+        if not self._index_times or epoch >= self._index_times[-1]:
+            self._index_times.append(epoch)
+            self._index_positions.append(position)
+        else:
+            slot = bisect.bisect_right(self._index_times, epoch)
+            self._index_times.insert(slot, epoch)
+            self._index_positions.insert(slot, position)
+            
+    def _has_cold_data(self) -> bool:
+        if self._segments is not None:
+            return self._segments.count() > len(self.data)
+        return bool(self._cold_end_offset or self._evicted)
+        
+    def get_records_between(self, start: datetime, end: datetime) -> List[Dict]:
+        """Lấy các bản ghi có timestamp trong [start, end], sắp theo thời gian"""
+        if self._has_cold_data() and (not self._index_times or start.timestamp() < self._index_times[0]):
+            # Khoảng thời gian vượt ra ngoài cửa sổ nóng: quét tuần tự trên đĩa
+            lo, hi = start.timestamp(), end.timestamp()
+            # Ở chế độ phân đoạn chỉ mở các phân đoạn giao với khoảng cần tìm
+            records = (self._segments.iter_range(lo, hi) if self._segments is not None
+                       else self.iter_records())
+            matches = []
+            for record in records:
+                epoch = parse_timestamp(record.get("timestamp"))
+                if epoch is not None and lo <= epoch <= hi:
+                    matches.append((epoch, record))
+            matches.sort(key=lambda match: match[0])
+            return [record for _, record in matches]
+            
+        lo = bisect.bisect_left(self._index_times, start.timestamp())
+        hi = bisect.bisect_right(self._index_times, end.timestamp())
+        return [self.data[position] for position in self._index_positions[lo:hi]]
+        
+    def get_recent_records(self, days: int = 3, now: Optional[datetime] = None) -> List[Dict]:
         """Lấy bản ghi trong N ngày gần nhất"""
-        # Đơn giản hóa: lấy N bản ghi cuối cùng
-        return self.data[-days*8:] if self.data else []
+        now = now or datetime.now()
+        return self.get_records_between(now - timedelta(days=days), now)
+        
+    def get_recent_window(self, days: int = 3, now: Optional[datetime] = None) -> HistoryWindow:
+        """Các cột NumPy của N ngày gần nhất"""
+        now = now or datetime.now()
+        return self.columns.window(now - timedelta(days=days), now)
         
     def get_last_record(self) -> Optional[Dict]:
         """Lấy bản ghi cuối cùng"""
@@ -107,7 +519,235 @@ class Database:
         
     def get_next_id(self) -> int:
         """Lấy ID cho bản ghi tiếp theo"""
-        return len(self.data) + 1
+        last_record = self.get_last_record()
+        return last_record["id"] + 1 if last_record else 1
+
+class SQLiteDatabase:
+    """Cơ sở dữ liệu lịch sử nhúng SQLite (WAL), cùng giao diện với Database"""
+    
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS cycles (
+            id INTEGER PRIMARY KEY,
+            epoch REAL,
+            timestamp TEXT NOT NULL,
+            phase TEXT NOT NULL,
+            wait_minutes INTEGER NOT NULL,
+            temperature REAL NOT NULL,
+            humidity REAL NOT NULL,
+            et0 REAL NOT NULL,
+            fill_seconds INTEGER NOT NULL,
+            ec REAL NOT NULL,
+            reflection_text TEXT NOT NULL DEFAULT ''
+        );
+        CREATE INDEX IF NOT EXISTS idx_cycles_epoch ON cycles (epoch);
+    """
+    COLUMNS = ("id, timestamp, phase, wait_minutes, temperature, humidity, et0, "
+               "fill_seconds, ec, reflection_text")
+    INSERT = ("INSERT INTO cycles (id, epoch, timestamp, phase, wait_minutes, temperature, "
+              "humidity, et0, fill_seconds, ec, reflection_text) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)")
+    PAGE_SIZE = 500
+    
+    def __init__(self, file_path: str = SQLITE_FILE, batch_size: Optional[int] = None,
+                 target_ec: float = 4.0, aggregates_every: Optional[int] = None):
+        """
+        batch_size: số bản ghi gom trong một transaction trước khi commit
+                    (1 = commit từng bản ghi)
+        target_ec: EC mục tiêu của vùng sở hữu lịch sử, cho thống kê tích lũy
+        aggregates_every: số bản ghi giữa hai lần ghi file thống kê tích lũy (ngoài sync/close)
+        """
+        self.file_path = file_path
+        self.batch_size = (batch_size if batch_size is not None
+                           else int(os.getenv("HISTORY_SQLITE_BATCH", "1")))
+        self._pending = 0
+        # Gradio gọi từ nhiều thread nên dùng chung một kết nối có khóa
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(file_path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(self.SCHEMA)
+        self.conn.commit()
+        self.target_ec = target_ec
+        self.aggregates_every = (aggregates_every if aggregates_every is not None
+                                 else int(os.getenv("HISTORY_AGGREGATES_EVERY", "100")))
+        self._unsaved_aggregates = 0
+        self.aggregates = CycleAggregates.load_or_rebuild(self.file_path + AGGREGATES_SUFFIX, self, target_ec)
+        
+    @staticmethod
+    def _to_row(record_dict: Dict) -> Tuple:
+        env = record_dict["input_data"]["môi_trường_tb"]
+        return (
+            record_dict["id"],
+            parse_timestamp(record_dict["timestamp"]),
+            record_dict["timestamp"],
+            record_dict["phase"],
+            record_dict["input_data"]["T_chờ_phút"],
+            env["nhiệt_độ"],
+            env["độ_ẩm"],
+            env["et0"],
+            record_dict["output_data"]["T_đầy_giây"],
+            record_dict["output_data"]["EC_đo_được"],
+            record_dict.get("reflection_text", ""),
+        )
+        
+    @staticmethod
+    def _to_dict(row: Tuple) -> Dict:
+        """Dựng lại đúng cấu trúc CycleRecord.to_dict()"""
+        (record_id, timestamp, phase, wait_minutes, temperature, humidity, et0,
+         fill_seconds, ec, reflection_text) = row
+        return {
+            "id": record_id,
+            "timestamp": timestamp,
+            "phase": phase,
+            "input_data": {
+                "T_chờ_phút": wait_minutes,
+                "môi_trường_tb": {"nhiệt_độ": temperature, "độ_ẩm": humidity, "et0": et0}
+            },
+            "output_data": {"T_đầy_giây": fill_seconds, "EC_đo_được": ec},
+            "reflection_text": reflection_text
+        }
+        
+    def _query(self, sql: str, params: Tuple = ()) -> List[Dict]:
+        with self._lock:
+            rows = self.conn.execute(sql, params).fetchall()
+        return [self._to_dict(row) for row in rows]
+        
+    def add_records(self, record_dicts: Iterable[Dict]) -> int:
+        """
+        Ghi nhiều bản ghi trong một transaction (dùng khi nhập dữ liệu cũ)
+        Thống kê tích lũy được cộng dồn khi lô nối tiếp sau id lớn nhất; chỉ dựng lại
+        từ toàn bảng khi lô thay thế hoặc chen vào giữa các bản ghi đã có
+        """
+        record_dicts = list(record_dicts)
+        rows = [self._to_row(record_dict) for record_dict in record_dicts]
+        with self._lock:
+            last_id = self.conn.execute("SELECT COALESCE(MAX(id), 0) FROM cycles").fetchone()[0]
+            self.conn.executemany(self.INSERT.replace("INSERT", "INSERT OR REPLACE", 1), rows)
+            self.conn.commit()
+            self._pending = 0
+        # INSERT OR REPLACE không tính các dòng bị thay vào changes(), nên so với id lớn nhất trước đó
+        ids = [row[0] for row in rows]
+        if all(previous < current for previous, current in zip([last_id] + ids, ids)):
+            for record_dict in record_dicts:
+                self.aggregates.add(record_dict)
+        else:
+            self.aggregates = CycleAggregates(self.target_ec)
+            for record_dict in self.iter_records():
+                self.aggregates.add(record_dict)
+        self._unsaved_aggregates += len(rows)
+        self._save_aggregates()
+        return len(rows)
+        
+    def add_record(self, record: CycleRecord):
+        """Thêm bản ghi mới"""
+        with self._lock:
+            record_dict = record.to_dict()
+            self.conn.execute(self.INSERT, self._to_row(record_dict))
+            self._pending += 1
+            if self._pending >= self.batch_size:
+                self.conn.commit()
+                self._pending = 0
+        self._update_aggregates(record_dict)
+        print(f"💾 Đã lưu bản ghi #{record.id}")
+        
+    def sync(self):
+        """Commit các bản ghi còn trong transaction và ghi file thống kê tích lũy"""
+        with self._lock:
+            self.conn.commit()
+            self._pending = 0
+        self._save_aggregates()
+        
+    def history_mark(self) -> int:
+        """Số bản ghi trong bảng: dấu hiệu lưu cùng thống kê tích lũy"""
+        return self.count_records()
+        
+    def _update_aggregates(self, record_dict: Dict):
+        self.aggregates.add(record_dict)
+        self._unsaved_aggregates += 1
+        if self._unsaved_aggregates >= max(self.aggregates_every, 1):
+            self._save_aggregates()
+            
+    def _save_aggregates(self):
+        if self._unsaved_aggregates:
+            self.aggregates.history_mark = self.history_mark()
+            self.aggregates.save(self.file_path + AGGREGATES_SUFFIX)
+            self._unsaved_aggregates = 0
+            
+    def close(self):
+        self.sync()
+        self.conn.close()
+        
+    def get_records_between(self, start: datetime, end: datetime) -> List[Dict]:
+        """Lấy các bản ghi có timestamp trong [start, end], sắp theo thời gian"""
+        return self._query(
+            f"SELECT {self.COLUMNS} FROM cycles WHERE epoch BETWEEN ? AND ? ORDER BY epoch",
+            (start.timestamp(), end.timestamp())
+        )
+        
+    def get_recent_records(self, days: int = 3, now: Optional[datetime] = None) -> List[Dict]:
+        """Lấy bản ghi trong N ngày gần nhất"""
+        now = now or datetime.now()
+        return self.get_records_between(now - timedelta(days=days), now)
+        
+    def get_recent_window(self, days: int = 3, now: Optional[datetime] = None) -> HistoryWindow:
+        """Các cột NumPy của N ngày gần nhất"""
+        records = self.get_recent_records(days=days, now=now)
+        epochs = [parse_timestamp(record["timestamp"]) for record in records]
+        return ColumnarHistory.from_records(records, epochs).window()
+        
+    def iter_records(self) -> Iterator[Dict]:
+        """Duyệt toàn bộ lịch sử theo id, mỗi lần đọc một trang"""
+        last_id = 0
+        while True:
+            page = self._query(
+                f"SELECT {self.COLUMNS} FROM cycles WHERE id > ? ORDER BY id LIMIT ?",
+                (last_id, self.PAGE_SIZE)
+            )
+            yield from page
+            if len(page) < self.PAGE_SIZE:
+                return
+            last_id = page[-1]["id"]
+                
+    def count_records(self) -> int:
+        with self._lock:
+            return self.conn.execute("SELECT COUNT(*) FROM cycles").fetchone()[0]
+            
+    def get_last_record(self) -> Optional[Dict]:
+        """Lấy bản ghi cuối cùng"""
+        records = self._query(f"SELECT {self.COLUMNS} FROM cycles ORDER BY id DESC LIMIT 1")
+        return records[0] if records else None
+        
+    def get_next_id(self) -> int:
+        """Lấy ID cho bản ghi tiếp theo"""
+        with self._lock:
+            return self.conn.execute("SELECT COALESCE(MAX(id), 0) + 1 FROM cycles").fetchone()[0]
+
+def create_database(storage: Optional[str] = None, **kwargs):
+    """Tạo cơ sở dữ liệu lịch sử theo cấu hình HISTORY_STORAGE"""
+    storage = storage or os.getenv("HISTORY_STORAGE", "json")
+    if storage == "sqlite":
+        return SQLiteDatabase(**kwargs)
+    return Database(storage=storage, **kwargs)
+
+def import_json_history(json_path: str = "irrigation_history.json",
+                        journal_path: str = "irrigation_history.jsonl") -> int:
+    """
+    Chuyển lịch sử dạng mảng JSON sang nhật ký JSONL (chạy một lần)
+    Returns: số bản ghi đã chuyển
+    """
+    with open(json_path, 'r', encoding='utf-8') as f:
+        records = json.load(f)
+        
+    # Ghi ra file tạm rồi đổi tên để không bao giờ để lại nhật ký dở dang
+    tmp_path = journal_path + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        for record in records:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, journal_path)
+    
+    print(f"📦 Đã chuyển {len(records)} bản ghi từ {json_path} sang {journal_path}")
+    return len(records)
 
 class EnvironmentSensor:
     """Cảm biến môi trường (mô phỏng)"""
@@ -131,3 +771,11 @@ class EnvironmentSensor:
             "Trời âm u, độ ẩm cao."
         ]
         return random.choice(forecasts)
+
+    @staticmethod
+    async def aget_current_environment() -> EnvironmentData:
+        return EnvironmentSensor.get_current_environment()
+
+    @staticmethod
+    async def aget_weather_forecast() -> str:
+        return EnvironmentSensor.get_weather_forecast()
@@ -0,0 +1,3 @@
+# agent-api là dự án riêng (package `agents` trùng tên với agents.py): chạy pytest trong thư mục đó
+# gradio_app_test.py là ứng dụng Gradio, không phải file test
+collect_ignore = ["agent-api", "gradio_app_test.py"]
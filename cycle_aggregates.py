@@ -0,0 +1,253 @@
+"""
+Thống kê tích lũy của các chu trình tưới, cập nhật tăng dần mỗi lần thêm bản ghi
+Tổng kết và tab phân tích đọc trực tiếp trong O(1), không phụ thuộc độ dài lịch sử
+"""
+
+import json
+import math
+import os
+from collections import deque
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+# Trường số được theo dõi: tên -> đường dẫn trong bản ghi
+FIELDS = {
+    "EC": ("output_data", "EC_đo_được"),
+    "T_chờ": ("input_data", "T_chờ_phút"),
+    "T_đầy": ("output_data", "T_đầy_giây"),
+    "nhiệt_độ": ("input_data", "môi_trường_tb", "nhiệt_độ"),
+    "độ_ẩm": ("input_data", "môi_trường_tb", "độ_ẩm"),
+    "et0": ("input_data", "môi_trường_tb", "et0"),
+}
+
+# Số chu trình đầu/cuối dùng để so sánh xu hướng
+TREND_SIZE = 3
+
+# Số ngày gần nhất giữ thống kê theo ngày (tổng kết theo khoảng thời gian)
+DAILY_DAYS = 30
+
+
+def _field(record: Dict, path: tuple) -> float:
+    value = record
+    for key in path:
+        value = value[key]
+    return value
+
+
+class RunningStats:
+    """Trung bình và phương sai theo thuật toán Welford"""
+
+    def __init__(self, count: int = 0, mean: float = 0.0, m2: float = 0.0):
+        self.count = count
+        self.mean = mean
+        self.m2 = m2
+
+    def add(self, value: float):
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+
+    @property
+    def std(self) -> float:
+        """Độ lệch chuẩn mẫu (ddof=1)"""
+        return math.sqrt(self.m2 / (self.count - 1)) if self.count > 1 else float("nan")
+
+    def to_dict(self) -> Dict:
+        return {"count": self.count, "mean": self.mean, "m2": self.m2}
+
+
+class RollingWindow:
+    """Cửa sổ trượt kích thước cố định với tổng và tổng bình phương chạy"""
+
+    def __init__(self, size: int, values: Optional[List[float]] = None):
+        self.values = deque(maxlen=size)
+        self.total = 0.0
+        self.total_sq = 0.0
+        for value in values or []:
+            self.add(value)
+
+    def add(self, value: float):
+        if len(self.values) == self.values.maxlen:
+            old = self.values[0]
+            self.total -= old
+            self.total_sq -= old * old
+        self.values.append(value)
+        self.total += value
+        self.total_sq += value * value
+
+    @property
+    def mean(self) -> float:
+        return self.total / len(self.values) if self.values else float("nan")
+
+    @property
+    def std(self) -> float:
+        """Độ lệch chuẩn quần thể của cửa sổ"""
+        if not self.values:
+            return float("nan")
+        return math.sqrt(max(self.total_sq / len(self.values) - self.mean ** 2, 0.0))
+
+    def tail_mean(self, n: int) -> float:
+        tail = list(self.values)[-n:]
+        return sum(tail) / len(tail) if tail else float("nan")
+
+
+class CycleAggregates:
+    """
+    Thống kê tích lũy: Welford cho từng trường, đếm theo giai đoạn, EWMA sai số EC,
+    cửa sổ trượt và tổng theo ngày của DAILY_DAYS ngày gần nhất
+    """
+
+    def __init__(self,
+                 target_ec: float = 4.0,
+                 ewma_alpha: float = 0.3,
+                 window_size: int = 24):
+        """target_ec: EC mục tiêu của vùng sở hữu lịch sử, dùng cho sai số EC"""
+        self.target_ec = target_ec
+        self.ewma_alpha = ewma_alpha
+        self.window_size = window_size
+        self.count = 0
+        self.last_id: Optional[int] = None
+        self.stats = {name: RunningStats() for name in FIELDS}
+        self.phase_counts: Dict[str, int] = {}
+        self.ewma_ec_error: Optional[float] = None
+        self.ewma_abs_ec_error: Optional[float] = None
+        self.first_ec: List[float] = []
+        self.rolling = {name: RollingWindow(window_size) for name in ("EC", "T_chờ")}
+        # "YYYY-MM-DD" -> [số chu trình, tổng EC, tổng T_chờ]
+        self.daily: Dict[str, List[float]] = {}
+        # database.history_mark() khi lưu: phát hiện file thống kê cũ hơn lịch sử
+        self.history_mark: Optional[int] = None
+
+    def add(self, record: Dict):
+        """Cập nhật mọi thống kê với một bản ghi mới (O(1))"""
+        self.count += 1
+        self.last_id = record["id"]
+        for name, path in FIELDS.items():
+            self.stats[name].add(_field(record, path))
+        self.phase_counts[record["phase"]] = self.phase_counts.get(record["phase"], 0) + 1
+
+        ec = _field(record, FIELDS["EC"])
+        error = ec - self.target_ec
+        if self.ewma_ec_error is None:
+            self.ewma_ec_error, self.ewma_abs_ec_error = error, abs(error)
+        else:
+            self.ewma_ec_error += self.ewma_alpha * (error - self.ewma_ec_error)
+            self.ewma_abs_ec_error += self.ewma_alpha * (abs(error) - self.ewma_abs_ec_error)
+
+        if len(self.first_ec) < TREND_SIZE:
+            self.first_ec.append(ec)
+        wait = _field(record, FIELDS["T_chờ"])
+        self.rolling["EC"].add(ec)
+        self.rolling["T_chờ"].add(wait)
+
+        bucket = self.daily.setdefault(record["timestamp"][:10], [0, 0.0, 0.0])
+        bucket[0] += 1
+        bucket[1] += ec
+        bucket[2] += wait
+        if len(self.daily) > DAILY_DAYS:
+            del self.daily[min(self.daily)]
+
+    def mean(self, name: str) -> float:
+        return self.stats[name].mean if self.count else float("nan")
+
+    def std(self, name: str) -> float:
+        return self.stats[name].std
+
+    def window(self, days: int, now: datetime) -> Dict:
+        """
+        Số chu trình, EC và T_chờ trung bình của `days` ngày gần nhất (tính cả
+        ngày của `now`), cộng từ tổng theo ngày
+        """
+        if days > DAILY_DAYS:
+            raise ValueError(f"Chỉ giữ thống kê {DAILY_DAYS} ngày gần nhất")
+        first = (now - timedelta(days=days - 1)).date().isoformat()
+        last = now.date().isoformat()
+        count, ec_total, wait_total = 0, 0.0, 0.0
+        for day, (n, ec_sum, wait_sum) in self.daily.items():
+            if first <= day <= last:
+                count += n
+                ec_total += ec_sum
+                wait_total += wait_sum
+        return {
+            "count": count,
+            "EC": ec_total / count if count else float("nan"),
+            "T_chờ": wait_total / count if count else float("nan"),
+        }
+
+    @property
+    def earlier_ec(self) -> float:
+        """EC trung bình của TREND_SIZE chu trình đầu tiên"""
+        return sum(self.first_ec) / len(self.first_ec) if self.first_ec else float("nan")
+
+    @property
+    def recent_ec(self) -> float:
+        """EC trung bình của TREND_SIZE chu trình gần nhất"""
+        return self.rolling["EC"].tail_mean(TREND_SIZE)
+
+    # ---------- Lưu trữ ----------
+
+    def to_dict(self) -> Dict:
+        return {
+            "target_ec": self.target_ec,
+            "ewma_alpha": self.ewma_alpha,
+            "window_size": self.window_size,
+            "count": self.count,
+            "last_id": self.last_id,
+            "stats": {name: stats.to_dict() for name, stats in self.stats.items()},
+            "phase_counts": self.phase_counts,
+            "ewma_ec_error": self.ewma_ec_error,
+            "ewma_abs_ec_error": self.ewma_abs_ec_error,
+            "first_ec": self.first_ec,
+            "rolling": {name: list(window.values) for name, window in self.rolling.items()},
+            "daily": self.daily,
+            "history_mark": self.history_mark,
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "CycleAggregates":
+        aggregates = cls(data["target_ec"], data["ewma_alpha"], data["window_size"])
+        aggregates.count = data["count"]
+        aggregates.last_id = data["last_id"]
+        aggregates.stats = {name: RunningStats(**stats) for name, stats in data["stats"].items()}
+        aggregates.phase_counts = data["phase_counts"]
+        aggregates.ewma_ec_error = data["ewma_ec_error"]
+        aggregates.ewma_abs_ec_error = data["ewma_abs_ec_error"]
+        aggregates.first_ec = data["first_ec"]
+        aggregates.rolling = {name: RollingWindow(aggregates.window_size, values)
+                              for name, values in data["rolling"].items()}
+        aggregates.daily = data["daily"]
+        aggregates.history_mark = data["history_mark"]
+        return aggregates
+
+    def save(self, path: str):
+        """Ghi file thống kê (kích thước cố định) bằng file tạm + đổi tên"""
+        tmp_path = path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.to_dict(), f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load_or_rebuild(cls, path: str, database, target_ec: float = 4.0) -> "CycleAggregates":
+        """
+        Đọc thống kê đã lưu cùng lịch sử; dựng lại bằng một lần quét nếu
+        file thiếu, hỏng hoặc không khớp với lịch sử hiện có (kể cả EC mục tiêu)
+        So khớp bằng database.history_mark() và id cuối, không đếm lại phần lạnh
+        """
+        last_record = database.get_last_record()
+        aggregates = cls(target_ec)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                saved = cls.from_dict(json.load(f))
+            if (saved.history_mark == database.history_mark()
+                    and saved.last_id == (last_record["id"] if last_record else None)
+                    and saved.target_ec == aggregates.target_ec):
+                return saved
+        except (FileNotFoundError, json.JSONDecodeError, KeyError, TypeError):
+            pass
+
+        for record in database.iter_records():
+            aggregates.add(record)
+        aggregates.history_mark = database.history_mark()
+        aggregates.save(path)
+        return aggregates
@@ -0,0 +1,87 @@
+"""
+Hạn chót của một chu trình, truyền ngầm qua contextvars tới mọi bước con
+(đọc cảm biến, chờ lưu trữ, gọi LLM); bước nào vượt hạn bị hủy và người gọi
+dùng câu trả lời tốt nhất đang có, kèm lý do suy giảm được ghi lại
+"""
+
+import asyncio
+import time
+from contextvars import ContextVar
+from typing import Awaitable, Dict, List, Optional
+
+_current: ContextVar[Optional["Deadline"]] = ContextVar("deadline", default=None)
+
+# Số lần suy giảm theo bước, cho giám sát
+degradation_counts: Dict[str, int] = {}
+
+
+class DeadlineExceeded(Exception):
+    """Bước vượt quá thời gian còn lại của hạn chót"""
+
+
+class Deadline:
+    """Hạn chót theo thời gian thực (monotonic): LLM và thiết bị chạy theo giờ thật"""
+
+    def __init__(self, seconds: float, name: str = ""):
+        self.name = name
+        self.seconds = seconds
+        self.expires_at = time.monotonic() + seconds
+        self.reasons: List[str] = []
+        self._token = None
+
+    def remaining(self) -> float:
+        return max(self.expires_at - time.monotonic(), 0.0)
+
+    @property
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    def budget(self, share: Optional[float] = None) -> float:
+        """Thời gian cho một bước: cả phần còn lại hoặc một tỉ lệ của hạn chót ban đầu"""
+        if share is None:
+            return self.remaining()
+        return min(self.remaining(), self.seconds * share)
+
+    def degrade(self, stage: str, reason: str):
+        self.reasons.append(f"{stage}: {reason}")
+        degradation_counts[stage] = degradation_counts.get(stage, 0) + 1
+        print(f"⏱️ Suy giảm ({self.name}/{stage}): {reason}")
+
+    def __enter__(self) -> "Deadline":
+        self._token = _current.set(self)
+        return self
+
+    def __exit__(self, *exc_info):
+        _current.reset(self._token)
+
+
+def current_deadline() -> Optional[Deadline]:
+    return _current.get()
+
+
+def degrade(stage: str, reason: str):
+    """Ghi lý do suy giảm vào hạn chót hiện tại (nếu có)"""
+    deadline = current_deadline()
+    if deadline is not None:
+        deadline.degrade(stage, reason)
+
+
+async def within(awaitable: Awaitable, stage: str, share: Optional[float] = None):
+    """
+    Chờ `awaitable` trong ngân sách của bước; không có hạn chót thì chờ bình thường
+    Raises: DeadlineExceeded (awaitable đã bị hủy)
+    """
+    deadline = current_deadline()
+    if deadline is None:
+        return await awaitable
+    timeout = deadline.budget(share)
+    if timeout <= 0:
+        if asyncio.iscoroutine(awaitable):
+            awaitable.close()
+        elif isinstance(awaitable, asyncio.Future):
+            awaitable.cancel()
+        raise DeadlineExceeded(f"{stage}: hết thời gian")
+    try:
+        return await asyncio.wait_for(awaitable, timeout)
+    except asyncio.TimeoutError:
+        raise DeadlineExceeded(f"{stage}: vượt {timeout:.1f}s") from None
@@ -0,0 +1,201 @@
+"""
+Bộ nhớ đệm quyết định của Plan Agent theo đầu vào đã lượng tử hóa
+Các chu trình có EC, T_chờ, môi trường và dự báo gần giống nhau dùng lại quyết
+định cũ thay vì gọi LLM. Hai tầng: LRU trong bộ nhớ có TTL, tùy chọn SQLite trên đĩa
+"""
+
+import hashlib
+import json
+import os
+import random
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Tuple
+
+# Bước lượng tử hóa cho từng đặc trưng
+EC_STEP = 0.1
+WAIT_STEP = 10
+TEMPERATURE_STEP = 1.0
+HUMIDITY_STEP = 5.0
+ET0_STEP = 0.05
+# Số chu trình gần nhất đưa vào digest lịch sử
+HISTORY_DIGEST_SIZE = 3
+
+FORECAST_CATEGORIES = (
+    ("mưa", "rain"),
+    ("nắng", "sunny"),
+    ("âm u", "cloudy"),
+    ("ổn định", "stable"),
+)
+
+
+def _bucket(value: float, step: float) -> int:
+    return int(round(value / step))
+
+
+def forecast_category(forecast: str) -> str:
+    """Nhóm dự báo dạng văn bản thành một vài loại"""
+    text = forecast.lower()
+    for keyword, category in FORECAST_CATEGORIES:
+        if keyword in text:
+            return category
+    return "other"
+
+
+def plan_features(history: List[Dict], current_env: Dict, forecast: str, target_ec: float) -> Tuple:
+    """Vector đặc trưng lượng tử hóa cho một lần quyết định của Plan Agent"""
+    digest = tuple(
+        (_bucket(record["output_data"]["EC_đo_được"], EC_STEP),
+         _bucket(record["input_data"]["T_chờ_phút"], WAIT_STEP))
+        for record in history[-HISTORY_DIGEST_SIZE:]
+    )
+    return (
+        round(target_ec, 2),
+        digest,
+        _bucket(current_env["nhiệt_độ"], TEMPERATURE_STEP),
+        _bucket(current_env["độ_ẩm"], HUMIDITY_STEP),
+        _bucket(current_env["et0"], ET0_STEP),
+        forecast_category(forecast),
+    )
+
+
+class DecisionCache:
+    """LRU + TTL trong bộ nhớ, tầng SQLite tùy chọn, thống kê trúng/trượt và độ lệch"""
+
+    def __init__(self,
+                 ttl_seconds: Optional[float] = None,
+                 max_entries: Optional[int] = None,
+                 disk_path: Optional[str] = None,
+                 audit_rate: Optional[float] = None,
+                 divergence_tolerance: float = 15.0,
+                 time_source: Callable[[], float] = time.time):
+        """
+        ttl_seconds: tuổi tối đa của một quyết định
+        max_entries: số quyết định giữ trong bộ nhớ (LRU)
+        disk_path: file SQLite cho tầng đĩa ("" = tắt)
+        audit_rate: tỉ lệ lần trúng vẫn gọi LLM để đo độ lệch giữa quyết định đệm và thực
+        divergence_tolerance: chênh lệch T_chờ (phút) được coi là lệch
+        """
+        self.ttl_seconds = (ttl_seconds if ttl_seconds is not None
+                            else float(os.getenv("DECISION_CACHE_TTL", "21600")))
+        self.max_entries = (max_entries if max_entries is not None
+                            else int(os.getenv("DECISION_CACHE_SIZE", "512")))
+        disk_path = disk_path if disk_path is not None else os.getenv("DECISION_CACHE_FILE", "")
+        self.audit_rate = (audit_rate if audit_rate is not None
+                           else float(os.getenv("DECISION_CACHE_AUDIT_RATE", "0.05")))
+        self.divergence_tolerance = divergence_tolerance
+        self.time_source = time_source
+
+        self._entries: "OrderedDict[str, Tuple[float, Dict]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn = None
+        if disk_path:
+            self._conn = sqlite3.connect(disk_path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS decisions "
+                "(key TEXT PRIMARY KEY, created REAL NOT NULL, decision TEXT NOT NULL)"
+            )
+            self._conn.commit()
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.audits = 0
+        self.divergences = 0
+        self.total_divergence = 0.0
+
+    @staticmethod
+    def key(features: Tuple) -> str:
+        return hashlib.sha1(json.dumps(features).encode('utf-8')).hexdigest()
+
+    def get(self, key: str) -> Optional[Dict]:
+        now = self.time_source()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None and self._conn is not None:
+                row = self._conn.execute(
+                    "SELECT created, decision FROM decisions WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None:
+                    entry = (row[0], json.loads(row[1]))
+                    self._store_memory(key, entry)
+                    self.disk_hits += 1
+            if entry is None:
+                self.misses += 1
+                return None
+            created, decision = entry
+            if now - created > self.ttl_seconds:
+                self._entries.pop(key, None)
+                if self._conn is not None:
+                    self._conn.execute("DELETE FROM decisions WHERE key = ?", (key,))
+                    self._conn.commit()
+                self.expired += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return dict(decision)
+
+    def _store_memory(self, key: str, entry: Tuple[float, Dict]):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def put(self, key: str, decision: Dict):
+        entry = (self.time_source(), dict(decision))
+        with self._lock:
+            self._store_memory(key, entry)
+            if self._conn is not None:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO decisions (key, created, decision) VALUES (?, ?, ?)",
+                    (key, entry[0], json.dumps(entry[1], ensure_ascii=False))
+                )
+                self._conn.commit()
+
+    def should_audit(self) -> bool:
+        return random.random() < self.audit_rate
+
+    def record_audit(self, cached: Dict, live: Dict):
+        """So sánh quyết định đệm với quyết định LLM cho cùng đầu vào lượng tử hóa"""
+        difference = abs(cached["T_chờ_đề_xuất"] - live["T_chờ_đề_xuất"])
+        with self._lock:
+            self.audits += 1
+            self.total_divergence += difference
+            if difference > self.divergence_tolerance:
+                self.divergences += 1
+
+    def stats(self) -> Dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "expired": self.expired,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "audits": self.audits,
+            "divergences": self.divergences,
+            "divergence_rate": self.divergences / self.audits if self.audits else 0.0,
+            "mean_divergence_minutes": self.total_divergence / self.audits if self.audits else 0.0,
+        }
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+
+_shared_cache: Optional[DecisionCache] = None
+
+
+def shared_decision_cache() -> DecisionCache:
+    """Bộ nhớ đệm dùng chung cho mọi vùng trong tiến trình (khóa có EC mục tiêu)"""
+    global _shared_cache
+    if _shared_cache is None:
+        _shared_cache = DecisionCache()
+    return _shared_cache
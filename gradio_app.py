@@ -8,26 +8,29 @@ import gradio as gr
 import pandas as pd
 import plotly.graph_objects as go
 import plotly.express as px
-from datetime import datetime, timedelta
-import json
-import threading
-import time
-from typing import Dict, List, Tuple
+import asyncio
+from typing import Tuple
 
 from main import IrrigationSystem
-from components import Database, EnvironmentSensor, EnvironmentData
-from agents import ReflectionAgent, PlanAgent
+from clock import AcceleratedClock, RealClock
+from components import Controller, await_device
+from history_columns import HistoryWindow, rolling_mean
 
 
 class DemoIrrigationSystem(IrrigationSystem):
     """Phiên bản demo với thời gian tính bằng giây thay vì phút"""
     
-    def run_calibration_phase(self):
+    def __init__(self, clock=None, **kwargs):
+        """Demo chờ theo giây thật; bơm chạy nhanh gấp 20 lần để không phải chờ T_đầy"""
+        kwargs.setdefault("controller", Controller(clock=AcceleratedClock(speed=20)))
+        super().__init__(clock=clock or RealClock(), **kwargs)
+    
+    async def arun_calibration_phase(self):
         """Giai đoạn 1: Hiệu chỉnh (demo với giây)"""
         print("🔧 === GIAI ĐOẠN HIỆU CHỈNH ===")
         
         # Lấy dữ liệu môi trường
-        env_data = EnvironmentSensor.get_current_environment()
+        env_data = await await_device(self.sensor, "get_current_environment")
         print(f"🌡️ Môi trường: {env_data.nhiệt_độ}°C, {env_data.độ_ẩm}%, ET0: {env_data.et0}")
         
         # Sử dụng thời gian chờ demo (giây thay vì phút)
@@ -43,17 +46,17 @@ class DemoIrrigationSystem(IrrigationSystem):
         
         # Mô phỏng chờ
         print("⏳ Đang chờ... (demo)")
-        time.sleep(initial_wait)  # Chờ thực tế theo giây
+        await self.clock.asleep(initial_wait)  # Chờ theo giây trên đồng hồ
         
         # Thực hiện tưới
-        T_đầy, EC = self.controller.tưới_cho_đến_khi_đầy()
+        T_đầy, EC = await await_device(self.controller, "tưới_cho_đến_khi_đầy")
         
         output_data = OutputData(T_đầy_giây=T_đầy, EC_đo_được=EC)
         
         # Tạo bản ghi hiệu chỉnh
         record = CycleRecord(
             id=self.database.get_next_id(),
-            timestamp=datetime.now().isoformat(),
+            timestamp=self.clock.now().isoformat(),
             phase="calibration",
             input_data=input_data,
             output_data=output_data,
@@ -63,25 +66,27 @@ class DemoIrrigationSystem(IrrigationSystem):
         self.database.add_record(record)
         print(f"✅ Hoàn thành hiệu chỉnh. EC đo được: {EC}")
     
-    def run_operation_cycle(self) -> bool:
+    async def arun_operation_cycle(self) -> bool:
         """Chạy một chu trình vận hành (demo với giây)"""
         print("\n🚀 === CHU TRÌNH VẬN HÀNH (DEMO) ===")
         
         # Bước 1: Chuẩn bị context
         print("📊 Chuẩn bị dữ liệu...")
-        history = self.database.get_recent_records(days=3)
+        history = self.database.get_recent_records(days=3, now=self.clock.now())
         last_record = self.database.get_last_record()
         last_reflection = last_record["reflection_text"] if last_record else ""
         
-        current_env = EnvironmentSensor.get_current_environment()
-        forecast = EnvironmentSensor.get_weather_forecast()
+        current_env, forecast = await asyncio.gather(
+            await_device(self.sensor, "get_current_environment"),
+            await_device(self.sensor, "get_weather_forecast")
+        )
         
         print(f"🌡️ Môi trường hiện tại: {current_env.nhiệt_độ}°C, {current_env.độ_ẩm}%")
         print(f"🌤️ Dự báo: {forecast}")
         
         # Bước 2: Plan Agent quyết định (điều chỉnh cho demo)
         print("🧠 Plan Agent đang phân tích...")
-        decision = self.plan_agent.decide_next_wait_time(
+        decision = await self.plan_agent.adecide_next_wait_time(
             last_reflection=last_reflection,
             history=history,
             current_env={
@@ -102,14 +107,14 @@ class DemoIrrigationSystem(IrrigationSystem):
         
         # Bước 3: Chờ thực tế
         print(f"⏳ Đang chờ {T_chờ_giây_demo} giây...")
-        time.sleep(T_chờ_giây_demo)
+        await self.clock.asleep(T_chờ_giây_demo)
         
         # Bước 4: Thực hiện tưới
-        T_đầy_mới, EC_mới = self.controller.tưới_cho_đến_khi_đầy()
+        T_đầy_mới, EC_mới = await await_device(self.controller, "tưới_cho_đến_khi_đầy")
         
         # Bước 5: Reflection Agent phản tư
         print("🤔 Reflection Agent đang phân tích...")
-        reflection_text = self.reflection_agent.create_reflection(
+        reflection_text = await self.reflection_agent.acreate_reflection(
             input_data={"T_chờ_phút": T_chờ_giây_demo},  # Ghi giây vào field phút
             output_data={"T_đầy_giây": T_đầy_mới, "EC_đo_được": EC_mới}
         )
@@ -130,7 +135,7 @@ class DemoIrrigationSystem(IrrigationSystem):
         
         record = CycleRecord(
             id=self.database.get_next_id(),
-            timestamp=datetime.now().isoformat(),
+            timestamp=self.clock.now().isoformat(),
             phase="operation",
             input_data=input_data,
             output_data=output_data,
@@ -155,7 +160,8 @@ class IrrigationWebUI:
     
     def __init__(self):
         self.irrigation_system = DemoIrrigationSystem()  # Sử dụng phiên bản demo
-        self.database = Database()
+        # Dùng chung Database với hệ thống để không tải lịch sử hai lần
+        self.database = self.irrigation_system.database
         self.is_running = False
         self.auto_mode = False
         
@@ -163,7 +169,7 @@ class IrrigationWebUI:
         """Lấy trạng thái hệ thống hiện tại"""
         try:
             # Thông tin môi trường
-            env_data = EnvironmentSensor.get_current_environment()
+            env_data = self.irrigation_system.sensor.get_current_environment()
             env_info = f"""
             🌡️ **Nhiệt độ:** {env_data.nhiệt_độ}°C
             💧 **Độ ẩm:** {env_data.độ_ẩm}%
@@ -172,7 +178,7 @@ class IrrigationWebUI:
             
             # Thông tin hệ thống
             last_record = self.database.get_last_record()
-            total_cycles = len(self.database.data)
+            total_cycles = self.database.count_records()
             
             if last_record:
                 last_ec = last_record["output_data"]["EC_đo_được"]
@@ -206,7 +212,7 @@ class IrrigationWebUI:
             self.is_running = True
             
             # Kiểm tra nếu cần hiệu chỉnh
-            if not self.database.data:
+            if self.database.get_last_record() is None:
                 self.irrigation_system.run_calibration_phase()
                 result = "✅ **Hoàn thành chu trình hiệu chỉnh**\\n\\nHệ thống đã được khởi tạo thành công."
             else:
@@ -234,33 +240,33 @@ class IrrigationWebUI:
             self.is_running = False
             return f"❌ **Lỗi:** {str(e)}"
     
+    def get_history_window(self) -> HistoryWindow:
+        """Lấy 30 ngày lịch sử dưới dạng các cột NumPy"""
+        return self.database.get_recent_window(days=30, now=self.irrigation_system.clock.now())
+    
     def get_history_data(self) -> pd.DataFrame:
         """Lấy dữ liệu lịch sử dưới dạng DataFrame"""
-        history = self.database.get_recent_records(days=30)
+        window = self.get_history_window()
         
-        if not history:
+        if not len(window):
             return pd.DataFrame()
         
-        data = []
-        for record in history:
-            data.append({
-                'ID': record['id'],
-                'Thời gian': record['timestamp'][:19],
-                'Giai đoạn': record['phase'],
-                'Thời gian chờ (giây)': record['input_data']['T_chờ_phút'],  # Đổi label thành giây
-                'Thời gian tưới (giây)': record['output_data']['T_đầy_giây'],
-                'EC đo được': record['output_data']['EC_đo_được'],
-                'Nhiệt độ (°C)': record['input_data']['môi_trường_tb']['nhiệt_độ'],
-                'Độ ẩm (%)': record['input_data']['môi_trường_tb']['độ_ẩm']
-            })
-        
-        return pd.DataFrame(data)
+        return pd.DataFrame({
+            'ID': window['id'],
+            'Thời gian': window['time_label'],
+            'Giai đoạn': window.phase_labels,
+            'Thời gian chờ (giây)': window['T_chờ'].astype(int),  # Đổi label thành giây
+            'Thời gian tưới (giây)': window['T_đầy'].astype(int),
+            'EC đo được': window['EC'],
+            'Nhiệt độ (°C)': window['nhiệt_độ'],
+            'Độ ẩm (%)': window['độ_ẩm']
+        })
     
     def create_ec_chart(self) -> go.Figure:
         """Tạo biểu đồ EC theo thời gian"""
-        df = self.get_history_data()
+        window = self.get_history_window()
         
-        if df.empty:
+        if not len(window):
             fig = go.Figure()
             fig.add_annotation(
                 text="Chưa có dữ liệu để hiển thị",
@@ -274,14 +280,23 @@ class IrrigationWebUI:
         
         # Đường EC thực tế
         fig.add_trace(go.Scatter(
-            x=df['Thời gian'],
-            y=df['EC đo được'],
+            x=window['time_label'],
+            y=window['EC'],
             mode='lines+markers',
             name='EC đo được',
             line=dict(color='blue', width=2),
             marker=dict(size=6)
         ))
         
+        # Trung bình trượt EC
+        fig.add_trace(go.Scatter(
+            x=window['time_label'],
+            y=rolling_mean(window['EC'], 5),
+            mode='lines',
+            name='EC trung bình trượt (5)',
+            line=dict(color='orange', width=1, dash='dot')
+        ))
+        
         # Đường EC mục tiêu
         fig.add_hline(
             y=self.irrigation_system.target_ec,
@@ -302,9 +317,9 @@ class IrrigationWebUI:
     
     def create_environment_chart(self) -> go.Figure:
         """Tạo biểu đồ môi trường"""
-        df = self.get_history_data()
+        window = self.get_history_window()
         
-        if df.empty:
+        if not len(window):
             fig = go.Figure()
             fig.add_annotation(
                 text="Chưa có dữ liệu để hiển thị",
@@ -318,8 +333,8 @@ class IrrigationWebUI:
         
         # Nhiệt độ
         fig.add_trace(go.Scatter(
-            x=df['Thời gian'],
-            y=df['Nhiệt độ (°C)'],
+            x=window['time_label'],
+            y=window['nhiệt_độ'],
             mode='lines+markers',
             name='Nhiệt độ (°C)',
             yaxis='y',
@@ -328,8 +343,8 @@ class IrrigationWebUI:
         
         # Độ ẩm
         fig.add_trace(go.Scatter(
-            x=df['Thời gian'],
-            y=df['Độ ẩm (%)'],
+            x=window['time_label'],
+            y=window['độ_ẩm'],
             mode='lines+markers',
             name='Độ ẩm (%)',
             yaxis='y2',
@@ -349,17 +364,17 @@ class IrrigationWebUI:
     
     def get_data_analysis(self) -> str:
         """Phân tích dữ liệu và đưa ra khuyến nghị"""
-        df = self.get_history_data()
+        aggregates = self.database.aggregates
         
-        if df.empty:
+        if not aggregates.count:
             return "📭 **Chưa có dữ liệu để phân tích**\\n\\nHãy chạy ít nhất một chu trình tưới để có dữ liệu phân tích."
         
         # Thống kê cơ bản
-        ec_avg = df['EC đo được'].mean()
-        ec_std = df['EC đo được'].std()
-        wait_avg = df['Thời gian chờ (giây)'].mean()  # Đổi thành giây
-        temp_avg = df['Nhiệt độ (°C)'].mean()
-        humidity_avg = df['Độ ẩm (%)'].mean()
+        ec_avg = aggregates.mean('EC')
+        ec_std = aggregates.std('EC')
+        wait_avg = aggregates.mean('T_chờ')  # Đổi thành giây
+        temp_avg = aggregates.mean('nhiệt_độ')
+        humidity_avg = aggregates.mean('độ_ẩm')
         
         # Đánh giá hiệu suất
         target_ec = self.irrigation_system.target_ec
@@ -375,9 +390,9 @@ class IrrigationWebUI:
             performance = "❌ **Cần xem xét** - Hệ thống cần kiểm tra lại"
         
         # Xu hướng
-        if len(df) >= 3:
-            recent_ec = df['EC đo được'].tail(3).mean()
-            earlier_ec = df['EC đo được'].head(3).mean()
+        if aggregates.count >= 3:
+            recent_ec = aggregates.recent_ec
+            earlier_ec = aggregates.earlier_ec
             
             if abs(recent_ec - target_ec) < abs(earlier_ec - target_ec):
                 trend = "📈 **Đang cải thiện** - Hệ thống học tốt"
@@ -401,7 +416,9 @@ class IrrigationWebUI:
         - **Thời gian chờ trung bình:** {wait_avg:.1f} giây (demo)
         - **Nhiệt độ trung bình:** {temp_avg:.1f}°C
         - **Độ ẩm trung bình:** {humidity_avg:.1f}%
-        - **Tổng số chu trình:** {len(df)}
+        - **Sai số EC gần đây (EWMA):** {aggregates.ewma_ec_error:+.2f}
+        - **EC trung bình {aggregates.window_size} chu trình gần nhất:** {aggregates.rolling['EC'].mean:.2f}
+        - **Tổng số chu trình:** {aggregates.count}
         
         ### 💡 Khuyến nghị
         """
@@ -10,8 +10,9 @@ from typing import Dict, List, Optional
 import queue
 
 # Import các component từ project
+from clock import AcceleratedClock
 from components import (
-    Controller, Database, EnvironmentSensor, 
+    Controller, create_database, EnvironmentSensor, 
     CycleRecord, InputData, OutputData, EnvironmentData
 )
 from agents import ReflectionAgent, PlanAgent
@@ -20,8 +21,9 @@ class RealTimeIrrigationApp:
     """Ứng dụng Gradio cho hệ thống tưới thời gian thực"""
     
     def __init__(self):
-        self.controller = Controller()
-        self.database = Database()
+        # Bơm chạy nhanh gấp 20 lần như bản demo, không phải chờ T_đầy thật
+        self.controller = Controller(clock=AcceleratedClock(speed=20))
+        self.database = create_database()
         self.reflection_agent = ReflectionAgent()
         self.plan_agent = PlanAgent()
         self.target_ec = 4.0
@@ -282,7 +284,7 @@ class RealTimeIrrigationApp:
         self.add_log("🌱 Khởi động hệ thống tưới tự động", "SUCCESS")
         
         # Chạy hiệu chỉnh nếu chưa có dữ liệu
-        if not self.database.data:
+        if self.database.get_last_record() is None:
             self.add_log("🔧 Chạy hiệu chỉnh ban đầu...", "INFO")
             env_data = EnvironmentSensor.get_current_environment()
             input_data = InputData(T_chờ_phút=120, môi_trường_tb=env_data)
@@ -0,0 +1,146 @@
+"""
+Kho lịch sử dạng cột (NumPy) phục vụ phân tích chu trình tưới
+Luôn được sắp theo thời gian để cắt cửa sổ bằng searchsorted, không sao chép
+"""
+
+from datetime import datetime
+from typing import Dict, Iterable, Optional
+
+import numpy as np
+
+PHASES = ("calibration", "operation")
+
+# Tên cột -> kiểu dữ liệu
+COLUMNS = {
+    "timestamp": np.float64,      # epoch giây
+    "time_label": "<U19",         # "YYYY-MM-DDTHH:MM:SS" để hiển thị
+    "id": np.int64,
+    "phase": np.int8,             # chỉ số trong PHASES
+    "T_chờ": np.float64,
+    "T_đầy": np.float64,
+    "EC": np.float64,
+    "nhiệt_độ": np.float64,
+    "độ_ẩm": np.float64,
+    "et0": np.float64,
+}
+
+
+def rolling_mean(values: np.ndarray, window: int) -> np.ndarray:
+    """Trung bình trượt (cửa sổ co lại ở đầu chuỗi) tính bằng tổng tích lũy"""
+    if len(values) == 0:
+        return values.astype(np.float64)
+    csum = np.concatenate(([0.0], np.cumsum(values, dtype=np.float64)))
+    ends = np.arange(1, len(values) + 1)
+    starts = np.maximum(ends - window, 0)
+    return (csum[ends] - csum[starts]) / (ends - starts)
+
+
+def rolling_std(values: np.ndarray, window: int) -> np.ndarray:
+    """Độ lệch chuẩn trượt (quần thể) tính bằng tổng tích lũy bậc hai"""
+    if len(values) == 0:
+        return values.astype(np.float64)
+    values = values.astype(np.float64)
+    mean = rolling_mean(values, window)
+    mean_sq = rolling_mean(values * values, window)
+    return np.sqrt(np.maximum(mean_sq - mean * mean, 0.0))
+
+
+class HistoryWindow:
+    """Một khoảng thời gian của lịch sử; mọi cột là view của kho gốc"""
+
+    def __init__(self, columns: Dict[str, np.ndarray]):
+        self.columns = columns
+
+    def __len__(self) -> int:
+        return len(self.columns["timestamp"])
+
+    def __getitem__(self, name: str) -> np.ndarray:
+        return self.columns[name]
+
+    @property
+    def phase_labels(self) -> np.ndarray:
+        """Nhãn giai đoạn dạng chuỗi"""
+        return np.asarray(PHASES)[self.columns["phase"]]
+
+    def head(self, n: int) -> "HistoryWindow":
+        return HistoryWindow({name: col[:n] for name, col in self.columns.items()})
+
+    def tail(self, n: int) -> "HistoryWindow":
+        return HistoryWindow({name: col[max(len(self) - n, 0):] for name, col in self.columns.items()})
+
+    def mean(self, name: str) -> float:
+        return float(self.columns[name].mean()) if len(self) else float("nan")
+
+    def std(self, name: str) -> float:
+        """Độ lệch chuẩn mẫu (ddof=1) giống pandas"""
+        return float(self.columns[name].std(ddof=1)) if len(self) > 1 else float("nan")
+
+
+class ColumnarHistory:
+    """Các mảng NumPy có kiểu cho từng trường của bản ghi, đồng bộ với Database"""
+
+    def __init__(self, capacity: int = 256):
+        self._size = 0
+        self._buffers = {name: np.empty(capacity, dtype=dtype) for name, dtype in COLUMNS.items()}
+
+    @classmethod
+    def from_records(cls, records: Iterable[Dict], epochs: Iterable[Optional[float]]) -> "ColumnarHistory":
+        """Dựng kho cột từ các bản ghi và epoch đã phân tích sẵn"""
+        rows = [(epoch, record) for epoch, record in zip(epochs, records) if epoch is not None]
+        rows.sort(key=lambda row: row[0])
+        history = cls(capacity=max(256, len(rows) * 2))
+        for epoch, record in rows:
+            history._write(history._size, epoch, record)
+            history._size += 1
+        return history
+
+    def __len__(self) -> int:
+        return self._size
+
+    def _grow(self):
+        """Nhân đôi dung lượng khi đầy"""
+        for name, buf in self._buffers.items():
+            bigger = np.empty(len(buf) * 2, dtype=buf.dtype)
+            bigger[:self._size] = buf[:self._size]
+            self._buffers[name] = bigger
+
+    def _write(self, slot: int, epoch: float, record: Dict):
+        """Ghi một bản ghi vào hàng slot"""
+        env = record["input_data"]["môi_trường_tb"]
+        row = {
+            "timestamp": epoch,
+            "time_label": record["timestamp"][:19],
+            "id": record["id"],
+            "phase": PHASES.index(record["phase"]) if record["phase"] in PHASES else 1,
+            "T_chờ": record["input_data"]["T_chờ_phút"],
+            "T_đầy": record["output_data"]["T_đầy_giây"],
+            "EC": record["output_data"]["EC_đo_được"],
+            "nhiệt_độ": env["nhiệt_độ"],
+            "độ_ẩm": env["độ_ẩm"],
+            "et0": env["et0"],
+        }
+        for name, value in row.items():
+            self._buffers[name][slot] = value
+
+    def append(self, record: Dict, epoch: Optional[float]):
+        """Thêm bản ghi, giữ thứ tự thời gian kể cả khi đến muộn"""
+        if epoch is None:
+            return
+        if self._size == len(self._buffers["timestamp"]):
+            self._grow()
+
+        times = self._buffers["timestamp"]
+        slot = self._size
+        if self._size and epoch < times[self._size - 1]:
+            slot = int(np.searchsorted(times[:self._size], epoch, side="right"))
+            for buf in self._buffers.values():
+                buf[slot + 1:self._size + 1] = buf[slot:self._size]
+        self._write(slot, epoch, record)
+        self._size += 1
+
+    def window(self, start: Optional[datetime] = None, end: Optional[datetime] = None) -> HistoryWindow:
+        """Cắt các cột theo khoảng [start, end] (view, không sao chép)"""
+        times = self._buffers["timestamp"][:self._size]
+        lo = 0 if start is None else int(np.searchsorted(times, start.timestamp(), side="left"))
+        hi = self._size if end is None else int(np.searchsorted(times, end.timestamp(), side="right"))
+        return HistoryWindow({name: buf[lo:hi] for name, buf in self._buffers.items()})
@@ -0,0 +1,339 @@
+"""
+Lưu lịch sử theo phân đoạn thời gian (mỗi ngày hoặc theo dung lượng)
+Phân đoạn đã đóng được nén nền, chính sách lưu giữ xóa hoặc lưu trữ phân đoạn cũ
+"""
+
+import gzip
+import json
+import os
+import shutil
+import threading
+import time
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional
+
+MANIFEST_FILE = "manifest.json"
+ARCHIVE_DIR = "archive"
+
+
+class SegmentStore:
+    """Thư mục các file JSONL theo phân đoạn, được theo dõi bởi một manifest nhỏ"""
+
+    def __init__(self,
+                 directory: str,
+                 segment_by: str = "day",
+                 max_segment_bytes: int = 4 * 1024 * 1024,
+                 retention_days: int = 0,
+                 retention_action: str = "archive",
+                 fsync_every: int = 1):
+        """
+        segment_by: "day" (một file mỗi ngày) hoặc "size" (cắt theo max_segment_bytes)
+        retention_days: số ngày giữ phân đoạn (0 = giữ mãi)
+        retention_action: "archive" (chuyển vào thư mục archive) hoặc "delete"
+        """
+        if segment_by not in ("day", "size"):
+            raise ValueError(f"Kiểu phân đoạn không hợp lệ: {segment_by}")
+        if retention_action not in ("archive", "delete"):
+            raise ValueError(f"Hành động lưu giữ không hợp lệ: {retention_action}")
+        self.directory = directory
+        self.segment_by = segment_by
+        self.max_segment_bytes = max_segment_bytes
+        self.retention_days = retention_days
+        self.retention_action = retention_action
+        self.fsync_every = fsync_every
+
+        self._lock = threading.Lock()
+        self._workers: List[threading.Thread] = []
+        self._handle = None
+        self._unsynced = 0
+
+        # Nén và lưu giữ chạy tuần tự để không cùng lúc đụng vào một phân đoạn
+        self._maintenance_lock = threading.Lock()
+
+        os.makedirs(directory, exist_ok=True)
+        self._next_seq = 0
+        self.segments: List[Dict] = self._load_manifest()
+        self._recover_open_segment()
+
+    # ---------- Manifest ----------
+
+    def _manifest_path(self) -> str:
+        return os.path.join(self.directory, MANIFEST_FILE)
+
+    def _load_manifest(self) -> List[Dict]:
+        try:
+            with open(self._manifest_path(), 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+        except FileNotFoundError:
+            return []
+        self._next_seq = manifest["next_seq"]
+        return manifest["segments"]
+
+    def _save_manifest(self):
+        """Ghi manifest nguyên tử (file tạm + đổi tên); gọi khi đang giữ khóa"""
+        tmp_path = self._manifest_path() + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            manifest = {"version": 1, "next_seq": self._next_seq, "segments": self.segments}
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self._manifest_path())
+
+    def _segment_path(self, segment: Dict) -> str:
+        return os.path.join(self.directory, segment["file"])
+
+    def _recover_open_segment(self):
+        """
+        Dựng lại thống kê của phân đoạn đang mở (manifest chỉ ghi khi cuộn)
+        Chỉ cắt dòng cuối bị ghi dở; dòng hỏng mà phía sau vẫn còn dữ liệu thì báo lỗi
+        Raises: json.JSONDecodeError nếu phân đoạn hỏng giữa chừng
+        """
+        segment = self._open_segment()
+        if segment is None:
+            return
+        path = self._segment_path(segment)
+        start, end, count, good_offset = None, None, 0, 0
+        try:
+            with open(path, 'rb') as f:
+                for line in f:
+                    if not line.strip():
+                        good_offset += len(line)
+                        continue
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        # Chỉ dòng cuối mới có thể bị ghi dở khi mất điện
+                        if f.read().strip():
+                            raise
+                        print(f"⚠️ Bỏ qua dòng cuối bị hỏng trong {path}")
+                        break
+                    epoch = _epoch(record)
+                    if epoch is not None:
+                        start = epoch if start is None else min(start, epoch)
+                        end = epoch if end is None else max(end, epoch)
+                    count += 1
+                    good_offset += len(line)
+        except FileNotFoundError:
+            pass
+        if os.path.exists(path) and good_offset < os.path.getsize(path):
+            with open(path, 'r+b') as f:
+                f.truncate(good_offset)
+        segment.update(start=start, end=end, count=count, bytes=good_offset)
+
+    def _open_segment(self) -> Optional[Dict]:
+        if self.segments and not self.segments[-1]["closed"]:
+            return self.segments[-1]
+        return None
+
+    # ---------- Ghi ----------
+
+    def _segment_key(self, epoch: Optional[float]) -> str:
+        moment = datetime.fromtimestamp(epoch) if epoch is not None else datetime.now()
+        return moment.strftime("%Y-%m-%d")
+
+    def _needs_roll(self, segment: Dict, key: str) -> bool:
+        if self.segment_by == "day":
+            return segment["key"] != key
+        return segment["bytes"] >= self.max_segment_bytes
+
+    def append(self, record: Dict, epoch: Optional[float]):
+        """Ghi thêm bản ghi vào phân đoạn đang mở, cuộn sang phân đoạn mới khi cần"""
+        key = self._segment_key(epoch)
+        line = (json.dumps(record, ensure_ascii=False) + "\n").encode('utf-8')
+
+        with self._lock:
+            segment = self._open_segment()
+            if segment is not None and self._needs_roll(segment, key):
+                self._close_segment(segment)
+                segment = None
+            if segment is None:
+                segment = self._new_segment(key)
+
+            if self._handle is None:
+                self._handle = open(self._segment_path(segment), 'ab')
+            self._handle.write(line)
+            self._handle.flush()
+            self._unsynced += 1
+            if self.fsync_every and self._unsynced >= self.fsync_every:
+                self._sync_locked()
+
+            if epoch is not None:
+                segment["start"] = epoch if segment["start"] is None else min(segment["start"], epoch)
+                segment["end"] = epoch if segment["end"] is None else max(segment["end"], epoch)
+            segment["count"] += 1
+            segment["bytes"] += len(line)
+
+    def _new_segment(self, key: str) -> Dict:
+        sequence = self._next_seq
+        self._next_seq += 1
+        segment = {
+            "seq": sequence,
+            "key": key,
+            "file": f"{key}_{sequence:05d}.jsonl",
+            "start": None,
+            "end": None,
+            "count": 0,
+            "bytes": 0,
+            "closed": False,
+            "compressed": False,
+        }
+        self.segments.append(segment)
+        self._save_manifest()
+        return segment
+
+    def _close_segment(self, segment: Dict):
+        """Đóng phân đoạn hiện tại, lên lịch nén và áp dụng chính sách lưu giữ ở nền"""
+        self._sync_locked()
+        if self._handle is not None:
+            self._handle.close()
+            self._handle = None
+        segment["closed"] = True
+        self._save_manifest()
+
+        worker = threading.Thread(target=self._maintain, args=(segment["seq"],), daemon=True)
+        self._workers = [w for w in self._workers if w.is_alive()] + [worker]
+        worker.start()
+
+    def _sync_locked(self):
+        if self._handle is not None and self._unsynced:
+            self._handle.flush()
+            os.fsync(self._handle.fileno())
+        self._unsynced = 0
+
+    def sync(self):
+        with self._lock:
+            self._sync_locked()
+
+    def close(self):
+        """fsync, đóng file và chờ các tác vụ nền kết thúc"""
+        with self._lock:
+            self._sync_locked()
+            if self._handle is not None:
+                self._handle.close()
+                self._handle = None
+            self._save_manifest()
+        for worker in self._workers:
+            worker.join()
+        self._workers = []
+
+    # ---------- Bảo trì nền ----------
+
+    def _maintain(self, sequence: int):
+        with self._maintenance_lock:
+            self.compact(sequence)
+            self.apply_retention()
+
+    def compact(self, sequence: int):
+        """Nén gzip một phân đoạn đã đóng, bỏ các dòng hỏng"""
+        with self._lock:
+            segment = next((s for s in self.segments if s["seq"] == sequence), None)
+            if segment is None or not segment["closed"] or segment["compressed"]:
+                return
+            source = self._segment_path(segment)
+
+        # Phân đoạn đã đóng không còn bị ghi nên có thể nén ngoài khóa
+        target = source + ".gz"
+        with open(source, 'rb') as src, gzip.open(target + ".tmp", 'wb') as dst:
+            for line in src:
+                if line.strip():
+                    try:
+                        json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    dst.write(line if line.endswith(b"\n") else line + b"\n")
+        os.replace(target + ".tmp", target)
+
+        with self._lock:
+            segment["file"] += ".gz"
+            segment["compressed"] = True
+            segment["bytes"] = os.path.getsize(target)
+            self._save_manifest()
+        os.remove(source)
+
+    def apply_retention(self, now: Optional[float] = None):
+        """Xóa hoặc lưu trữ các phân đoạn đã đóng cũ hơn retention_days"""
+        if not self.retention_days:
+            return
+        cutoff = (now or time.time()) - self.retention_days * 86400
+        with self._lock:
+            expired = [s for s in self.segments
+                       if s["closed"] and s["end"] is not None and s["end"] < cutoff]
+            if not expired:
+                return
+            for segment in expired:
+                path = self._segment_path(segment)
+                if self.retention_action == "archive":
+                    archive_dir = os.path.join(self.directory, ARCHIVE_DIR)
+                    os.makedirs(archive_dir, exist_ok=True)
+                    shutil.move(path, os.path.join(archive_dir, segment["file"]))
+                elif os.path.exists(path):
+                    os.remove(path)
+            self.segments = [s for s in self.segments if s not in expired]
+            self._save_manifest()
+            print(f"🗄️ Đã xử lý {len(expired)} phân đoạn quá hạn ({self.retention_action})")
+
+    # ---------- Đọc ----------
+
+    def count(self) -> int:
+        return sum(segment["count"] for segment in self.segments)
+
+    def _read_segment(self, segment: Dict) -> Iterator[Dict]:
+        path = self._segment_path(segment)
+        if not segment["compressed"] and not os.path.exists(path):
+            # Phân đoạn vừa được nén bởi tác vụ nền sau khi chụp manifest
+            path += ".gz"
+        opener = gzip.open if path.endswith(".gz") else open
+        try:
+            with opener(path, 'rb') as f:
+                for line in f:
+                    if line.strip():
+                        try:
+                            yield json.loads(line)
+                        except json.JSONDecodeError:
+                            return
+        except FileNotFoundError:
+            # Phân đoạn vừa bị xóa bởi chính sách lưu giữ
+            return
+
+    def _snapshot(self) -> List[Dict]:
+        with self._lock:
+            if self._handle is not None:
+                self._handle.flush()
+            return [dict(segment) for segment in self.segments]
+
+    def iter_all(self) -> Iterator[Dict]:
+        """Duyệt toàn bộ bản ghi theo thứ tự phân đoạn"""
+        for segment in self._snapshot():
+            yield from self._read_segment(segment)
+
+    def iter_range(self, start: float, end: float) -> Iterator[Dict]:
+        """Chỉ mở các phân đoạn giao với [start, end]"""
+        for segment in self._snapshot():
+            if segment["start"] is None or segment["end"] < start or segment["start"] > end:
+                continue
+            for record in self._read_segment(segment):
+                epoch = _epoch(record)
+                if epoch is not None and start <= epoch <= end:
+                    yield record
+
+    def load_tail(self, n: int = 0) -> List[Dict]:
+        """n bản ghi cuối cùng (0 = tất cả), chỉ đọc các phân đoạn mới nhất cần thiết"""
+        if not n:
+            return list(self.iter_all())
+        chunks = []
+        collected = 0
+        for segment in reversed(self._snapshot()):
+            records = list(self._read_segment(segment))
+            chunks.append(records)
+            collected += len(records)
+            if collected >= n:
+                break
+        records = [record for chunk in reversed(chunks) for record in chunk]
+        return records[-n:]
+
+
+def _epoch(record: Dict) -> Optional[float]:
+    try:
+        return datetime.fromisoformat(record.get("timestamp")).timestamp()
+    except (TypeError, ValueError):
+        return None
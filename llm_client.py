@@ -0,0 +1,258 @@
+"""
+Lớp gọi LLM dùng chung: giới hạn số yêu cầu đồng thời theo nhà cung cấp,
+thử lại có jitter cho lỗi tạm thời, timeout và cầu dao (circuit breaker)
+Khi cầu dao mở, lời gọi thất bại ngay để agent dùng logic fallback tất định
+"""
+
+import asyncio
+import os
+import random
+import threading
+import time
+from typing import Callable, Dict, Optional
+
+from deadline import DeadlineExceeded, current_deadline, within
+
+# Mã HTTP coi là lỗi tạm thời của nhà cung cấp
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
+
+
+class CircuitOpenError(Exception):
+    """Cầu dao đang mở: không gọi nhà cung cấp"""
+
+
+def is_retryable(error: Exception) -> bool:
+    """Timeout, lỗi kết nối, quá tải (429) và lỗi 5xx"""
+    if isinstance(error, (asyncio.TimeoutError, TimeoutError, ConnectionError)):
+        return True
+    status = getattr(error, "status_code", None)
+    return status in RETRYABLE_STATUS
+
+
+class CircuitBreaker:
+    """
+    closed -> open sau `failure_threshold` lỗi tạm thời liên tiếp;
+    open -> half_open sau `reset_timeout` giây, cho một yêu cầu thử;
+    thử thành công thì đóng lại, thất bại hoặc bỏ dở (release_probe) thì mở tiếp
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0,
+                 time_source: Callable[[], float] = time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.time_source = time_source
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.opens = 0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open" and self.time_source() - self.opened_at >= self.reset_timeout:
+                self.state = "half_open"
+                self._probing = False
+            if self.state == "half_open" and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state, self.failures, self._probing = "closed", 0, False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == "half_open" or self.failures >= self.failure_threshold:
+                if self.state != "open":
+                    self.opens += 1
+                    print(f"🔌 Cầu dao LLM mở sau {self.failures} lỗi liên tiếp")
+                self.state, self.opened_at, self._probing = "open", self.time_source(), False
+
+    def release_probe(self):
+        """
+        Lời gọi kết thúc mà không ghi nhận kết quả (bị hủy, hết hạn chót): nếu đó
+        là yêu cầu thử thì mở lại cầu dao với mốc thời gian mới để lượt thử sau
+        không bị chặn mãi ở half_open
+        """
+        with self._lock:
+            if self.state == "half_open" and self._probing:
+                self.state, self.opened_at, self._probing = "open", self.time_source(), False
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            return {"state": self.state, "consecutive_failures": self.failures, "opens": self.opens}
+
+
+class LLMClient:
+    """Bọc agent.run/arun của một nhà cung cấp"""
+
+    def __init__(self,
+                 provider: str,
+                 max_concurrency: Optional[int] = None,
+                 retries: Optional[int] = None,
+                 base_delay: float = 0.5,
+                 max_delay: float = 8.0,
+                 timeout: Optional[float] = None,
+                 breaker: Optional[CircuitBreaker] = None):
+        """
+        max_concurrency: số yêu cầu đang bay tối đa tới nhà cung cấp
+        retries: số lần thử lại cho lỗi tạm thời
+        base_delay, max_delay: backoff lũy thừa có jitter đầy đủ (giây)
+        timeout: thời gian tối đa mỗi lần gọi async (giây)
+        """
+        self.provider = provider
+        self.max_concurrency = max_concurrency or int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+        self.retries = retries if retries is not None else int(os.getenv("LLM_RETRIES", "2"))
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.timeout = timeout or float(os.getenv("LLM_TIMEOUT", "30"))
+        self.breaker = breaker or CircuitBreaker(
+            failure_threshold=int(os.getenv("LLM_BREAKER_THRESHOLD", "5")),
+            reset_timeout=float(os.getenv("LLM_BREAKER_RESET", "30")),
+        )
+        # Giới hạn cho lời gọi đồng bộ (mọi luồng) và cho từng event loop
+        self._sync_slots = threading.BoundedSemaphore(self.max_concurrency)
+        self._async_slots: Dict[asyncio.AbstractEventLoop, asyncio.Semaphore] = {}
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.calls = 0
+        self.retried = 0
+        self.failures = 0
+        self.rejected = 0
+
+    def _backoff(self, attempt: int) -> float:
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def _admit(self):
+        if not self.breaker.allow():
+            with self._lock:
+                self.rejected += 1
+            raise CircuitOpenError(f"Cầu dao {self.provider} đang mở, dùng fallback")
+
+    def _track(self, delta: int):
+        with self._lock:
+            self.in_flight += delta
+            if delta > 0:
+                self.calls += 1
+
+    def _on_error(self, error: Exception, attempt: int) -> bool:
+        """Ghi nhận lỗi; True nếu nên thử lại"""
+        if not is_retryable(error):
+            # Nhà cung cấp vẫn trả lời (vd. 400): không tính vào cầu dao
+            self.breaker.record_success()
+            return False
+        self.breaker.record_failure()
+        with self._lock:
+            self.failures += 1
+        if attempt >= self.retries or self.breaker.state == "open":
+            return False
+        with self._lock:
+            self.retried += 1
+        return True
+
+    def call(self, agent, prompt: str):
+        """agent.run(prompt) với giới hạn đồng thời, thử lại và cầu dao"""
+        for attempt in range(self.retries + 1):
+            self._admit()
+            recorded = False
+            try:
+                with self._sync_slots:
+                    self._track(1)
+                    try:
+                        response = agent.run(prompt)
+                    except Exception as e:
+                        recorded = True
+                        if not self._on_error(e, attempt):
+                            raise
+                    else:
+                        recorded = True
+                        self.breaker.record_success()
+                        return response
+                    finally:
+                        self._track(-1)
+            finally:
+                if not recorded:
+                    self.breaker.release_probe()
+            time.sleep(self._backoff(attempt))
+
+    async def acall(self, agent, prompt: str):
+        """
+        Như call nhưng dùng agent.arun, có timeout cho mỗi lần gọi; trong một
+        hạn chót (deadline.py) timeout và số lần thử lại bị giới hạn theo thời gian còn lại
+        Raises: DeadlineExceeded khi hết hạn chót (không tính là lỗi của nhà cung cấp;
+        nếu đó là yêu cầu thử thì cầu dao mở lại qua release_probe)
+        """
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            slots = self._async_slots.setdefault(loop, asyncio.Semaphore(self.max_concurrency))
+        deadline = current_deadline()
+        for attempt in range(self.retries + 1):
+            self._admit()
+            # Hủy, hết hạn chót khi chờ slot hoặc khi đang gọi: không ghi nhận kết quả
+            recorded = False
+            try:
+                await within(slots.acquire(), "llm_queue")
+                timeout = min(self.timeout, deadline.remaining()) if deadline else self.timeout
+                self._track(1)
+                try:
+                    response = await asyncio.wait_for(agent.arun(prompt), timeout)
+                except asyncio.TimeoutError as e:
+                    if timeout < self.timeout:
+                        raise DeadlineExceeded(f"llm: vượt {timeout:.1f}s còn lại") from None
+                    recorded = True
+                    if not self._on_error(e, attempt):
+                        raise
+                except Exception as e:
+                    recorded = True
+                    if not self._on_error(e, attempt):
+                        raise
+                else:
+                    recorded = True
+                    self.breaker.record_success()
+                    return response
+                finally:
+                    self._track(-1)
+                    slots.release()
+            finally:
+                if not recorded:
+                    self.breaker.release_probe()
+            delay = self._backoff(attempt)
+            if deadline is not None and delay >= deadline.remaining():
+                raise DeadlineExceeded("llm: không đủ thời gian để thử lại")
+            await asyncio.sleep(delay)
+
+    def status(self) -> Dict:
+        with self._lock:
+            counters = {
+                "in_flight": self.in_flight,
+                "max_concurrency": self.max_concurrency,
+                "calls": self.calls,
+                "retried": self.retried,
+                "failures": self.failures,
+                "rejected": self.rejected,
+            }
+        return {"provider": self.provider, **counters, "breaker": self.breaker.snapshot()}
+
+
+_clients: Dict[str, LLMClient] = {}
+_clients_lock = threading.Lock()
+
+
+def get_llm_client(provider: str) -> LLMClient:
+    """LLMClient dùng chung cho một nhà cung cấp"""
+    with _clients_lock:
+        if provider not in _clients:
+            _clients[provider] = LLMClient(provider)
+        return _clients[provider]
+
+
+def llm_clients_status() -> Dict[str, Dict]:
+    """Trạng thái mọi nhà cung cấp (số yêu cầu đang bay, lỗi, cầu dao) cho giám sát"""
+    with _clients_lock:
+        clients = list(_clients.values())
+    return {client.provider: client.status() for client in clients}
@@ -4,158 +4,327 @@ Hệ thống Tưới Tự Động Đối Thoại
 Baseline cuối cùng với vòng lặp phản hồi kép
 """
 
-import time
+import asyncio
+import os
 from datetime import datetime
+from typing import Optional
+
+from clock import create_clock
 from components import (
-    Controller, Database, EnvironmentSensor, 
-    CycleRecord, InputData, OutputData, EnvironmentData
+    Controller, create_database, EnvironmentSensor, await_device,
+    CyclePlan, CycleRecord, InputData, OutputData, EnvironmentData
 )
-from agents import ReflectionAgent, PlanAgent
+from deadline import Deadline, DeadlineExceeded, degradation_counts, degrade, within
+from agents import ReflectionAgent, PlanAgent, shared_batch_reflection_agent
+from llm_client import llm_clients_status
+from speculative_planner import SpeculativePlanner
 
 class IrrigationSystem:
     """Hệ thống tưới tự động chính"""
     
-    def __init__(self):
-        self.controller = Controller()
-        self.database = Database()
-        self.reflection_agent = ReflectionAgent()
-        self.plan_agent = PlanAgent()
-        self.target_ec = 4.0
-        
+    def __init__(self, controller=None, sensor=None, clock=None, database=None,
+                 reflection_agent=None, plan_agent=None, target_ec: float = 4.0,
+                 speculative_planner=None, plan_deadline: Optional[float] = None,
+                 reflection_deadline: Optional[float] = None):
+        """
+        controller, sensor: thiết bị tưới và cảm biến; mặc định là bản mô phỏng
+        ngẫu nhiên, có thể thay bằng SimulatedController/SimulatedEnvironmentSensor
+        clock: đồng hồ cho mọi lệnh chờ và timestamp; mặc định theo CLOCK_MODE
+        reflection_agent: mặc định ReflectionAgent riêng, hoặc lô phản tư dùng chung
+        giữa các vùng khi BATCH_REFLECTION=1
+        target_ec: EC mục tiêu của vùng tưới này
+        speculative_planner: tính trước quyết định trong lúc chờ (mặc định theo SPECULATIVE_PLANNING)
+        plan_deadline, reflection_deadline: hạn chót (giây) cho bước lập kế hoạch và
+        bước phản tư; quá hạn thì dùng câu trả lời tốt nhất đang có thay vì chờ tiếp
+        """
+        self.clock = clock or create_clock()
+        self.controller = controller or Controller(clock=self.clock)
+        self.sensor = sensor or EnvironmentSensor()
+        self.database = database or create_database(target_ec=target_ec)
+        if reflection_agent is None:
+            if os.getenv("BATCH_REFLECTION", "0") == "1":
+                reflection_agent = shared_batch_reflection_agent().for_zone(target_ec)
+            else:
+                reflection_agent = ReflectionAgent(target_ec)
+        self.reflection_agent = reflection_agent
+        self.plan_agent = plan_agent or PlanAgent(target_ec)
+        self.target_ec = target_ec
+        self._loop = None
+        self._pending: Optional[asyncio.Task] = None  # phản tư + lưu trữ đang chạy nền
+        
+        if speculative_planner is None and os.getenv("SPECULATIVE_PLANNING", "0") == "1":
+            speculative_planner = SpeculativePlanner(self.plan_agent, target_ec)
+        self.speculative_planner = speculative_planner
+        self._speculation: Optional[asyncio.Task] = None
+        self._last_ec: Optional[float] = None
+        
+        self.plan_deadline = (plan_deadline if plan_deadline is not None
+                              else float(os.getenv("PLAN_DEADLINE", "90")))
+        self.reflection_deadline = (reflection_deadline if reflection_deadline is not None
+                                    else float(os.getenv("REFLECTION_DEADLINE", "120")))
+        self._last_env: Optional[EnvironmentData] = None  # số đo gần nhất khi cảm biến quá hạn
+        self._last_forecast = ""
+        
+    # ---------- Giao diện đồng bộ (bọc engine async) ----------
+    
     def run_calibration_phase(self):
         """Giai đoạn 1: Hiệu chỉnh"""
+        self._run_sync(self.arun_calibration_phase())
+        
+    def run_operation_cycle(self) -> bool:
+        """
+        Chạy một chu trình vận hành
+        Returns: True nếu tiếp tục, False nếu dừng
+        """
+        return self._run_sync(self.arun_operation_cycle())
+        
+    def run(self, max_cycles: int = 5, interactive: bool = True):
+        """
+        Chạy hệ thống hoàn chỉnh
+        interactive: hỏi người dùng giữa các chu trình (tắt khi chạy kịch bản mô phỏng)
+        """
+        self._run_sync(self.arun(max_cycles, interactive))
+        
+    def _run_sync(self, coroutine):
+        """
+        Chạy coroutine trên event loop riêng của hệ thống; giữ một loop duy nhất
+        để client HTTP của agent không bị gắn vào loop đã đóng giữa các lần gọi
+        """
+        if self._loop is None or self._loop.is_closed():
+            self._loop = asyncio.new_event_loop()
+        result = self._loop.run_until_complete(coroutine)
+        # Người gọi đồng bộ mong bản ghi đã được lưu khi hàm trả về
+        self._loop.run_until_complete(self.aflush())
+        self.database.sync()
+        return result
+        
+    # ---------- Engine async ----------
+    
+    async def aplan_calibration(self) -> CyclePlan:
+        """Chuẩn bị chu trình hiệu chỉnh: đọc môi trường, dùng thời gian chờ mặc định"""
         print("🔧 === GIAI ĐOẠN HIỆU CHỈNH ===")
         
         # Lấy dữ liệu môi trường
-        env_data = EnvironmentSensor.get_current_environment()
+        env_data = await await_device(self.sensor, "get_current_environment")
         print(f"🌡️ Môi trường: {env_data.nhiệt_độ}°C, {env_data.độ_ẩm}%, ET0: {env_data.et0}")
         
         # Sử dụng thời gian chờ mặc định cho hiệu chỉnh
         initial_wait = 120  # phút
-        
-        input_data = InputData(
-            T_chờ_phút=initial_wait,
-            môi_trường_tb=env_data
-        )
-        
         print(f"⏰ Thời gian chờ hiệu chỉnh: {initial_wait} phút")
         
-        # Mô phỏng chờ (rút ngắn cho demo)
-        print("⏳ Đang chờ... (mô phỏng)")
-        time.sleep(2)
-        
-        # Thực hiện tưới
-        T_đầy, EC = self.controller.tưới_cho_đến_khi_đầy()
-        
-        output_data = OutputData(T_đầy_giây=T_đầy, EC_đo_được=EC)
-        
-        # Tạo bản ghi hiệu chỉnh
-        record = CycleRecord(
-            id=self.database.get_next_id(),
-            timestamp=datetime.now().isoformat(),
+        return CyclePlan(
             phase="calibration",
-            input_data=input_data,
-            output_data=output_data,
-            reflection_text="Chu trình hiệu chỉnh ban đầu."
+            T_chờ_phút=initial_wait,
+            lý_do="Chu trình hiệu chỉnh ban đầu.",
+            môi_trường=env_data
         )
         
-        self.database.add_record(record)
-        print(f"✅ Hoàn thành hiệu chỉnh. EC đo được: {EC}")
-        
-    def run_operation_cycle(self) -> bool:
+    async def aplan_cycle(self) -> CyclePlan:
         """
-        Chạy một chu trình vận hành
-        Returns: True nếu tiếp tục, False nếu dừng
+        Bước 1-2 của chu trình vận hành: chuẩn bị context và để Plan Agent quyết định
+        Đọc cảm biến song song với phản tư/lưu trữ của chu trình trước; chỉ
+        chờ kết quả đó ngay trước khi cần đến lịch sử và nhận xét
+        Mọi bước chạy trong hạn chót plan_deadline; bước quá hạn được thay bằng
+        số đo gần nhất, lịch sử đã lưu hoặc quyết định đệm/fallback PI
         """
         print("\n🚀 === CHU TRÌNH VẬN HÀNH ===")
         
+        with Deadline(self.plan_deadline, "plan") as deadline:
+            plan = await self._aplan_within_deadline()
+            plan.suy_giảm = "; ".join(deadline.reasons)
+        
+        # Tính trước nằm ngoài hạn chót của chu trình này
+        if self.speculative_planner is not None:
+            if self._speculation is not None:
+                self._speculation.cancel()
+            self._speculation = asyncio.create_task(self._aspeculate(plan))
+        return plan
+        
+    async def _asense(self, sensing) -> tuple:
+        """Chờ cảm biến trong phần ngân sách của nó; quá hạn thì dùng số đo gần nhất"""
+        try:
+            current_env, forecast = await within(sensing, "sensing", share=0.3)
+        except DeadlineExceeded as e:
+            if self._last_env is None:
+                raise
+            degrade("sensing", f"{e}, dùng số đo gần nhất")
+            return self._last_env, self._last_forecast
+        self._last_env, self._last_forecast = current_env, forecast
+        return current_env, forecast
+        
+    async def _aplan_within_deadline(self) -> CyclePlan:
         # Bước 1: Chuẩn bị context
         print("📊 Chuẩn bị dữ liệu...")
-        history = self.database.get_recent_records(days=3)
-        last_record = self.database.get_last_record()
-        last_reflection = last_record["reflection_text"] if last_record else ""
-        
-        current_env = EnvironmentSensor.get_current_environment()
-        forecast = EnvironmentSensor.get_weather_forecast()
-        
-        print(f"🌡️ Môi trường hiện tại: {current_env.nhiệt_độ}°C, {current_env.độ_ẩm}%")
-        print(f"🌤️ Dự báo: {forecast}")
-        
-        # Bước 2: Plan Agent quyết định
-        print("🧠 Plan Agent đang phân tích...")
-        decision = self.plan_agent.decide_next_wait_time(
-            last_reflection=last_reflection,
-            history=history,
-            current_env={
-                "nhiệt_độ": current_env.nhiệt_độ,
-                "độ_ẩm": current_env.độ_ẩm,
-                "et0": current_env.et0
-            },
-            forecast=forecast
+        sensing = asyncio.gather(
+            await_device(self.sensor, "get_current_environment"),
+            await_device(self.sensor, "get_weather_forecast")
         )
         
-        T_chờ_mới = decision["T_chờ_đề_xuất"]
-        lý_do = decision["lý_do"]
-        
-        print(f"⏰ Quyết định: Chờ {T_chờ_mới} phút")
-        print(f"💭 Lý do: {lý_do}")
+        # Quyết định tính trước trong lúc chờ: không cần chờ phản tư của chu trình trước
+        decision, sensed = None, None
+        if self.speculative_planner is not None and self._last_ec is not None:
+            sensed = current_env, forecast = await self._asense(sensing)
+            decision = self.speculative_planner.take(self._last_ec, forecast)
+            
+        if decision is None:
+            try:
+                # shield: lưu trữ của chu trình trước vẫn chạy tiếp khi quá hạn
+                await within(asyncio.shield(self.aflush()), "history", share=0.4)
+            except DeadlineExceeded as e:
+                degrade("history", f"{e}, dùng lịch sử đã lưu")
+            except Exception:
+                sensing.cancel()
+                await asyncio.gather(sensing, return_exceptions=True)
+                raise
+            history = self.database.get_recent_records(days=3, now=self.clock.now())
+            last_record = self.database.get_last_record()
+            last_reflection = last_record["reflection_text"] if last_record else ""
+            
+            current_env, forecast = sensed or await self._asense(sensing)
+            
+            print(f"🌡️ Môi trường hiện tại: {current_env.nhiệt_độ}°C, {current_env.độ_ẩm}%")
+            print(f"🌤️ Dự báo: {forecast}")
+            
+            # Bước 2: Plan Agent quyết định (lời gọi LLM bị giới hạn theo thời gian còn lại)
+            print("🧠 Plan Agent đang phân tích...")
+            decision = await self.plan_agent.adecide_next_wait_time(
+                last_reflection=last_reflection,
+                history=history,
+                current_env={
+                    "nhiệt_độ": current_env.nhiệt_độ,
+                    "độ_ẩm": current_env.độ_ẩm,
+                    "et0": current_env.et0
+                },
+                forecast=forecast
+            )
+        else:
+            print(f"⚡ Dùng quyết định tính trước cho EC {self._last_ec}")
         
-        # Bước 3: Chờ (mô phỏng)
-        print(f"⏳ Đang chờ {T_chờ_mới} phút... (mô phỏng)")
-        time.sleep(3)  # Mô phỏng thời gian chờ
+        plan = CyclePlan(
+            phase="operation",
+            T_chờ_phút=decision["T_chờ_đề_xuất"],
+            lý_do=decision["lý_do"],
+            môi_trường=current_env,
+            dự_báo=forecast
+        )
+        print(f"⏰ Quyết định: Chờ {plan.T_chờ_phút} phút")
+        print(f"💭 Lý do: {plan.lý_do}")
+        return plan
+        
+    async def _aspeculate(self, plan: CyclePlan):
+        """Trong lúc chờ T_chờ: tính trước quyết định kế tiếp cho các dải EC quanh EC gần nhất"""
+        try:
+            await self.aflush()
+            history = self.database.get_recent_records(days=3, now=self.clock.now())
+            expected_ec = self._last_ec if self._last_ec is not None else self.target_ec
+            await self.speculative_planner.aprecompute(history, plan, expected_ec)
+        except asyncio.CancelledError:
+            self.speculative_planner.reset()
+            raise
+        except Exception as e:
+            print(f"⚠️ Không tính trước được quyết định: {e}")
+        
+    async def afinish_cycle(self, plan: CyclePlan) -> bool:
+        """
+        Bước 4 sau khi đã chờ đủ T_chờ: tưới; phản tư và lưu trữ (bước 5-6)
+        chạy nền, chu trình sau chỉ chờ chúng trong aplan_cycle hoặc aflush
+        Returns: True nếu tiếp tục, False nếu dừng
+        """
+        # Chu trình trước phải được lưu xong để id và thứ tự bản ghi đúng
+        await self.aflush()
         
         # Bước 4: Thực hiện tưới
-        T_đầy_mới, EC_mới = self.controller.tưới_cho_đến_khi_đầy()
+        T_đầy_mới, EC_mới = await await_device(self.controller, "tưới_cho_đến_khi_đầy")
+        irrigated_at = self.clock.now()
+        self._last_ec = EC_mới
         
-        # Bước 5: Reflection Agent phản tư
-        print("🤔 Reflection Agent đang phân tích...")
-        reflection_text = self.reflection_agent.create_reflection(
-            input_data={"T_chờ_phút": T_chờ_mới},
-            output_data={"T_đầy_giây": T_đầy_mới, "EC_đo_được": EC_mới}
+        self._pending = asyncio.create_task(
+            self._areflect_and_persist(plan, T_đầy_mới, EC_mới, irrigated_at)
         )
+        return True  # Tiếp tục vòng lặp
         
-        print(f"📝 Nhận xét: {reflection_text}")
+    async def _areflect_and_persist(self, plan: CyclePlan, T_đầy_mới: int, EC_mới: float,
+                                    irrigated_at: datetime):
+        """Bước 5-6: phản tư rồi lưu bản ghi (timestamp là lúc tưới xong)"""
+        # Bước 5: Reflection Agent phản tư (chu trình hiệu chỉnh dùng nhận xét cố định)
+        if plan.phase == "calibration":
+            reflection_text = plan.lý_do
+        else:
+            print("🤔 Reflection Agent đang phân tích...")
+            with Deadline(self.reflection_deadline, "reflection"):
+                try:
+                    reflection_text = await within(self.reflection_agent.acreate_reflection(
+                        input_data={"T_chờ_phút": plan.T_chờ_phút},
+                        output_data={"T_đầy_giây": T_đầy_mới, "EC_đo_được": EC_mới}
+                    ), "reflection")
+                except DeadlineExceeded as e:
+                    # Bản ghi vẫn được lưu, chỉ thay nhận xét bằng mẫu
+                    degrade("reflection", f"{e}, dùng nhận xét mẫu")
+                    reflection_text = (f"EC={EC_mới} so với mục tiêu {self.target_ec}. "
+                                       f"Thời gian chờ {plan.T_chờ_phút} phút cần được đánh giá lại.")
+            print(f"📝 Nhận xét: {reflection_text}")
         
         # Bước 6: Lưu trữ
-        input_data = InputData(
-            T_chờ_phút=T_chờ_mới,
-            môi_trường_tb=current_env
-        )
-        
-        output_data = OutputData(
-            T_đầy_giây=T_đầy_mới,
-            EC_đo_được=EC_mới
-        )
-        
         record = CycleRecord(
             id=self.database.get_next_id(),
-            timestamp=datetime.now().isoformat(),
-            phase="operation",
-            input_data=input_data,
-            output_data=output_data,
+            timestamp=irrigated_at.isoformat(),
+            phase=plan.phase,
+            input_data=InputData(T_chờ_phút=plan.T_chờ_phút, môi_trường_tb=plan.môi_trường),
+            output_data=OutputData(T_đầy_giây=T_đầy_mới, EC_đo_được=EC_mới),
             reflection_text=reflection_text
         )
         
         self.database.add_record(record)
         
         # Hiển thị trạng thái
-        if abs(EC_mới - self.target_ec) <= 0.2:
+        if plan.phase == "calibration":
+            print(f"✅ Hoàn thành hiệu chỉnh. EC đo được: {EC_mới}")
+        elif abs(EC_mới - self.target_ec) <= 0.2:
             print(f"🎯 Tuyệt vời! EC {EC_mới} đã đạt gần mục tiêu {self.target_ec}")
         elif EC_mới > self.target_ec:
             print(f"📈 EC {EC_mới} cao hơn mục tiêu {self.target_ec}, cần tưới sớm hơn")
         else:
             print(f"📉 EC {EC_mới} thấp hơn mục tiêu {self.target_ec}, cần chờ lâu hơn")
-            
-        return True  # Tiếp tục vòng lặp
         
-    def run(self, max_cycles: int = 5):
-        """Chạy hệ thống hoàn chỉnh"""
+    async def aflush(self):
+        """Chờ phản tư/lưu trữ nền của chu trình trước (nếu có) hoàn tất"""
+        pending = self._pending
+        if pending is None:
+            return
+        try:
+            await pending
+        finally:
+            if self._pending is pending:
+                self._pending = None
+        
+    async def await_plan(self, plan: CyclePlan):
+        """Bước 3: Chờ theo đồng hồ (thật, tăng tốc hoặc sự kiện rời rạc)"""
+        print(f"⏳ Đang chờ {plan.T_chờ_phút} phút...")
+        await self.clock.asleep(plan.T_chờ_phút * 60)
+        
+    async def arun_calibration_phase(self):
+        """Giai đoạn 1: Hiệu chỉnh"""
+        plan = await self.aplan_calibration()
+        await self.await_plan(plan)
+        await self.afinish_cycle(plan)
+        
+    async def arun_operation_cycle(self) -> bool:
+        """
+        Chạy một chu trình vận hành
+        Returns: True nếu tiếp tục, False nếu dừng
+        """
+        plan = await self.aplan_cycle()
+        await self.await_plan(plan)
+        return await self.afinish_cycle(plan)
+        
+    async def arun(self, max_cycles: int = 5, interactive: bool = True):
+        """Chạy hệ thống hoàn chỉnh trên event loop hiện tại"""
         print("🌱 === HỆ THỐNG TƯỚI TỰ ĐỘNG THÔNG MINH ===")
         print(f"🎯 Mục tiêu EC: {self.target_ec}")
         
         # Kiểm tra nếu đã có dữ liệu hiệu chỉnh
-        if not self.database.data:
-            self.run_calibration_phase()
+        if self.database.get_last_record() is None:
+            await self.arun_calibration_phase()
         else:
             print("✅ Đã có dữ liệu hiệu chỉnh, bỏ qua giai đoạn này")
         
@@ -164,13 +333,14 @@ class IrrigationSystem:
             print(f"\n🔄 Chu trình {cycle + 1}/{max_cycles}")
             
             try:
-                should_continue = self.run_operation_cycle()
+                should_continue = await self.arun_operation_cycle()
                 if not should_continue:
                     break
                     
                 # Hỏi người dùng có muốn tiếp tục
-                if cycle < max_cycles - 1:
-                    user_input = input("\n⏸️ Nhấn Enter để tiếp tục chu trình tiếp theo (hoặc 'q' để dừng): ")
+                if interactive and cycle < max_cycles - 1:
+                    await self.aflush()
+                    user_input = await asyncio.to_thread(input, "\n⏸️ Nhấn Enter để tiếp tục chu trình tiếp theo (hoặc 'q' để dừng): ")
                     if user_input.lower() == 'q':
                         break
                         
@@ -181,29 +351,45 @@ class IrrigationSystem:
                 print(f"❌ Lỗi trong chu trình: {e}")
                 break
                 
+        try:
+            await self.aflush()
+        except Exception as e:
+            print(f"❌ Lỗi khi lưu chu trình cuối: {e}")
         print("\n🏁 Kết thúc hệ thống")
         self.show_summary()
         
     def show_summary(self):
         """Hiển thị tổng kết"""
         print("\n📊 === TỔNG KẾT ===")
-        history = self.database.get_recent_records(days=1)
+        aggregates = self.database.aggregates
         
-        if not history:
+        if not aggregates.count:
             print("Không có dữ liệu")
             return
             
-        ec_values = [record["output_data"]["EC_đo_được"] for record in history]
-        wait_times = [record["input_data"]["T_chờ_phút"] for record in history]
-        
-        print(f"📈 Số chu trình: {len(history)}")
-        print(f"🎯 EC trung bình: {sum(ec_values)/len(ec_values):.1f}")
-        print(f"⏰ Thời gian chờ trung bình: {sum(wait_times)//len(wait_times)} phút")
-        print(f"📊 EC gần nhất: {ec_values[-1]} (mục tiêu: {self.target_ec})")
+        print(f"📈 Số chu trình: {aggregates.count}")
+        print(f"🎯 EC trung bình: {aggregates.mean('EC'):.1f}")
+        print(f"⏰ Thời gian chờ trung bình: {int(aggregates.mean('T_chờ'))} phút")
+        print(f"📉 Sai số EC (EWMA): {aggregates.ewma_ec_error:+.2f}")
+        print(f"📊 EC gần nhất: {aggregates.rolling['EC'].values[-1]} (mục tiêu: {self.target_ec})")
+        now = self.clock.now()
+        for label, days in (("Hôm nay", 1), ("30 ngày qua", 30)):
+            window = aggregates.window(days, now)
+            if window["count"]:
+                print(f"📅 {label}: {window['count']} chu trình, EC trung bình {window['EC']:.1f}, "
+                      f"chờ trung bình {int(window['T_chờ'])} phút")
+        for provider, status in llm_clients_status().items():
+            print(f"🔌 LLM {provider}: {status['calls']} lần gọi, {status['failures']} lỗi, "
+                  f"{status['rejected']} bị chặn, cầu dao {status['breaker']['state']}")
+        if degradation_counts:
+            print(f"⏱️ Suy giảm do quá hạn: {degradation_counts}")
 
 def main():
-    """Hàm chính"""
-    system = IrrigationSystem()
+    """
+    Hàm chính: 3 chu trình demo trên đồng hồ tăng tốc (CLOCK_SPEED, mặc định 2400 lần:
+    chờ 120 phút mất 3 giây) để không chờ thời gian thực; CLOCK_MODE=real để chạy thật
+    """
+    system = IrrigationSystem(clock=create_clock(os.getenv("CLOCK_MODE") or "accelerated"))
     system.run(max_cycles=3)  # Chạy 3 chu trình demo
 
 if __name__ == "__main__":
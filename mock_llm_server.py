@@ -0,0 +1,481 @@
+#!/usr/bin/env python3
+"""
+Máy chủ LLM giả lập tương thích OpenAI (chỉ dùng thư viện chuẩn)
+Trả lời hợp lệ theo schema cho Plan/Reflection Agent và PlantOutput,
+ReflectionOutput, AnalysisOutput của agent-api; có độ trễ theo phân phối,
+streaming, chèn lỗi và chế độ cassette ghi/phát lại phản hồi thật
+
+Dùng: python mock_llm_server.py rồi đặt OPENAI_BASE_URL=http://127.0.0.1:8765/v1
+"""
+
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Optional, Tuple
+
+from prompt_context import estimate_tokens
+
+# Dòng thay đổi mỗi lần gọi, bỏ qua khi tính khóa cassette
+VOLATILE_LINES = re.compile(r"^current_datetime: .*$", re.M)
+
+
+def parse_latency(spec: str) -> Callable[[random.Random], float]:
+    """
+    Phân phối độ trễ (giây) từ chuỗi cấu hình:
+    fixed:0.2 | uniform:0.1,1.0 | lognormal:<trung vị>,<sigma> | exponential:<trung bình>
+    """
+    kind, _, params = spec.partition(":")
+    values = [float(value) for value in params.split(",") if value]
+    if kind == "fixed":
+        return lambda rng: values[0]
+    if kind == "uniform":
+        return lambda rng: rng.uniform(values[0], values[1])
+    if kind == "lognormal":
+        median, sigma = values
+        return lambda rng: median * rng.lognormvariate(0.0, sigma)
+    if kind == "exponential":
+        return lambda rng: rng.expovariate(1.0 / values[0])
+    raise ValueError(f"Phân phối độ trễ không hợp lệ: {spec}")
+
+
+# ---------- Sinh nội dung theo loại yêu cầu ----------
+
+def _text(messages: List[Dict]) -> str:
+    parts = []
+    for message in messages:
+        content = message.get("content") or ""
+        if isinstance(content, list):
+            content = " ".join(part.get("text", "") for part in content if isinstance(part, dict))
+        parts.append(content)
+    return "\n".join(parts)
+
+
+def _plan_decision(prompt: str, rng: random.Random) -> Dict:
+    """JSON của PlanAgent: điều chỉnh T_chờ theo dòng cuối của bảng lịch sử"""
+    rows = re.findall(r"^\d+\|(\d+(?:\.\d+)?)\|[\d.]+\|([+-][\d.]+)$", prompt, re.M)
+    if rows:
+        last_wait, error = float(rows[-1][0]), float(rows[-1][1])
+        wait = int(max(60, min(300, last_wait - 40 * error + rng.uniform(-5, 5))))
+        reason = f"Sai số EC {error:+.2f}, điều chỉnh T_chờ từ {last_wait:.0f} thành {wait} phút"
+    else:
+        wait = rng.randint(90, 180)
+        reason = "Chưa đủ lịch sử, chọn thời gian chờ trung bình"
+    return {"T_chờ_đề_xuất": wait, "lý_do": reason}
+
+
+def _batch_reflections(prompt: str) -> Dict:
+    ids = re.findall(r"^(\w+) \| [\d.]+ \| ", prompt, re.M)
+    return {"nhận_xét": [{"id": cycle_id, "nội_dung": "EC gần mục tiêu, giữ thời gian chờ hiện tại."}
+                         for cycle_id in ids]}
+
+
+def _reflection_text(prompt: str) -> str:
+    match = re.search(r"EC đo được: (\d+(?:\.\d+)?)", prompt)
+    ec = float(match.group(1)) if match else 4.0
+    target = re.search(r"mục tiêu EC=(\d+(?:\.\d+)?)", prompt)
+    target_ec = float(target.group(1)) if target else 4.0
+    if ec > target_ec + 0.2:
+        return f"EC {ec} cao hơn mục tiêu {target_ec}, nên giảm thời gian chờ để tưới sớm hơn."
+    if ec < target_ec - 0.2:
+        return f"EC {ec} thấp hơn mục tiêu {target_ec}, nên tăng thời gian chờ."
+    return f"EC {ec} gần mục tiêu {target_ec}, thời gian chờ phù hợp."
+
+
+def _environment(prompt: str, rng: random.Random) -> Dict:
+    match = re.search(r"^current_env: (.*)$", prompt, re.M)
+    if match:
+        values = dict(pair.split("=") for pair in match.group(1).split())
+        return {key: float(value) for key, value in values.items()}
+    return {"temperature": round(rng.uniform(15, 30), 2), "humidity": round(rng.uniform(30, 80), 2),
+            "ec": round(rng.uniform(3.5, 4.5), 2), "et0": round(rng.uniform(0.5, 1.5), 2)}
+
+
+def _plant_output(prompt: str, rng: random.Random) -> Dict:
+    environment = _environment(prompt, rng)
+    error = environment.get("ec", 4.0) - 4.0
+    wait = int(max(60, min(300, 150 - 60 * error)))
+    return {
+        "time_waiting": wait,
+        "next_time_watering": (datetime.now() + timedelta(minutes=wait)).isoformat(timespec="minutes"),
+        "reason": f"EC error {error:+.2f}, waiting {wait} minutes",
+        "environ_sensor_data": environment,
+    }
+
+
+def _analysis_output(prompt: str) -> Dict:
+    user = prompt.split("<context>")[0].lower()
+    match = re.search(r"(\d+)\s*(phút|minutes?|mins?)", user)
+    if not match:
+        return {"status": "success", "delay": 0}
+    minutes = int(match.group(1))
+    earlier = any(word in user for word in ("sớm", "earlier", "before"))
+    return {"status": "adjust", "delay": -minutes if earlier else minutes}
+
+
+def _from_schema(schema: Dict, definitions: Dict, rng: random.Random):
+    """Giá trị hợp lệ tối thiểu cho một JSON schema bất kỳ"""
+    if "$ref" in schema:
+        return _from_schema(definitions[schema["$ref"].split("/")[-1]], definitions, rng)
+    if "anyOf" in schema:
+        return _from_schema(schema["anyOf"][0], definitions, rng)
+    kind = schema.get("type")
+    if kind == "object":
+        return {name: _from_schema(prop, definitions, rng) for name, prop in schema.get("properties", {}).items()}
+    if kind == "array":
+        return [_from_schema(schema.get("items", {}), definitions, rng)]
+    if kind == "integer":
+        return rng.randint(0, 100)
+    if kind == "number":
+        return round(rng.uniform(0, 10), 2)
+    if kind == "boolean":
+        return True
+    return schema.get("default", "mock")
+
+
+STRUCTURED = {
+    "PlantOutput": lambda prompt, rng: _plant_output(prompt, rng),
+    "ReflectionOutput": lambda prompt, rng: {"reflection_text": _reflection_text(prompt)},
+    "AnalysisOutput": lambda prompt, rng: _analysis_output(prompt),
+}
+
+# Nhận diện theo danh sách trường khi agno dùng chế độ json_object (<json_fields>)
+JSON_FIELDS = {
+    "time_waiting": "PlantOutput",
+    "reflection_text": "ReflectionOutput",
+    "status": "AnalysisOutput",
+}
+
+
+def generate_content(body: Dict, rng: random.Random) -> Tuple[str, str]:
+    """Returns: (loại yêu cầu, nội dung trả lời)"""
+    prompt = _text(body.get("messages", []))
+    response_format = body.get("response_format") or {}
+    if response_format.get("type") == "json_schema":
+        spec = response_format.get("json_schema", {})
+        name = spec.get("name", "")
+        if name in STRUCTURED:
+            return name, json.dumps(STRUCTURED[name](prompt, rng), ensure_ascii=False)
+        schema = spec.get("schema", {})
+        return name or "json_schema", json.dumps(_from_schema(schema, schema.get("$defs", {}), rng))
+    if "<json_fields>" in prompt:
+        for field, name in JSON_FIELDS.items():
+            if f'"{field}"' in prompt or f"'{field}'" in prompt:
+                return name, json.dumps(STRUCTURED[name](prompt, rng), ensure_ascii=False)
+    if "T_chờ_đề_xuất" in prompt:
+        return "plan", json.dumps(_plan_decision(prompt, rng), ensure_ascii=False)
+    if "nội_dung" in prompt:
+        return "batch_reflection", json.dumps(_batch_reflections(prompt), ensure_ascii=False)
+    return "reflection", _reflection_text(prompt)
+
+
+# ---------- Máy chủ ----------
+
+class MockLLM:
+    """Cấu hình và trạng thái dùng chung của máy chủ giả lập"""
+
+    def __init__(self,
+                 mode: Optional[str] = None,
+                 latency: Optional[str] = None,
+                 token_delay: Optional[float] = None,
+                 error_rate: Optional[float] = None,
+                 error_codes: Optional[str] = None,
+                 timeout_rate: Optional[float] = None,
+                 cassette_path: Optional[str] = None,
+                 upstream: Optional[str] = None,
+                 seed: Optional[int] = None):
+        """
+        mode: mock (sinh phản hồi) | record (gọi upstream và ghi cassette) | replay (phát lại cassette)
+        latency: phân phối độ trễ tới token đầu tiên, xem parse_latency
+        token_delay: giãn cách giữa các chunk khi streaming (giây)
+        error_rate, error_codes: tỉ lệ yêu cầu trả lỗi và các mã lỗi chọn ngẫu nhiên
+        timeout_rate: tỉ lệ yêu cầu treo tới khi client hết thời gian chờ
+        """
+        self.mode = mode or os.getenv("MOCK_LLM_MODE", "mock")
+        if self.mode not in ("mock", "record", "replay"):
+            raise ValueError(f"Chế độ máy chủ giả lập không hợp lệ: {self.mode}")
+        self.latency = parse_latency(latency or os.getenv("MOCK_LLM_LATENCY", "lognormal:0.8,0.4"))
+        self.token_delay = (token_delay if token_delay is not None
+                            else float(os.getenv("MOCK_LLM_TOKEN_DELAY", "0.01")))
+        self.error_rate = error_rate if error_rate is not None else float(os.getenv("MOCK_LLM_ERROR_RATE", "0"))
+        self.error_codes = [int(code) for code in
+                            (error_codes or os.getenv("MOCK_LLM_ERROR_CODES", "429,500,503")).split(",")]
+        self.timeout_rate = (timeout_rate if timeout_rate is not None
+                             else float(os.getenv("MOCK_LLM_TIMEOUT_RATE", "0")))
+        self.cassette_path = cassette_path or os.getenv("MOCK_LLM_CASSETTE", "llm_cassette.jsonl")
+        self.upstream = (upstream or os.getenv("MOCK_LLM_UPSTREAM", "")).rstrip("/")
+        self.seed = seed if seed is not None else int(os.getenv("MOCK_LLM_SEED", "42"))
+
+        self._lock = threading.Lock()
+        self._rng = random.Random(self.seed)
+        self._seen_prefixes = set()
+        self._cassette: Dict[str, List[Dict]] = {}
+        self._replayed: Dict[str, int] = {}
+        if self.mode == "replay":
+            self._load_cassette()
+        self.counters = {"requests": 0, "errors_injected": 0, "timeouts_injected": 0,
+                         "recorded": 0, "replay_hits": 0, "replay_misses": 0}
+        self.by_kind: Dict[str, int] = {}
+
+    # ---------- Cassette ----------
+
+    @staticmethod
+    def cassette_key(body: Dict) -> str:
+        """Khóa của một yêu cầu: model, messages (bỏ dòng thời gian), response_format, tools"""
+        canonical = {
+            "model": body.get("model"),
+            "messages": [{"role": m.get("role"), "content": VOLATILE_LINES.sub("", _text([m]))}
+                         for m in body.get("messages", [])],
+            "response_format": body.get("response_format"),
+            "tools": body.get("tools"),
+        }
+        return hashlib.sha1(json.dumps(canonical, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+    def _load_cassette(self):
+        if not os.path.exists(self.cassette_path):
+            return
+        with open(self.cassette_path, "r", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    entry = json.loads(line)
+                    self._cassette.setdefault(entry["key"], []).append(entry["response"])
+
+    def _record(self, key: str, response: Dict):
+        with self._lock:
+            with open(self.cassette_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps({"key": key, "response": response}, ensure_ascii=False) + "\n")
+            self.counters["recorded"] += 1
+
+    def _replay(self, key: str) -> Optional[Dict]:
+        """Lần gọi thứ n của cùng một yêu cầu nhận phản hồi ghi thứ n (lặp lại khi hết)"""
+        with self._lock:
+            responses = self._cassette.get(key)
+            if not responses:
+                self.counters["replay_misses"] += 1
+                return None
+            index = self._replayed.get(key, 0)
+            self._replayed[key] = index + 1
+            self.counters["replay_hits"] += 1
+            return responses[index % len(responses)]
+
+    def _call_upstream(self, body: Dict) -> Dict:
+        request = dict(body, stream=False)
+        request.pop("stream_options", None)
+        data = json.dumps(request).encode("utf-8")
+        http_request = urllib.request.Request(
+            f"{self.upstream}/chat/completions", data=data, method="POST",
+            headers={"Content-Type": "application/json",
+                     "Authorization": f"Bearer {os.getenv('OPENAI_API_KEY', '')}"}
+        )
+        with urllib.request.urlopen(http_request, timeout=120) as response:
+            return json.loads(response.read())
+
+    # ---------- Phản hồi ----------
+
+    def _usage(self, body: Dict, content: str) -> Dict:
+        """Token ước lượng; phần system prompt đã gặp được báo là cached_tokens"""
+        messages = body.get("messages", [])
+        prefix = _text([m for m in messages if m.get("role") in ("system", "developer")])
+        prompt_tokens = estimate_tokens(_text(messages))
+        digest = hashlib.sha1(prefix.encode("utf-8")).hexdigest()
+        with self._lock:
+            cached = estimate_tokens(prefix) if prefix and digest in self._seen_prefixes else 0
+            self._seen_prefixes.add(digest)
+        completion_tokens = estimate_tokens(content)
+        return {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+            "prompt_tokens_details": {"cached_tokens": cached},
+        }
+
+    def complete(self, body: Dict) -> Dict:
+        """Phản hồi chat.completion đầy đủ cho một yêu cầu (mock, record hoặc replay)"""
+        key = self.cassette_key(body)
+        with self._lock:
+            rng = random.Random(f"{self.seed}:{key}:{self.counters['requests']}")
+        if self.mode == "replay":
+            recorded = self._replay(key)
+            if recorded is not None:
+                return recorded
+        if self.mode == "record":
+            response = self._call_upstream(body)
+            self._record(key, response)
+            return response
+
+        kind, content = generate_content(body, rng)
+        with self._lock:
+            self.by_kind[kind] = self.by_kind.get(kind, 0) + 1
+        return {
+            "id": f"chatcmpl-{uuid.uuid4().hex[:24]}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "mock"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": "stop",
+            }],
+            "usage": self._usage(body, content),
+        }
+
+    def injected_failure(self) -> Optional[str]:
+        """'error', 'timeout' hoặc None cho yêu cầu hiện tại"""
+        with self._lock:
+            self.counters["requests"] += 1
+            roll = self._rng.random()
+            if roll < self.timeout_rate:
+                self.counters["timeouts_injected"] += 1
+                return "timeout"
+            if roll < self.timeout_rate + self.error_rate:
+                self.counters["errors_injected"] += 1
+                return "error"
+        return None
+
+    def sample_latency(self) -> float:
+        with self._lock:
+            return max(self.latency(self._rng), 0.0)
+
+    def pick_error_code(self) -> int:
+        with self._lock:
+            return self._rng.choice(self.error_codes)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {"mode": self.mode, **self.counters, "by_kind": dict(self.by_kind)}
+
+
+def _chunks(text: str, size: int = 16) -> List[str]:
+    return [text[i:i + size] for i in range(0, len(text), size)] or [""]
+
+
+class MockLLMHandler(BaseHTTPRequestHandler):
+    """POST /v1/chat/completions, GET /v1/models, GET /stats"""
+
+    server_version = "MockLLM/1.0"
+    protocol_version = "HTTP/1.1"
+
+    @property
+    def llm(self) -> MockLLM:
+        return self.server.llm
+
+    def log_message(self, format, *args):
+        pass  # Không in từng yêu cầu khi chạy tải cao
+
+    def _send_json(self, status: int, payload: Dict, headers: Optional[Dict] = None):
+        data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path.rstrip("/") in ("/models", "/v1/models"):
+            self._send_json(200, {"object": "list", "data": [{"id": "mock", "object": "model", "owned_by": "mock"}]})
+        elif self.path.rstrip("/") == "/stats":
+            self._send_json(200, self.llm.stats())
+        else:
+            self._send_json(404, {"error": {"message": f"Không có đường dẫn {self.path}"}})
+
+    def do_POST(self):
+        if self.path.rstrip("/") not in ("/chat/completions", "/v1/chat/completions"):
+            self._send_json(404, {"error": {"message": f"Không có đường dẫn {self.path}"}})
+            return
+        length = int(self.headers.get("Content-Length", 0))
+        body = json.loads(self.rfile.read(length) or b"{}")
+
+        failure = self.llm.injected_failure()
+        latency = self.llm.sample_latency()
+        if failure == "timeout":
+            time.sleep(float(os.getenv("MOCK_LLM_TIMEOUT_SECONDS", "600")))
+            return
+        if failure == "error":
+            time.sleep(latency / 4)
+            code = self.llm.pick_error_code()
+            headers = {"Retry-After": "1"} if code == 429 else None
+            self._send_json(code, {"error": {"message": "Lỗi giả lập", "type": "mock_error", "code": code}}, headers)
+            return
+
+        try:
+            response = self.llm.complete(body)
+        except urllib.error.HTTPError as e:
+            self._send_json(e.code, {"error": {"message": f"Upstream: {e.reason}"}})
+            return
+        except Exception as e:
+            self._send_json(502, {"error": {"message": f"Lỗi máy chủ giả lập: {e}"}})
+            return
+
+        time.sleep(latency)
+        if body.get("stream"):
+            self._stream(body, response)
+        else:
+            self._send_json(200, response)
+
+    def _stream(self, body: Dict, response: Dict):
+        """Trả phản hồi dạng SSE từng đoạn; chunk usage cuối nếu client yêu cầu"""
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+
+        base = {"id": response["id"], "object": "chat.completion.chunk",
+                "created": response["created"], "model": response["model"]}
+        content = response["choices"][0]["message"].get("content") or ""
+
+        def send(payload):
+            self.wfile.write(f"data: {json.dumps(payload, ensure_ascii=False)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+
+        try:
+            for index, piece in enumerate(_chunks(content)):
+                delta = {"content": piece}
+                if index == 0:
+                    delta["role"] = "assistant"
+                send({**base, "choices": [{"index": 0, "delta": delta, "finish_reason": None}]})
+                time.sleep(self.llm.token_delay)
+            send({**base, "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]})
+            if (body.get("stream_options") or {}).get("include_usage") and response.get("usage"):
+                send({**base, "choices": [], "usage": response["usage"]})
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+
+def create_server(host: Optional[str] = None, port: Optional[int] = None, llm: Optional[MockLLM] = None):
+    """Tạo máy chủ (chưa chạy); port=0 để hệ điều hành chọn cổng trống"""
+    host = host or os.getenv("MOCK_LLM_HOST", "127.0.0.1")
+    port = port if port is not None else int(os.getenv("MOCK_LLM_PORT", "8765"))
+    server = ThreadingHTTPServer((host, port), MockLLMHandler)
+    server.daemon_threads = True
+    server.llm = llm or MockLLM()
+    return server
+
+
+def main():
+    server = create_server()
+    host, port = server.server_address[:2]
+    print(f"🤖 Máy chủ LLM giả lập ({server.llm.mode}) tại http://{host}:{port}/v1")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print(f"\n📊 {server.llm.stats()}")
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""
+Dựng phần dữ liệu của prompt Plan Agent trong một ngân sách token
+Lịch sử gần đây ở dạng bảng gọn, các chu trình cũ hơn gộp thành thống kê,
+chỉ giữ những nhận xét nhiều thông tin nhất vừa với ngân sách còn lại
+"""
+
+import math
+import os
+import statistics
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+# Ước lượng số ký tự mỗi token cho văn bản tiếng Việt có dấu lẫn số liệu
+CHARS_PER_TOKEN = 3.0
+
+# Sai số EC coi là đạt mục tiêu khi thống kê chu trình cũ
+ON_TARGET_BAND = 0.2
+
+
+def estimate_tokens(text: str) -> int:
+    """Ước lượng số token (không phụ thuộc tokenizer của từng LLM)"""
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+@dataclass(slots=True)
+class PlanContext:
+    """Các khối dữ liệu đã dựng cho prompt và số token ước lượng của chúng"""
+    history: str
+    reflections: str
+    environment: str
+    tokens: int
+
+
+class PlanContextBuilder:
+    """Bảng lịch sử gọn + thống kê chu trình cũ + nhận xét chọn lọc theo ngân sách token"""
+
+    def __init__(self, token_budget: Optional[int] = None, recent_cycles: Optional[int] = None):
+        """
+        token_budget: số token tối đa cho phần dữ liệu (lịch sử, nhận xét, môi trường)
+        recent_cycles: số chu trình gần nhất giữ nguyên từng dòng trong bảng
+        """
+        self.token_budget = token_budget or int(os.getenv("PLAN_CONTEXT_TOKENS", "400"))
+        self.recent_cycles = recent_cycles or int(os.getenv("PLAN_CONTEXT_RECENT_CYCLES", "6"))
+
+    @staticmethod
+    def _summary(records: List[Dict], target_ec: float) -> str:
+        """Một dòng thống kê cho các chu trình cũ"""
+        waits = [r["input_data"]["T_chờ_phút"] for r in records]
+        ecs = [r["output_data"]["EC_đo_được"] for r in records]
+        on_target = sum(1 for ec in ecs if abs(ec - target_ec) <= ON_TARGET_BAND) / len(ecs)
+        spread = f"±{statistics.stdev(ecs):.2f}" if len(ecs) > 1 else ""
+        return (f"{len(records)} chu trình trước: T_chờ tb {statistics.mean(waits):.0f} "
+                f"({min(waits)}-{max(waits)}), EC tb {statistics.mean(ecs):.2f}{spread} "
+                f"({min(ecs)}-{max(ecs)}), đạt ±{ON_TARGET_BAND}: {on_target:.0%}")
+
+    @staticmethod
+    def _rows(records: List[Dict], target_ec: float) -> List[str]:
+        return [
+            f"{r['id']}|{r['input_data']['T_chờ_phút']}|{r['output_data']['EC_đo_được']}|"
+            f"{r['output_data']['EC_đo_được'] - target_ec:+.2f}"
+            for r in records
+        ]
+
+    def history_table(self, history: List[Dict], target_ec: float, recent_cycles: int) -> str:
+        if not history:
+            return "(chưa có)"
+        recent = history[-recent_cycles:] if recent_cycles else []
+        older = history[:len(history) - len(recent)]
+        lines = [self._summary(older, target_ec)] if older else []
+        if recent:
+            lines.append("id|T_chờ|EC|sai_số")
+            lines.extend(self._rows(recent, target_ec))
+        return "\n".join(lines)
+
+    @staticmethod
+    def _informativeness(record: Dict, position: int, total: int, target_ec: float) -> float:
+        """Chu trình lệch mục tiêu nhiều và gần đây được ưu tiên"""
+        error = abs(record["output_data"]["EC_đo_được"] - target_ec)
+        recency = (position + 1) / total
+        return error + 0.5 * recency
+
+    def select_reflections(self, history: List[Dict], target_ec: float, budget: int) -> str:
+        """Các nhận xét nhiều thông tin nhất (trừ chu trình cuối) vừa với `budget` token"""
+        candidates = history[:-1]
+        ranked = sorted(
+            ((self._informativeness(r, i, len(candidates), target_ec), i, r)
+             for i, r in enumerate(candidates) if r["reflection_text"]),
+            reverse=True
+        )
+        chosen, seen, used = [], set(), 0
+        for _, position, record in ranked:
+            text = " ".join(record["reflection_text"].split())
+            line = f"#{record['id']}: {text}"
+            cost = estimate_tokens(line) + 1
+            if text in seen or used + cost > budget:
+                continue
+            chosen.append((position, line))
+            seen.add(text)
+            used += cost
+        return "\n".join(line for _, line in sorted(chosen)) or "(không có)"
+
+    def build(self, last_reflection: str, history: List[Dict], current_env: Dict, target_ec: float) -> PlanContext:
+        environment = " ".join(f"{key}={value}" for key, value in current_env.items())
+        fixed = estimate_tokens(environment) + estimate_tokens(last_reflection)
+
+        # Bảng quá ngân sách thì chuyển dần dòng cũ nhất vào thống kê
+        recent_cycles = self.recent_cycles
+        table = self.history_table(history, target_ec, recent_cycles)
+        while recent_cycles > 1 and fixed + estimate_tokens(table) > self.token_budget:
+            recent_cycles -= 1
+            table = self.history_table(history, target_ec, recent_cycles)
+
+        remaining = self.token_budget - fixed - estimate_tokens(table)
+        reflections = self.select_reflections(history, target_ec, max(remaining, 0))
+        tokens = fixed + estimate_tokens(table) + estimate_tokens(reflections)
+        return PlanContext(history=table, reflections=reflections, environment=environment, tokens=tokens)
@@ -0,0 +1,233 @@
+"""
+Mã hóa nhị phân gọn cho bản ghi chu trình tưới
+Bố cục cố định (struct) có số phiên bản, chuyển đổi qua lại không mất mát với dạng JSON
+
+Khung mỗi bản ghi: <độ dài payload u32><crc32 u32><payload>
+Payload: <version u8><flags u16><id u32><thời điểm i64 µs><phase u8><6 trường số><văn bản>
+"""
+
+import struct
+import zlib
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, Iterator, List, Tuple
+
+SCHEMA_VERSION = 1
+MAGIC = b"IRRB"
+
+PHASES = ("calibration", "operation")
+RAW_PHASE = 255
+
+FRAME = struct.Struct("<II")
+HEADER = struct.Struct("<BHIqB")
+# Gọn: T_chờ, T_đầy (i32) và nhiệt độ, độ ẩm, et0, EC nhân 1000 (i32)
+COMPACT_NUMBERS = struct.Struct("<6i")
+# Rộng: cả 6 trường dạng float64 khi không biểu diễn gọn được
+WIDE_NUMBERS = struct.Struct("<6d")
+TEXT_LENGTH = struct.Struct("<I")
+
+FLAG_WIDE = 1 << 0
+FLAG_RAW_TIMESTAMP = 1 << 1
+FLAG_ZLIB_REFLECTION = 1 << 2
+FLAG_RAW_PHASE = 1 << 3
+# Bit 4..9: trường số thứ i là int trong JSON gốc
+FLAG_INT_BASE = 4
+
+SCALE = 1000
+EPOCH = datetime(1970, 1, 1)
+_MICROSECOND = timedelta(microseconds=1)
+# Chỉ nén nhận xét dài hơn ngưỡng này (zlib có chi phí cố định)
+ZLIB_MIN_LENGTH = 96
+
+
+def _numbers(record: Dict) -> List:
+    env = record["input_data"]["môi_trường_tb"]
+    return [
+        record["input_data"]["T_chờ_phút"],
+        record["output_data"]["T_đầy_giây"],
+        env["nhiệt_độ"],
+        env["độ_ẩm"],
+        env["et0"],
+        record["output_data"]["EC_đo_được"],
+    ]
+
+
+def _compact_numbers(numbers: List) -> Tuple[int, ...]:
+    """Trả về các số nguyên nếu biểu diễn gọn được chính xác, ngược lại ()"""
+    waits = numbers[:2]
+    if not all(isinstance(value, int) for value in waits):
+        return ()
+    scaled = []
+    for value in numbers[2:]:
+        candidate = round(value * SCALE)
+        if candidate / SCALE != value or not -2**31 <= candidate < 2**31:
+            return ()
+        scaled.append(candidate)
+    return tuple(waits) + tuple(scaled)
+
+
+def _encode_timestamp(timestamp: str) -> Tuple[int, bool]:
+    """Thời điểm dạng micro giây nếu isoformat() tái tạo đúng chuỗi gốc"""
+    try:
+        moment = datetime.fromisoformat(timestamp)
+    except (TypeError, ValueError):
+        return 0, True
+    if moment.tzinfo is not None or moment.isoformat() != timestamp:
+        return 0, True
+    micros = (moment - EPOCH) // _MICROSECOND
+    return micros, False
+
+
+def encode_record(record: Dict) -> bytes:
+    """Mã hóa một bản ghi (dạng CycleRecord.to_dict()) thành payload nhị phân"""
+    flags = 0
+    numbers = _numbers(record)
+    for position, value in enumerate(numbers):
+        if isinstance(value, int):
+            flags |= 1 << (FLAG_INT_BASE + position)
+
+    compact = _compact_numbers(numbers)
+    if compact:
+        number_bytes = COMPACT_NUMBERS.pack(*compact)
+    else:
+        flags |= FLAG_WIDE
+        number_bytes = WIDE_NUMBERS.pack(*(float(value) for value in numbers))
+
+    texts = []
+    micros, raw_timestamp = _encode_timestamp(record["timestamp"])
+    if raw_timestamp:
+        flags |= FLAG_RAW_TIMESTAMP
+        texts.append(record["timestamp"].encode('utf-8'))
+
+    phase = record["phase"]
+    if phase in PHASES:
+        phase_code = PHASES.index(phase)
+    else:
+        flags |= FLAG_RAW_PHASE
+        phase_code = RAW_PHASE
+        texts.append(phase.encode('utf-8'))
+
+    reflection = record.get("reflection_text", "").encode('utf-8')
+    if len(reflection) >= ZLIB_MIN_LENGTH:
+        packed = zlib.compress(reflection, 9)
+        if len(packed) < len(reflection):
+            flags |= FLAG_ZLIB_REFLECTION
+            reflection = packed
+    texts.append(reflection)
+
+    parts = [HEADER.pack(SCHEMA_VERSION, flags, record["id"], micros, phase_code), number_bytes]
+    for text in texts:
+        parts.append(TEXT_LENGTH.pack(len(text)))
+        parts.append(text)
+    return b"".join(parts)
+
+
+def decode_record(payload: bytes) -> Dict:
+    """Giải mã payload về đúng cấu trúc JSON ban đầu"""
+    version, flags, record_id, micros, phase_code = HEADER.unpack_from(payload, 0)
+    if version != SCHEMA_VERSION:
+        raise ValueError(f"Phiên bản lược đồ không hỗ trợ: {version}")
+    offset = HEADER.size
+
+    layout = WIDE_NUMBERS if flags & FLAG_WIDE else COMPACT_NUMBERS
+    raw_numbers = layout.unpack_from(payload, offset)
+    offset += layout.size
+    numbers = []
+    for position, value in enumerate(raw_numbers):
+        if not flags & FLAG_WIDE and position >= 2:
+            value = value / SCALE
+        is_int = flags & (1 << (FLAG_INT_BASE + position))
+        numbers.append(int(value) if is_int else float(value))
+
+    def read_text() -> bytes:
+        nonlocal offset
+        (length,) = TEXT_LENGTH.unpack_from(payload, offset)
+        offset += TEXT_LENGTH.size
+        text = payload[offset:offset + length]
+        offset += length
+        return text
+
+    if flags & FLAG_RAW_TIMESTAMP:
+        timestamp = read_text().decode('utf-8')
+    else:
+        timestamp = (EPOCH + micros * _MICROSECOND).isoformat()
+    phase = read_text().decode('utf-8') if flags & FLAG_RAW_PHASE else PHASES[phase_code]
+    reflection = read_text()
+    if flags & FLAG_ZLIB_REFLECTION:
+        reflection = zlib.decompress(reflection)
+
+    wait, fill, temperature, humidity, et0, ec = numbers
+    return {
+        "id": record_id,
+        "timestamp": timestamp,
+        "phase": phase,
+        "input_data": {
+            "T_chờ_phút": wait,
+            "môi_trường_tb": {"nhiệt_độ": temperature, "độ_ẩm": humidity, "et0": et0}
+        },
+        "output_data": {"T_đầy_giây": fill, "EC_đo_được": ec},
+        "reflection_text": reflection.decode('utf-8')
+    }
+
+
+def frame(payload: bytes) -> bytes:
+    """Đóng khung payload với độ dài và CRC32 để phát hiện bản ghi ghi dở"""
+    return FRAME.pack(len(payload), zlib.crc32(payload)) + payload
+
+
+def file_header() -> bytes:
+    return MAGIC + bytes([SCHEMA_VERSION])
+
+
+def _frame_follows(data: bytes, offset: int) -> bool:
+    """Có khung nguyên vẹn nào bắt đầu sau `offset` (độ dài bị hỏng giữa file, không phải khung cuối ghi dở)"""
+    for position in range(offset + 1, len(data) - FRAME.size + 1):
+        length, checksum = FRAME.unpack_from(data, position)
+        start = position + FRAME.size
+        if (HEADER.size <= length <= len(data) - start and data[start] == SCHEMA_VERSION
+                and zlib.crc32(data[start:start + length]) == checksum):
+            return True
+    return False
+
+
+def iter_frames(data: bytes) -> Iterator[Tuple[int, Dict]]:
+    """
+    Duyệt các bản ghi trong nội dung file nhị phân
+    Yields: (offset kết thúc bản ghi, bản ghi); dừng ở khung cuối bị ghi dở
+    (thiếu byte, hoặc sai CRC mà không còn gì phía sau)
+    Raises: ValueError nếu không phải file lịch sử, sai phiên bản hoặc có khung hỏng giữa file
+    """
+    header = file_header()
+    if len(data) < len(header) and header.startswith(data):
+        # File mới tạo, phần đầu file còn ghi dở
+        return
+    if data[:len(MAGIC)] != MAGIC:
+        raise ValueError("Không phải file lịch sử nhị phân")
+    if data[len(MAGIC)] != SCHEMA_VERSION:
+        raise ValueError(f"Phiên bản file nhị phân không hỗ trợ: {data[len(MAGIC)]}")
+    offset = len(header)
+    while offset + FRAME.size <= len(data):
+        length, checksum = FRAME.unpack_from(data, offset)
+        start = offset + FRAME.size
+        end = start + length
+        if end > len(data):
+            if _frame_follows(data, offset):
+                raise ValueError(f"Độ dài khung hỏng tại byte {offset}, phía sau vẫn còn bản ghi")
+            return
+        payload = data[start:end]
+        if zlib.crc32(payload) != checksum:
+            if end == len(data):
+                return
+            raise ValueError(f"Khung hỏng tại byte {offset}, phía sau vẫn còn dữ liệu")
+        offset = end
+        yield offset, decode_record(payload)
+
+
+def write_records(path: str, records: Iterable[Dict]) -> int:
+    """Ghi toàn bộ bản ghi ra file nhị phân mới"""
+    count = 0
+    with open(path, 'wb') as f:
+        f.write(file_header())
+        for record in records:
+            f.write(frame(encode_record(record)))
+            count += 1
+    return count
@@ -0,0 +1,315 @@
+#!/usr/bin/env python3
+"""
+Mô phỏng vật lý giá thể cho N vùng tưới cùng lúc (NumPy)
+Mất nước theo ET0 -> cô đặc muối -> EC nước thoát và thời gian tưới đầy
+"""
+
+import contextlib
+import io
+import os
+import tempfile
+import time
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+from clock import SimulatedClock
+from components import Database, EnvironmentData
+
+
+class ZoneSimulator:
+    """
+    Mô hình cân bằng nước/muối cho nhiều vùng, mọi trạng thái là mảng NumPy
+
+    Trong lúc chờ, nước bay hơi theo ET0 còn lượng muối giữ nguyên. Khi tưới,
+    dung dịch EC_cấp bù phần thiếu hụt cộng phần nước thoát (rửa trôi); nước
+    thoát mang EC sau khi hòa trộn - đó là giá trị cảm biến đo được.
+    Trạng thái cân bằng: EC = EC_cấp * (1 + thiếu_hụt / rửa_trôi), nên chờ
+    càng lâu EC càng cao, đúng với quy tắc mà Plan Agent sử dụng.
+    """
+
+    def __init__(self,
+                 n_zones: int = 1,
+                 seed: Optional[int] = None,
+                 feed_ec: float = 2.0,
+                 leach_fraction: float = 0.3,
+                 water_loss_per_et0: float = 0.6,
+                 flow_rate: float = 0.6 / 45,
+                 temperature_mean: float = 31.0,
+                 humidity_mean: float = 70.0,
+                 ec_noise: float = 0.05):
+        """
+        feed_ec: EC của dung dịch cấp
+        leach_fraction: lượng nước thoát mỗi lần tưới (phần của dung tích giá thể)
+        water_loss_per_et0: phần dung tích mất đi cho mỗi (ET0 x giờ)
+        flow_rate: phần dung tích bơm được mỗi giây
+        """
+        self.n_zones = n_zones
+        self.rng = np.random.default_rng(seed)
+        self.feed_ec = feed_ec
+        self.leach_fraction = leach_fraction
+        self.water_loss_per_et0 = water_loss_per_et0
+        self.ec_noise = ec_noise
+
+        # Khác biệt giữa các vùng: vị trí nhà kính, giá thể, béc tưới
+        self.flow_rate = flow_rate * self.rng.uniform(0.85, 1.15, n_zones)
+        self.loss_factor = self.rng.uniform(0.9, 1.1, n_zones)
+        self.temperature_mean = temperature_mean + self.rng.normal(0.0, 1.0, n_zones)
+        self.humidity_mean = humidity_mean + self.rng.normal(0.0, 3.0, n_zones)
+
+        # Trạng thái: thời gian mô phỏng (giờ), phần nước còn lại, EC trong giá thể
+        self.hours = np.full(n_zones, 7.0)
+        self.water = np.ones(n_zones)
+        self.substrate_ec = np.full(n_zones, feed_ec * 2.0)
+
+    # ---------- Môi trường ----------
+
+    def environment(self, hours: Optional[np.ndarray] = None, zones=slice(None)) -> Dict[str, np.ndarray]:
+        """Nhiệt độ, độ ẩm và ET0 (theo giờ) của các vùng tại thời điểm cho trước"""
+        hours = self.hours[zones] if hours is None else hours
+        size = np.shape(hours)
+        # Đỉnh nhiệt lúc 14h, đáy lúc 2h; độ ẩm ngược pha
+        phase = np.sin(2 * np.pi * (hours - 8.0) / 24.0)
+        temperature = self.temperature_mean[zones] + 4.0 * phase + self.rng.normal(0.0, 0.3, size)
+        humidity = np.clip(self.humidity_mean[zones] - 12.0 * phase + self.rng.normal(0.0, 1.0, size), 20.0, 100.0)
+        # ET0 giản lược: tăng theo nhiệt độ, giảm theo độ ẩm (~0.25 ở 30°C, 70%)
+        et0 = np.maximum(0.0174 * (temperature + 17.8) * (1.0 - humidity / 100.0), 0.0)
+        return {"nhiệt_độ": temperature, "độ_ẩm": humidity, "et0": et0}
+
+    # ---------- Diễn biến ----------
+
+    def evaporate(self, minutes, zones=slice(None)) -> Dict[str, np.ndarray]:
+        """
+        Cho các vùng chờ `minutes` phút (mảng hoặc số), cô đặc muối theo lượng nước mất
+        Returns: môi trường trung bình trong khoảng chờ
+        """
+        hours = self.hours[zones]
+        minutes = np.broadcast_to(np.asarray(minutes, dtype=np.float64), np.shape(hours))
+        env = self.environment(hours + minutes / 120.0, zones)
+        loss = self.water_loss_per_et0 * self.loss_factor[zones] * env["et0"] * minutes / 60.0
+        water = self.water[zones]
+        new_water = np.maximum(water - loss, 0.1)
+        self.substrate_ec[zones] = self.substrate_ec[zones] * water / new_water
+        self.water[zones] = new_water
+        self.hours[zones] = hours + minutes / 60.0
+        return env
+
+    def irrigate(self, zones=slice(None)) -> Dict[str, np.ndarray]:
+        """
+        Tưới các vùng đến khi có nước thoát
+        Returns: thời gian tưới đầy (giây) và EC nước thoát của từng vùng
+        """
+        water = self.water[zones]
+        supplied = 1.0 - water + self.leach_fraction
+        salt = self.substrate_ec[zones] * water + self.feed_ec * supplied
+        # Nước thoát mang EC của hỗn hợp sau khi trộn đều
+        drain_ec = salt / (1.0 + self.leach_fraction)
+        self.substrate_ec[zones] = drain_ec
+        self.water[zones] = 1.0
+
+        fill_seconds = supplied / self.flow_rate[zones]
+        self.hours[zones] = self.hours[zones] + fill_seconds / 3600.0
+        measured_ec = drain_ec + self.rng.normal(0.0, self.ec_noise, np.shape(drain_ec))
+        return {
+            "T_đầy_giây": np.rint(fill_seconds).astype(np.int64),
+            "EC_đo_được": np.round(measured_ec, 2),
+        }
+
+    def step(self, wait_minutes, zones=slice(None)) -> Dict[str, np.ndarray]:
+        """Một chu trình đầy đủ cho các vùng: chờ rồi tưới"""
+        env = self.evaporate(wait_minutes, zones)
+        result = self.irrigate(zones)
+        result.update(env)
+        return result
+
+
+class SimulatedController:
+    """Controller dùng ZoneSimulator cho một vùng; thời gian chờ tính từ nguồn thời gian"""
+
+    def __init__(self,
+                 simulator: ZoneSimulator,
+                 zone: int = 0,
+                 time_source: Callable[[], float] = time.time,
+                 time_scale: float = 1.0):
+        """
+        time_source: hàm trả về thời điểm hiện tại (giây)
+        time_scale: số giây mô phỏng cho mỗi giây của time_source
+        """
+        self.simulator = simulator
+        self.zone = zone
+        self.time_source = time_source
+        self.time_scale = time_scale
+        self._last_irrigation = time_source()
+
+    def tưới_cho_đến_khi_đầy(self) -> tuple[int, float]:
+        """
+        Tưới vùng này sau khoảng thời gian đã trôi qua kể từ lần tưới trước
+        Returns: (T_đầy_giây, EC_đo_được)
+        """
+        print("🚿 Bắt đầu tưới (mô phỏng vật lý)...")
+        elapsed_minutes = (self.time_source() - self._last_irrigation) * self.time_scale / 60.0
+        zones = np.array([self.zone])
+        self.simulator.evaporate(elapsed_minutes, zones)
+        result = self.simulator.irrigate(zones)
+        self._last_irrigation = self.time_source()
+
+        T_đầy = int(result["T_đầy_giây"][0])
+        EC = float(result["EC_đo_được"][0])
+        print(f"✅ Tưới hoàn thành! Thời gian: {T_đầy}s, EC: {EC}")
+        return T_đầy, EC
+
+    async def atưới_cho_đến_khi_đầy(self) -> tuple[int, float]:
+        # Mô phỏng tính toán tức thì, không có gì để chờ
+        return self.tưới_cho_đến_khi_đầy()
+
+
+class SimulatedEnvironmentSensor:
+    """EnvironmentSensor đọc môi trường của một vùng trong ZoneSimulator"""
+
+    def __init__(self, simulator: ZoneSimulator, zone: int = 0):
+        self.simulator = simulator
+        self.zone = zone
+
+    def get_current_environment(self) -> EnvironmentData:
+        """Lấy dữ liệu môi trường hiện tại"""
+        env = self.simulator.environment(zones=np.array([self.zone]))
+        return EnvironmentData(
+            nhiệt_độ=round(float(env["nhiệt_độ"][0]), 1),
+            độ_ẩm=round(float(env["độ_ẩm"][0]), 1),
+            et0=round(float(env["et0"][0]), 2)
+        )
+
+    def get_weather_forecast(self) -> str:
+        """Dự báo dựa trên xu hướng nhiệt độ 3 giờ tới của vùng"""
+        zones = np.array([self.zone])
+        hours = self.simulator.hours[zones]
+        now = self.simulator.environment(hours, zones)
+        later = self.simulator.environment(hours + 3.0, zones)
+        delta = float(later["nhiệt_độ"][0] - now["nhiệt_độ"][0])
+        if delta > 1.0:
+            return "Trời nắng, nhiệt độ có xu hướng tăng nhẹ."
+        if delta < -1.0:
+            return "Trời âm u, độ ẩm cao."
+        return "Thời tiết ổn định, độ ẩm trung bình."
+
+    async def aget_current_environment(self) -> EnvironmentData:
+        return self.get_current_environment()
+
+    async def aget_weather_forecast(self) -> str:
+        return self.get_weather_forecast()
+
+
+class RulePlanAgent:
+    """Plan Agent theo luật tỉ lệ, không gọi LLM (dùng cho kịch bản mô phỏng dài)"""
+
+    def __init__(self, target_ec: float = 4.0, gain: float = 40.0):
+        self.target_ec = target_ec
+        self.gain = gain
+
+    def decide_next_wait_time(self, last_reflection: str, history: List[Dict],
+                              current_env: Dict, forecast: str) -> Dict:
+        if not history:
+            return {"T_chờ_đề_xuất": 120, "lý_do": "Chưa có lịch sử, dùng mặc định"}
+        last_ec = history[-1]["output_data"]["EC_đo_được"]
+        last_wait = history[-1]["input_data"]["T_chờ_phút"]
+        new_wait = int(max(60, min(300, round(last_wait - self.gain * (last_ec - self.target_ec)))))
+        return {"T_chờ_đề_xuất": new_wait, "lý_do": f"Luật tỉ lệ theo sai số EC {last_ec - self.target_ec:+.2f}"}
+
+    async def adecide_next_wait_time(self, *args, **kwargs) -> Dict:
+        return self.decide_next_wait_time(*args, **kwargs)
+
+
+class TemplateReflectionAgent:
+    """Reflection Agent dạng mẫu câu, không gọi LLM"""
+
+    def __init__(self, target_ec: float = 4.0):
+        self.target_ec = target_ec
+
+    def create_reflection(self, input_data: Dict, output_data: Dict) -> str:
+        ec = output_data["EC_đo_được"]
+        trend = "cao hơn" if ec > self.target_ec else "thấp hơn"
+        return f"Chờ {input_data['T_chờ_phút']} phút cho EC {ec}, {trend} mục tiêu {self.target_ec}."
+
+    async def acreate_reflection(self, input_data: Dict, output_data: Dict) -> str:
+        return self.create_reflection(input_data, output_data)
+
+
+def run_season(days: int = 90,
+               n_zones: int = 4,
+               seed: int = 42,
+               directory: Optional[str] = None,
+               start: Optional[datetime] = None) -> List[Dict]:
+    """
+    Chạy IrrigationSystem đầy đủ cho nhiều vùng trong `days` ngày mô phỏng
+    trên đồng hồ sự kiện rời rạc: không có lệnh chờ thật, timestamp vẫn đúng
+    Returns: tổng kết của từng vùng
+    """
+    from main import IrrigationSystem
+
+    directory = directory or tempfile.mkdtemp(prefix="irrigation_season_")
+    start = start or datetime(2025, 1, 1, 7, 0)
+    end = start + timedelta(days=days)
+    simulator = ZoneSimulator(n_zones=n_zones, seed=seed)
+    summaries = []
+
+    for zone in range(n_zones):
+        clock = SimulatedClock(start)
+        system = IrrigationSystem(
+            controller=SimulatedController(simulator, zone, time_source=clock.time),
+            sensor=SimulatedEnvironmentSensor(simulator, zone),
+            clock=clock,
+            database=Database(file_path=os.path.join(directory, f"zone_{zone}.jsonl"),
+                              storage="jsonl", fsync_every=0),
+            reflection_agent=TemplateReflectionAgent(),
+            plan_agent=RulePlanAgent(),
+        )
+        with contextlib.redirect_stdout(io.StringIO()):
+            system.run_calibration_phase()
+            while clock.now() < end:
+                system.run_operation_cycle()
+        system.database.close()
+
+        aggregates = system.database.aggregates
+        summaries.append({
+            "zone": zone,
+            "cycles": aggregates.count,
+            "first": next(system.database.iter_records())["timestamp"],
+            "last": system.database.get_last_record()["timestamp"],
+            "EC_tb": aggregates.mean("EC"),
+            "EC_gần_đây": aggregates.rolling["EC"].mean,
+            "T_chờ_tb": aggregates.mean("T_chờ"),
+        })
+    return summaries
+
+
+def main():
+    """Chạy thử: nhiều vùng với bộ điều khiển tỉ lệ đơn giản"""
+    n_zones, cycles, target_ec = 10_000, 200, 4.0
+    simulator = ZoneSimulator(n_zones=n_zones, seed=42)
+    wait = np.full(n_zones, 120.0)
+
+    started = time.perf_counter()
+    for _ in range(cycles):
+        result = simulator.step(wait)
+        wait = np.clip(wait - 40.0 * (result["EC_đo_được"] - target_ec), 60, 300)
+    elapsed = time.perf_counter() - started
+
+    ec = result["EC_đo_được"]
+    print(f"🌱 {n_zones} vùng x {cycles} chu trình trong {elapsed:.2f}s")
+    print(f"📊 EC cuối: trung bình {ec.mean():.2f}, độ lệch {ec.std():.2f}")
+    print(f"⏰ T_chờ: trung bình {wait.mean():.0f} phút, T_đầy trung bình {result['T_đầy_giây'].mean():.0f}s")
+
+    # Kịch bản mùa vụ: hệ thống đầy đủ (Database, thống kê) trên đồng hồ sự kiện rời rạc
+    started = time.perf_counter()
+    summaries = run_season(days=90, n_zones=4)
+    elapsed = time.perf_counter() - started
+    print(f"\n🗓️ 90 ngày x {len(summaries)} vùng trong {elapsed:.2f}s")
+    for summary in summaries:
+        print(f"  Vùng {summary['zone']}: {summary['cycles']} chu trình "
+              f"({summary['first'][:16]} → {summary['last'][:16]}), "
+              f"EC gần đây {summary['EC_gần_đây']:.2f}, T_chờ tb {summary['T_chờ_tb']:.0f} phút")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""
+Tính trước quyết định của chu trình kế tiếp trong lúc đang chờ T_chờ
+Mỗi dải EC khả dĩ (quanh EC gần nhất) được Plan Agent quyết định sẵn; khi EC thật
+về, chọn quyết định của dải tương ứng hoặc gọi trực tiếp nếu không có
+"""
+
+import asyncio
+import os
+from dataclasses import asdict
+from typing import Dict, List, Optional
+
+from components import CyclePlan
+
+
+class SpeculativePlanner:
+    """Quyết định tính trước theo dải EC cho một vùng"""
+
+    def __init__(self,
+                 plan_agent,
+                 target_ec: float = 4.0,
+                 bands: Optional[int] = None,
+                 band_width: Optional[float] = None):
+        """
+        bands: số dải EC tính trước quanh EC dự kiến (mỗi dải một lần gọi Plan Agent)
+        band_width: độ rộng mỗi dải EC
+        """
+        self.plan_agent = plan_agent
+        self.target_ec = target_ec
+        self.bands = bands if bands is not None else int(os.getenv("SPECULATIVE_BANDS", "5"))
+        self.band_width = (band_width if band_width is not None
+                           else float(os.getenv("SPECULATIVE_BAND_WIDTH", "0.2")))
+        self._forecast = ""
+        self._candidates: Dict[int, asyncio.Task] = {}
+        self.hits = 0
+        self.misses = 0
+        self.not_ready = 0
+
+    def band(self, ec: float) -> int:
+        return round(ec / self.band_width)
+
+    def _hypothetical(self, plan: CyclePlan, band: int) -> Dict:
+        """Bản ghi giả định cho chu trình đang chờ nếu EC rơi vào dải `band`"""
+        ec = round(band * self.band_width, 2)
+        trend = "cao hơn" if ec > self.target_ec else "thấp hơn"
+        return {
+            "id": 0,
+            "timestamp": "",
+            "phase": plan.phase,
+            "input_data": {"T_chờ_phút": plan.T_chờ_phút, "môi_trường_tb": asdict(plan.môi_trường)},
+            "output_data": {"T_đầy_giây": 0, "EC_đo_được": ec},
+            "reflection_text": (f"Dự kiến EC≈{ec} sau khi chờ {plan.T_chờ_phút} phút, "
+                                f"{trend} mục tiêu {self.target_ec}."),
+        }
+
+    def reset(self):
+        """Hủy các quyết định tính trước chưa xong của chu trình cũ"""
+        for task in self._candidates.values():
+            task.cancel()
+        self._candidates = {}
+
+    async def aprecompute(self, history: List[Dict], plan: CyclePlan, expected_ec: float):
+        """Tính trước quyết định cho các dải EC quanh `expected_ec` (chạy song song)"""
+        self.reset()
+        self._forecast = plan.dự_báo
+        current_env = asdict(plan.môi_trường)
+        center = self.band(expected_ec)
+        for band in range(center - self.bands // 2, center + (self.bands + 1) // 2):
+            record = self._hypothetical(plan, band)
+            self._candidates[band] = asyncio.create_task(self.plan_agent.adecide_next_wait_time(
+                last_reflection=record["reflection_text"],
+                history=history + [record],
+                current_env=current_env,
+                forecast=plan.dự_báo
+            ))
+        await asyncio.gather(*self._candidates.values(), return_exceptions=True)
+
+    def take(self, ec: float, forecast: str) -> Optional[Dict]:
+        """
+        Quyết định tính trước cho EC thật vừa đo; None nếu không có, chưa xong
+        hoặc dự báo đã đổi (khi đó gọi Plan Agent trực tiếp)
+        """
+        task = self._candidates.get(self.band(ec))
+        if task is None or forecast != self._forecast:
+            self.misses += 1
+            return None
+        if not task.done() or task.cancelled() or task.exception() is not None:
+            self.not_ready += 1
+            return None
+        self.hits += 1
+        decision = dict(task.result())
+        decision["lý_do"] = f"{decision['lý_do']} (tính trước cho EC≈{self.band(ec) * self.band_width:.2f})"
+        return decision
+
+    def stats(self) -> Dict:
+        total = self.hits + self.misses + self.not_ready
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "not_ready": self.not_ready,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
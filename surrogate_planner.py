@@ -0,0 +1,241 @@
+"""
+Bộ lập kế hoạch thay thế (surrogate) học từ lịch sử quyết định: hồi quy ridge
+bằng NumPy dự đoán EC của chu trình kế tiếp từ T_chờ ứng viên và điều kiện
+môi trường, rồi chọn T_chờ bằng một lần quét véc-tơ hóa 60-300 phút (< 1 ms)
+Dùng làm bộ lập kế hoạch chính hoặc để kiểm tra quyết định của LLM
+
+Huấn luyện ngoại tuyến từ lịch sử đang cấu hình: python surrogate_planner.py
+"""
+
+import os
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from wait_controller import MAX_WAIT, MIN_WAIT, WaitTimeController
+
+# Số cặp (chu trình trước, chu trình sau) tối thiểu để huấn luyện
+MIN_SAMPLES = 30
+
+# Thứ tự cột của đầu vào thô
+RAW_COLUMNS = ("T_chờ", "nhiệt_độ", "độ_ẩm", "et0", "EC_trước")
+
+
+def training_pairs(records: Iterable[Dict]) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    (đầu vào thô, EC đo được): mỗi chu trình vận hành ghép với EC của chu trình
+    ngay trước nó; bản ghi phải theo thứ tự thời gian của một vùng
+    """
+    rows, targets = [], []
+    previous_ec = None
+    for record in records:
+        ec = record["output_data"]["EC_đo_được"]
+        if record["phase"] == "operation" and previous_ec is not None:
+            env = record["input_data"]["môi_trường_tb"]
+            rows.append((record["input_data"]["T_chờ_phút"], env["nhiệt_độ"], env["độ_ẩm"], env["et0"], previous_ec))
+            targets.append(ec)
+        previous_ec = ec
+    return np.asarray(rows, dtype=np.float64).reshape(-1, len(RAW_COLUMNS)), np.asarray(targets, dtype=np.float64)
+
+
+def design(raw: np.ndarray) -> np.ndarray:
+    """
+    Đặc trưng cho hồi quy: EC tăng theo lượng nước bay hơi (ET0 x thời gian chờ)
+    nên ngoài các cột thô có thêm T_chờ·ET0 và T_chờ² (đã chia cho MAX_WAIT)
+    """
+    wait, temperature, humidity, et0, last_ec = raw.T
+    return np.column_stack((wait, wait * et0, wait * wait / MAX_WAIT, temperature, humidity, et0, last_ec))
+
+
+class SurrogateModel:
+    """Hồi quy ridge trên đặc trưng đã chuẩn hóa; lưu/tải bằng np.savez"""
+
+    def __init__(self, mean: np.ndarray, scale: np.ndarray, coef: np.ndarray, intercept: float,
+                 rmse: float, samples: int):
+        """rmse: sai số EC trên phần dữ liệu kiểm định (chu trình mới nhất) khi huấn luyện"""
+        self.mean = mean
+        self.scale = scale
+        self.coef = coef
+        self.intercept = intercept
+        self.rmse = rmse
+        self.samples = samples
+
+    @classmethod
+    def fit(cls, raw: np.ndarray, targets: np.ndarray, alpha: float = 1.0,
+            rmse: Optional[float] = None) -> "SurrogateModel":
+        features = design(raw)
+        mean = features.mean(axis=0)
+        scale = features.std(axis=0)
+        scale[scale == 0] = 1.0
+        z = (features - mean) / scale
+        intercept = float(targets.mean())
+        coef = np.linalg.solve(z.T @ z + alpha * np.eye(z.shape[1]), z.T @ (targets - intercept))
+        model = cls(mean, scale, coef, intercept, 0.0, len(targets))
+        model.rmse = rmse if rmse is not None else model.error(raw, targets)
+        return model
+
+    def predict(self, raw: np.ndarray) -> np.ndarray:
+        return ((design(raw) - self.mean) / self.scale) @ self.coef + self.intercept
+
+    def error(self, raw: np.ndarray, targets: np.ndarray) -> float:
+        return float(np.sqrt(np.mean((self.predict(raw) - targets) ** 2)))
+
+    def save(self, path: str):
+        np.savez(path, mean=self.mean, scale=self.scale, coef=self.coef,
+                 intercept=self.intercept, rmse=self.rmse, samples=self.samples)
+
+    @classmethod
+    def load(cls, path: str) -> "SurrogateModel":
+        with np.load(path) as data:
+            return cls(data["mean"], data["scale"], data["coef"], float(data["intercept"]),
+                       float(data["rmse"]), int(data["samples"]))
+
+
+def train(records: Iterable[Dict], alpha: float = 1.0, holdout: float = 0.2) -> SurrogateModel:
+    """
+    Huấn luyện trên toàn bộ lịch sử; rmse báo cáo lấy từ lần khớp trên phần cũ
+    và kiểm định trên `holdout` chu trình mới nhất
+    Raises: ValueError nếu chưa đủ MIN_SAMPLES cặp chu trình
+    """
+    raw, targets = training_pairs(records)
+    if len(targets) < MIN_SAMPLES:
+        raise ValueError(f"Cần ít nhất {MIN_SAMPLES} cặp chu trình, mới có {len(targets)}")
+    split = int(len(targets) * (1 - holdout))
+    validation = SurrogateModel.fit(raw[:split], targets[:split], alpha)
+    return SurrogateModel.fit(raw, targets, alpha, rmse=validation.error(raw[split:], targets[split:]))
+
+
+class SurrogatePlanner:
+    """Chọn T_chờ có EC dự đoán gần mục tiêu nhất trong 60-300 phút"""
+
+    def __init__(self, model: SurrogateModel, target_ec: float = 4.0, tolerance: Optional[float] = None):
+        """
+        tolerance: |EC dự đoán - mục tiêu| tối đa để tự quyết định; quyết định LLM
+        lệch hơn mức này trong khi mô hình tìm được T_chờ đạt thì bị thay thế
+        """
+        self.model = model
+        self.target_ec = target_ec
+        self.tolerance = tolerance or float(os.getenv("SURROGATE_TOLERANCE", "0.3"))
+        self._candidates = np.arange(MIN_WAIT, MAX_WAIT + 1, dtype=np.float64)
+        self._raw = np.empty((len(self._candidates), len(RAW_COLUMNS)))
+        self._raw[:, 0] = self._candidates
+        self.decisions = 0
+        self.escalations = 0
+        self.checks = 0
+        self.overrides = 0
+        self.sweeps = 0
+        self.total_seconds = 0.0
+
+    def _conditions(self, history: List[Dict], current_env: Dict) -> Tuple[float, float, float, float]:
+        return (current_env["nhiệt_độ"], current_env["độ_ẩm"], current_env["et0"],
+                history[-1]["output_data"]["EC_đo_được"])
+
+    def sweep(self, history: List[Dict], current_env: Dict) -> Tuple[int, float]:
+        """(T_chờ tốt nhất, EC dự đoán) trên toàn bộ lưới 60-300 phút"""
+        started = time.perf_counter()
+        self._raw[:, 1:] = self._conditions(history, current_env)
+        predicted = self.model.predict(self._raw)
+        best = int(np.argmin(np.abs(predicted - self.target_ec)))
+        self.total_seconds += time.perf_counter() - started
+        self.sweeps += 1
+        return int(self._candidates[best]), float(predicted[best])
+
+    def predict_ec(self, wait: float, history: List[Dict], current_env: Dict) -> float:
+        raw = np.array([(wait, *self._conditions(history, current_env))], dtype=np.float64)
+        return float(self.model.predict(raw)[0])
+
+    def decide(self, history: List[Dict], current_env: Dict) -> Tuple[Optional[Dict], str]:
+        """
+        Returns: (quyết định, "") nếu có T_chờ đạt mục tiêu trong dung sai,
+        ngược lại (None, lý do chuyển lên LLM)
+        """
+        if not history:
+            return None, "chưa có lịch sử"
+        wait, ec = self.sweep(history, current_env)
+        if abs(ec - self.target_ec) > self.tolerance:
+            self.escalations += 1
+            return None, f"mô hình thay thế không đạt mục tiêu (EC dự đoán {ec:.2f})"
+        self.decisions += 1
+        return {
+            "T_chờ_đề_xuất": wait,
+            "lý_do": f"Mô hình thay thế: chờ {wait} phút, EC dự đoán {ec:.2f} (mục tiêu {self.target_ec})"
+        }, ""
+
+    def check(self, decision: Dict, history: List[Dict], current_env: Dict) -> Dict:
+        """Kiểm tra quyết định của LLM; thay bằng T_chờ của mô hình nếu EC dự đoán lệch mục tiêu"""
+        if not history:
+            return decision
+        self.checks += 1
+        wait = decision["T_chờ_đề_xuất"]
+        predicted = self.predict_ec(wait, history, current_env)
+        if abs(predicted - self.target_ec) <= self.tolerance:
+            return decision
+        best_wait, best_ec = self.sweep(history, current_env)
+        if abs(best_ec - self.target_ec) > self.tolerance:
+            return decision
+        self.overrides += 1
+        print(f"⚠️ Mô hình thay thế sửa T_chờ {wait} -> {best_wait} phút (EC dự đoán {predicted:.2f} -> {best_ec:.2f})")
+        return {
+            "T_chờ_đề_xuất": best_wait,
+            "lý_do": f"{decision['lý_do']} (mô hình thay thế sửa {wait} -> {best_wait} phút: "
+                     f"EC dự đoán {predicted:.2f} lệch mục tiêu)"
+        }
+
+    def decide_next_wait_time(self, last_reflection: str, history: List[Dict],
+                              current_env: Dict, forecast: str) -> Dict:
+        """Cùng giao diện với PlanAgent; ngoài vùng tin cậy thì dùng một bước PI"""
+        decision, reason = self.decide(history, current_env)
+        if decision is not None:
+            return decision
+        if not history:
+            return {"T_chờ_đề_xuất": 120, "lý_do": f"Thời gian chờ mặc định ({reason})"}
+        decision = WaitTimeController(self.target_ec).step(history, current_env)
+        decision["lý_do"] = f"{decision['lý_do']} ({reason})"
+        return decision
+
+    async def adecide_next_wait_time(self, *args, **kwargs) -> Dict:
+        return self.decide_next_wait_time(*args, **kwargs)
+
+    def stats(self) -> Dict:
+        return {
+            "rmse": self.model.rmse,
+            "samples": self.model.samples,
+            "decisions": self.decisions,
+            "escalations": self.escalations,
+            "checks": self.checks,
+            "overrides": self.overrides,
+            "mean_sweep_microseconds": self.total_seconds / self.sweeps * 1e6 if self.sweeps else 0.0,
+        }
+
+
+def load_surrogate_planner(target_ec: float = 4.0, path: Optional[str] = None) -> Optional[SurrogatePlanner]:
+    """
+    Bộ lập kế hoạch từ file mô hình (SURROGATE_MODEL_FILE); None nếu chưa huấn
+    luyện hoặc sai số kiểm định lớn hơn dung sai
+    """
+    path = path or os.getenv("SURROGATE_MODEL_FILE", "surrogate_model.npz")
+    if not os.path.exists(path):
+        print(f"⚠️ Chưa có mô hình thay thế {path}, chạy python surrogate_planner.py để huấn luyện")
+        return None
+    planner = SurrogatePlanner(SurrogateModel.load(path), target_ec)
+    if planner.model.rmse > planner.tolerance:
+        print(f"⚠️ Bỏ qua mô hình thay thế: sai số kiểm định {planner.model.rmse:.2f} > {planner.tolerance}")
+        return None
+    return planner
+
+
+def main():
+    """Huấn luyện từ lịch sử đang cấu hình (HISTORY_STORAGE) và lưu SURROGATE_MODEL_FILE"""
+    from components import create_database
+
+    database = create_database()
+    model = train(database.iter_records(), alpha=float(os.getenv("SURROGATE_RIDGE_ALPHA", "1.0")))
+    path = os.getenv("SURROGATE_MODEL_FILE", "surrogate_model.npz")
+    model.save(path)
+    print(f"🧪 Mô hình thay thế: {model.samples} cặp chu trình, sai số kiểm định EC {model.rmse:.3f}")
+    print(f"💾 Đã lưu {path}")
+
+
+if __name__ == "__main__":
+    main()
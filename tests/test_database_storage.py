@@ -0,0 +1,193 @@
+"""Ghi rồi mở lại lịch sử qua từng chế độ lưu trữ"""
+
+import json
+import os
+from datetime import datetime
+
+import pytest
+
+from components import AGGREGATES_SUFFIX, CycleRecord, Database, EnvironmentData, InputData, OutputData, SQLiteDatabase
+from cycle_aggregates import CycleAggregates
+from history_segments import SegmentStore
+
+STORAGES = ["json", "jsonl", "segmented", "binary", "sqlite"]
+
+
+def make_record(record_id: int, day: int = 1, ec: float = 4.1, text: str = "EC ổn định") -> CycleRecord:
+    return CycleRecord(
+        id=record_id,
+        timestamp=f"2026-03-{day:02d}T08:{record_id % 60:02d}:00",
+        phase="calibration" if record_id == 1 else "operation",
+        input_data=InputData(T_chờ_phút=90 + record_id, môi_trường_tb=EnvironmentData(31.5, 62.0, 5.25)),
+        output_data=OutputData(T_đầy_giây=40, EC_đo_được=ec),
+        reflection_text=text,
+    )
+
+
+def open_database(storage: str, directory):
+    if storage == "sqlite":
+        return SQLiteDatabase(str(directory / "history.db"))
+    return Database(file_path=str(directory / f"history.{storage}"), storage=storage)
+
+
+@pytest.mark.parametrize("storage", STORAGES)
+def test_records_survive_reopen(storage, tmp_path):
+    records = [make_record(1, day=1), make_record(2, day=2, ec=3.8), make_record(3, day=2, ec=4.25)]
+    database = open_database(storage, tmp_path)
+    for record in records:
+        database.add_record(record)
+    database.close()
+
+    reopened = open_database(storage, tmp_path)
+    expected = [record.to_dict() for record in records]
+    assert list(reopened.iter_records()) == expected
+    assert reopened.count_records() == 3
+    assert reopened.get_last_record() == expected[-1]
+    assert reopened.get_next_id() == 4
+    assert reopened.get_records_between(datetime(2026, 3, 2), datetime(2026, 3, 3)) == expected[1:]
+    assert reopened.aggregates.count == 3
+    reopened.close()
+
+
+def test_journal_drops_torn_last_line(tmp_path):
+    path = tmp_path / "history.jsonl"
+    database = Database(file_path=str(path), storage="jsonl")
+    database.add_record(make_record(1))
+    database.add_record(make_record(2))
+    database.close()
+    size = path.stat().st_size
+    with open(path, "ab") as f:
+        f.write(b'{"id": 3, "timest')
+
+    reopened = Database(file_path=str(path), storage="jsonl")
+    assert [record["id"] for record in reopened.iter_records()] == [1, 2]
+    assert path.stat().st_size == size
+    reopened.add_record(make_record(3))
+    reopened.close()
+    assert Database(file_path=str(path), storage="jsonl").count_records() == 3
+
+
+def test_binary_log_drops_only_a_torn_tail(tmp_path):
+    path = tmp_path / "history.bin"
+    database = Database(file_path=str(path), storage="binary")
+    for record_id in (1, 2, 3):
+        database.add_record(make_record(record_id))
+    database.close()
+    content = path.read_bytes()
+    path.write_bytes(content[:-4])
+
+    reopened = Database(file_path=str(path), storage="binary")
+    assert [record["id"] for record in reopened.iter_records()] == [1, 2]
+    reopened.add_record(make_record(3))
+    reopened.close()
+    assert Database(file_path=str(path), storage="binary").count_records() == 3
+
+
+def test_binary_log_refuses_corruption_mid_file(tmp_path):
+    path = tmp_path / "history.bin"
+    database = Database(file_path=str(path), storage="binary")
+    for record_id in (1, 2, 3):
+        database.add_record(make_record(record_id))
+    database.close()
+    content = bytearray(path.read_bytes())
+    content[20] ^= 0xFF
+    path.write_bytes(bytes(content))
+
+    with pytest.raises(ValueError):
+        Database(file_path=str(path), storage="binary")
+    assert path.read_bytes() == bytes(content)
+
+
+@pytest.mark.parametrize("storage", STORAGES)
+def test_aggregates_sidecar_is_saved_on_sync_not_per_record(storage, tmp_path):
+    database = open_database(storage, tmp_path)
+    sidecar = tmp_path / (os.path.basename(database.file_path) + AGGREGATES_SUFFIX)
+    saved = sidecar.read_text(encoding="utf-8")
+    database.add_record(make_record(1))
+    database.add_record(make_record(2))
+    assert sidecar.read_text(encoding="utf-8") == saved
+    database.sync()
+    assert json.loads(sidecar.read_text(encoding="utf-8"))["count"] == 2
+    database.close()
+
+
+@pytest.mark.parametrize("storage", STORAGES)
+def test_stale_aggregates_sidecar_is_rebuilt(storage, tmp_path):
+    database = open_database(storage, tmp_path)
+    database.add_record(make_record(1))
+    database.sync()
+    # Mất điện trước lần lưu thống kê kế tiếp: lịch sử đã có bản ghi 2, file thống kê chưa
+    database.add_record(make_record(2, ec=3.8))
+    database._unsaved_aggregates = 0
+    database.close()
+
+    reopened = open_database(storage, tmp_path)
+    assert reopened.aggregates.count == 2
+    reopened.close()
+
+
+def test_hot_window_reopen_does_not_count_the_cold_journal(tmp_path, monkeypatch):
+    path = str(tmp_path / "history.jsonl")
+    database = Database(file_path=path, storage="jsonl", hot_window=2)
+    for record_id in range(1, 6):
+        database.add_record(make_record(record_id))
+    database.close()
+
+    monkeypatch.setattr(Database, "count_records", lambda self: pytest.fail("quét lại phần lạnh"))
+    reopened = Database(file_path=path, storage="jsonl", hot_window=2)
+    assert reopened.aggregates.count == 5
+    reopened.close()
+
+
+def test_open_segment_drops_only_a_torn_tail(tmp_path):
+    store = SegmentStore(str(tmp_path / "segments"))
+    for record_id in (1, 2):
+        store.append(make_record(record_id).to_dict(), None)
+    store.close()
+    path = tmp_path / "segments" / store.segments[-1]["file"]
+    size = path.stat().st_size
+    with open(path, "ab") as f:
+        f.write(b'{"id": 3, "timest')
+
+    reopened = SegmentStore(str(tmp_path / "segments"))
+    assert [record["id"] for record in reopened.iter_all()] == [1, 2]
+    assert reopened.count() == 2
+    assert path.stat().st_size == size
+
+
+def test_open_segment_refuses_corruption_mid_file(tmp_path):
+    store = SegmentStore(str(tmp_path / "segments"))
+    for record_id in (1, 2, 3):
+        store.append(make_record(record_id).to_dict(), None)
+    store.close()
+    path = tmp_path / "segments" / store.segments[-1]["file"]
+    lines = path.read_bytes().splitlines(keepends=True)
+    path.write_bytes(lines[0] + b'{"id": 2, "tim\n' + lines[2])
+
+    with pytest.raises(json.JSONDecodeError):
+        SegmentStore(str(tmp_path / "segments"))
+    assert path.read_bytes().endswith(lines[2])
+
+
+def test_sqlite_batch_appends_to_aggregates_without_rescanning(tmp_path, monkeypatch):
+    database = SQLiteDatabase(str(tmp_path / "history.db"))
+    database.add_record(make_record(1))
+    monkeypatch.setattr(SQLiteDatabase, "iter_records", lambda self: pytest.fail("quét lại toàn bảng"))
+    assert database.add_records([make_record(2).to_dict(), make_record(3, ec=3.8).to_dict()]) == 2
+    assert database.aggregates.count == 3
+    assert database.aggregates.last_id == 3
+    database.close()
+
+
+def test_sqlite_batch_replacing_rows_rebuilds_aggregates(tmp_path):
+    database = SQLiteDatabase(str(tmp_path / "history.db"))
+    for record_id in (1, 2, 3):
+        database.add_record(make_record(record_id))
+    database.add_records([make_record(2, ec=3.5).to_dict(), make_record(4).to_dict()])
+    rebuilt = CycleAggregates(database.target_ec)
+    for record in database.iter_records():
+        rebuilt.add(record)
+    rebuilt.history_mark = database.history_mark()
+    assert database.aggregates.to_dict() == rebuilt.to_dict()
+    assert database.aggregates.count == 4
+    database.close()
@@ -0,0 +1,187 @@
+"""Chuyển trạng thái của cầu dao và lượt thử bị hủy/hết hạn chót"""
+
+import asyncio
+
+import pytest
+
+from deadline import Deadline, DeadlineExceeded
+from llm_client import CircuitBreaker, CircuitOpenError, LLMClient
+
+
+class FakeTime:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class TransientError(Exception):
+    status_code = 503
+
+
+class Agent:
+    """agent.run/arun giả: trả lời, ném lỗi hoặc treo theo kịch bản"""
+
+    def __init__(self, *outcomes):
+        self.outcomes = list(outcomes)
+        self.calls = 0
+
+    def _next(self):
+        self.calls += 1
+        outcome = self.outcomes.pop(0) if self.outcomes else "ok"
+        if isinstance(outcome, BaseException):
+            raise outcome
+        return outcome
+
+    def run(self, prompt):
+        return self._next()
+
+    async def arun(self, prompt):
+        outcome = self._next()
+        if outcome == "hang":
+            await asyncio.sleep(3600)
+        return outcome
+
+
+@pytest.fixture
+def clock():
+    return FakeTime()
+
+
+def open_breaker(clock, threshold=2, reset=30.0) -> CircuitBreaker:
+    breaker = CircuitBreaker(failure_threshold=threshold, reset_timeout=reset, time_source=clock)
+    for _ in range(threshold):
+        breaker.record_failure()
+    return breaker
+
+
+def test_opens_after_consecutive_failures(clock):
+    breaker = CircuitBreaker(failure_threshold=3, time_source=clock)
+    breaker.record_failure()
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.state == "closed"
+    breaker.record_failure()
+    assert breaker.state == "open"
+    assert not breaker.allow()
+    assert breaker.snapshot() == {"state": "open", "consecutive_failures": 3, "opens": 1}
+
+
+def test_half_open_lets_a_single_probe_through(clock):
+    breaker = open_breaker(clock)
+    clock.now = 30.0
+    assert breaker.allow()
+    assert breaker.state == "half_open"
+    assert not breaker.allow()
+    breaker.record_success()
+    assert breaker.state == "closed"
+    assert breaker.allow()
+
+
+def test_failed_probe_reopens_with_a_fresh_timeout(clock):
+    breaker = open_breaker(clock)
+    clock.now = 30.0
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == "open"
+    clock.now = 59.0
+    assert not breaker.allow()
+    clock.now = 60.0
+    assert breaker.allow()
+
+
+def test_released_probe_reopens(clock):
+    breaker = open_breaker(clock)
+    clock.now = 30.0
+    assert breaker.allow()
+    breaker.release_probe()
+    assert breaker.state == "open"
+    assert not breaker.allow()
+    clock.now = 60.0
+    assert breaker.allow()
+
+
+def test_release_probe_leaves_a_closed_breaker(clock):
+    breaker = CircuitBreaker(time_source=clock)
+    breaker.release_probe()
+    assert breaker.state == "closed"
+
+
+def test_call_retries_transient_errors(clock):
+    client = LLMClient("test", retries=2, base_delay=0, breaker=CircuitBreaker(time_source=clock))
+    agent = Agent(TransientError(), "ok")
+    assert client.call(agent, "p") == "ok"
+    assert agent.calls == 2
+    assert client.status()["retried"] == 1
+    assert client.breaker.state == "closed"
+
+
+def test_call_rejected_while_open(clock):
+    client = LLMClient("test", retries=0, breaker=open_breaker(clock))
+    with pytest.raises(CircuitOpenError):
+        client.call(Agent(), "p")
+    assert client.status()["rejected"] == 1
+
+
+def test_interrupted_sync_probe_is_released(clock):
+    client = LLMClient("test", retries=0, breaker=open_breaker(clock))
+    clock.now = 30.0
+    with pytest.raises(KeyboardInterrupt):
+        client.call(Agent(KeyboardInterrupt()), "p")
+    assert client.breaker.state == "open"
+    assert client.status()["in_flight"] == 0
+
+
+def test_probe_cut_by_deadline_is_released(clock):
+    client = LLMClient("test", retries=0, timeout=10, breaker=open_breaker(clock))
+    clock.now = 30.0
+
+    async def run():
+        with Deadline(0.05, "test"):
+            await client.acall(Agent("hang"), "p")
+
+    with pytest.raises(DeadlineExceeded):
+        asyncio.run(run())
+    assert client.breaker.state == "open"
+    # Hết hạn chót không phải lỗi của nhà cung cấp
+    assert client.breaker.failures == 2
+    clock.now = 60.0
+    assert client.breaker.allow()
+
+
+def test_cancelled_probe_is_released(clock):
+    client = LLMClient("test", retries=0, timeout=10, breaker=open_breaker(clock))
+    clock.now = 30.0
+
+    async def run():
+        task = asyncio.ensure_future(client.acall(Agent("hang"), "p"))
+        await asyncio.sleep(0.01)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(run())
+    assert client.breaker.state == "open"
+    assert client.status()["in_flight"] == 0
+
+
+def test_probe_waiting_for_a_slot_past_the_deadline_is_released(clock):
+    client = LLMClient("test", max_concurrency=1, retries=0, timeout=10, breaker=CircuitBreaker(time_source=clock))
+
+    async def run():
+        busy = asyncio.ensure_future(client.acall(Agent("hang"), "p"))
+        await asyncio.sleep(0.01)
+        for _ in range(client.breaker.failure_threshold):
+            client.breaker.record_failure()
+        clock.now = 30.0
+        with Deadline(0.05, "test"):
+            with pytest.raises(DeadlineExceeded):
+                await client.acall(Agent(), "p")
+        busy.cancel()
+
+    asyncio.run(run())
+    assert client.breaker.state == "open"
+    assert not client.breaker._probing
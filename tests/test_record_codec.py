@@ -0,0 +1,89 @@
+"""Mã hóa nhị phân không mất mát và phát hiện khung hỏng bằng CRC"""
+
+import pytest
+
+import record_codec
+
+
+def record(**changes) -> dict:
+    base = {
+        "id": 7,
+        "timestamp": "2026-03-01T08:30:00",
+        "phase": "operation",
+        "input_data": {"T_chờ_phút": 120, "môi_trường_tb": {"nhiệt_độ": 31.5, "độ_ẩm": 62.0, "et0": 5.25}},
+        "output_data": {"T_đầy_giây": 45, "EC_đo_được": 4.125},
+        "reflection_text": "EC gần mục tiêu, giữ thời gian chờ.",
+    }
+    base.update(changes)
+    return base
+
+
+@pytest.mark.parametrize("value", [
+    record(),
+    # Số không biểu diễn gọn được (T_chờ thực, EC nhiều chữ số) dùng bố cục rộng
+    record(input_data={"T_chờ_phút": 90.5, "môi_trường_tb": {"nhiệt_độ": 30, "độ_ẩm": 55.5, "et0": 4.0}},
+           output_data={"T_đầy_giây": 40, "EC_đo_được": 3.14159}),
+    # Timestamp có múi giờ, giai đoạn lạ và nhận xét dài (nén zlib) giữ nguyên văn
+    record(timestamp="2026-03-01T08:30:00+07:00", phase="manual", reflection_text="Nhận xét dài. " * 20),
+    record(timestamp="không hợp lệ", reflection_text=""),
+])
+def test_round_trip(value):
+    decoded = record_codec.decode_record(record_codec.encode_record(value))
+    assert decoded == value
+    assert [type(number) for number in record_codec._numbers(decoded)] == \
+        [type(number) for number in record_codec._numbers(value)]
+
+
+def test_file_round_trip(tmp_path):
+    path = tmp_path / "history.bin"
+    records = [record(id=i, timestamp=f"2026-03-0{i}T08:00:00") for i in range(1, 4)]
+    assert record_codec.write_records(str(path), records) == 3
+    assert [value for _, value in record_codec.iter_frames(path.read_bytes())] == records
+
+
+def frames(*ids) -> list:
+    return [record_codec.frame(record_codec.encode_record(record(id=i))) for i in ids]
+
+
+def test_corrupt_frame_mid_file_raises():
+    parts = frames(1, 2, 3)
+    data = bytearray(record_codec.file_header() + b"".join(parts))
+    # Lật một byte trong payload của khung thứ hai: CRC không khớp, phía sau còn khung thứ ba
+    data[len(record_codec.file_header()) + len(parts[0]) + record_codec.FRAME.size + 5] ^= 0xFF
+    with pytest.raises(ValueError):
+        list(record_codec.iter_frames(bytes(data)))
+
+
+def test_corrupt_length_mid_file_raises():
+    parts = frames(1, 2, 3)
+    data = bytearray(record_codec.file_header() + b"".join(parts))
+    # Độ dài khung thứ hai vượt quá cuối file nhưng khung thứ ba vẫn nguyên vẹn
+    data[len(record_codec.file_header()) + len(parts[0]) + 3] = 0x7F
+    with pytest.raises(ValueError):
+        list(record_codec.iter_frames(bytes(data)))
+
+
+def test_corrupt_last_frame_stops_iteration():
+    parts = frames(1, 2)
+    data = bytearray(record_codec.file_header() + b"".join(parts))
+    data[-1] ^= 0xFF
+    assert [value["id"] for _, value in record_codec.iter_frames(bytes(data))] == [1]
+
+
+def test_truncated_frame_stops_iteration():
+    parts = frames(1, 2)
+    data = record_codec.file_header() + b"".join(parts)
+    entries = list(record_codec.iter_frames(data[:-3]))
+    assert [value["id"] for _, value in entries] == [1]
+    assert entries[-1][0] == len(record_codec.file_header()) + len(parts[0])
+
+
+def test_rejects_foreign_file_and_unknown_version():
+    with pytest.raises(ValueError):
+        list(record_codec.iter_frames(b"{}\n"))
+    with pytest.raises(ValueError):
+        list(record_codec.iter_frames(record_codec.MAGIC + bytes([record_codec.SCHEMA_VERSION + 1])))
+
+
+def test_torn_header_is_empty():
+    assert list(record_codec.iter_frames(record_codec.MAGIC[:2])) == []
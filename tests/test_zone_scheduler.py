@@ -0,0 +1,71 @@
+"""Giới hạn đồng thời của bộ lập lịch nhiều vùng"""
+
+import asyncio
+import contextlib
+import io
+from datetime import datetime
+
+from clock import SimulatedClock
+from components import Database
+from main import IrrigationSystem
+from simulator import (RulePlanAgent, SimulatedController, SimulatedEnvironmentSensor,
+                       TemplateReflectionAgent, ZoneSimulator)
+from zone_scheduler import ZoneScheduler
+
+
+class Activity:
+    """Đếm số bước plan/phản tư đang chạy cùng lúc"""
+
+    def __init__(self):
+        self.active = 0
+        self.peak = 0
+
+    async def run(self, result):
+        self.active += 1
+        self.peak = max(self.peak, self.active)
+        try:
+            await asyncio.sleep(0.01)
+            return result
+        finally:
+            self.active -= 1
+
+
+class CountedPlanAgent(RulePlanAgent):
+    def __init__(self, activity: Activity, target_ec: float):
+        super().__init__(target_ec)
+        self.activity = activity
+
+    async def adecide_next_wait_time(self, *args, **kwargs):
+        return await self.activity.run(self.decide_next_wait_time(*args, **kwargs))
+
+
+class CountedReflectionAgent(TemplateReflectionAgent):
+    def __init__(self, activity: Activity, target_ec: float):
+        super().__init__(target_ec)
+        self.activity = activity
+
+    async def acreate_reflection(self, input_data, output_data):
+        return await self.activity.run(self.create_reflection(input_data, output_data))
+
+
+def test_background_reflection_counts_toward_max_concurrency(tmp_path):
+    clock = SimulatedClock(datetime(2025, 1, 1, 7, 0))
+    simulator = ZoneSimulator(n_zones=6, seed=3)
+    scheduler = ZoneScheduler(clock=clock, max_concurrency=2)
+    activity = Activity()
+    for zone in range(6):
+        scheduler.add_zone(f"zone_{zone}", IrrigationSystem(
+            controller=SimulatedController(simulator, zone, time_source=clock.time),
+            sensor=SimulatedEnvironmentSensor(simulator, zone),
+            clock=clock,
+            database=Database(file_path=str(tmp_path / f"zone_{zone}.jsonl"), storage="jsonl", fsync_every=0),
+            reflection_agent=CountedReflectionAgent(activity, 4.0),
+            plan_agent=CountedPlanAgent(activity, 4.0),
+        ))
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        asyncio.run(scheduler.run(max_cycles=2))
+
+    assert sum(row["cycles"] for row in scheduler.status()) == 12
+    # Chu trình cuối của mỗi vùng không còn bước plan nào phía sau giữ suất đồng thời
+    assert activity.peak <= 2
@@ -0,0 +1,116 @@
+"""
+Bộ điều khiển số cho thời gian chờ: PI dạng gia số, hệ số lập lịch theo ET0
+Quyết định tại chỗ cho các chu trình thông thường; trả về lý do chuyển lên LLM
+khi tình huống nằm ngoài vùng tin cậy (sai số lớn, thời tiết bất thường, trôi)
+"""
+
+import os
+from typing import Dict, List, Optional, Tuple
+
+MIN_WAIT = 60
+MAX_WAIT = 300
+
+# ET0 tham chiếu mà các hệ số gốc được chỉnh theo
+REFERENCE_ET0 = 0.25
+
+
+class WaitTimeController:
+    """
+    T_chờ_mới = T_chờ_cũ - Kp·(e - e_trước) - Ki·e, với e = EC - mục tiêu
+
+    EC tăng theo lượng nước bay hơi (ET0 x thời gian chờ) nên khi ET0 cao mỗi
+    phút chờ làm EC thay đổi nhiều hơn: hệ số được chia theo ET0/ET0_tham_chiếu.
+    """
+
+    def __init__(self,
+                 target_ec: float = 4.0,
+                 kp: float = 20.0,
+                 ki: float = 20.0,
+                 max_step: float = 60.0,
+                 max_ec_error: Optional[float] = None,
+                 et0_range: Tuple[float, float] = (0.05, 0.5),
+                 temperature_range: Tuple[float, float] = (15.0, 40.0),
+                 drift_cycles: int = 4,
+                 drift_error: float = 0.3):
+        """
+        kp, ki: hệ số (phút cho mỗi đơn vị EC) tại ET0 tham chiếu
+        max_step: thay đổi tối đa mỗi chu trình (phút)
+        max_ec_error: |sai số EC| lớn hơn mức này thì chuyển lên LLM
+        drift_cycles, drift_error: sai số cùng dấu, trung bình vượt drift_error trong
+        drift_cycles chu trình liền nhau dù T_chờ đã chạm biên -> coi là trôi
+        """
+        self.target_ec = target_ec
+        self.kp = kp
+        self.ki = ki
+        self.max_step = max_step
+        self.max_ec_error = (max_ec_error if max_ec_error is not None
+                             else float(os.getenv("FAST_PATH_MAX_EC_ERROR", "1.0")))
+        self.et0_range = et0_range
+        self.temperature_range = temperature_range
+        self.drift_cycles = drift_cycles
+        self.drift_error = drift_error
+        self.decisions = 0
+        self.escalations: Dict[str, int] = {}
+
+    def _escalation_reason(self, history: List[Dict], current_env: Dict, forecast: str) -> Optional[str]:
+        if not history:
+            return "chưa có lịch sử"
+        error = history[-1]["output_data"]["EC_đo_được"] - self.target_ec
+        if abs(error) > self.max_ec_error:
+            return "sai số EC lớn"
+        et0, temperature = current_env["et0"], current_env["nhiệt_độ"]
+        if not self.et0_range[0] <= et0 <= self.et0_range[1]:
+            return "ET0 bất thường"
+        if not self.temperature_range[0] <= temperature <= self.temperature_range[1]:
+            return "nhiệt độ bất thường"
+        if "mưa" in forecast.lower():
+            return "dự báo có mưa"
+
+        recent = history[-self.drift_cycles:]
+        if len(recent) == self.drift_cycles:
+            errors = [r["output_data"]["EC_đo_được"] - self.target_ec for r in recent]
+            same_sign = all(e > 0 for e in errors) or all(e < 0 for e in errors)
+            saturated = recent[-1]["input_data"]["T_chờ_phút"] in (MIN_WAIT, MAX_WAIT)
+            if same_sign and saturated and abs(sum(errors)) / len(errors) > self.drift_error:
+                return "EC trôi dù T_chờ đã chạm biên"
+        return None
+
+    def decide(self, history: List[Dict], current_env: Dict, forecast: str) -> Tuple[Optional[Dict], str]:
+        """
+        Returns: (quyết định, "") nếu trong vùng tin cậy, ngược lại (None, lý do chuyển lên LLM)
+        """
+        reason = self._escalation_reason(history, current_env, forecast)
+        if reason is not None:
+            self.escalations[reason] = self.escalations.get(reason, 0) + 1
+            return None, reason
+
+        self.decisions += 1
+        return self.step(history, current_env), ""
+
+    def step(self, history: List[Dict], current_env: Dict) -> Dict:
+        """Một bước PI từ chu trình cuối, không kiểm tra vùng tin cậy (dùng cả làm fallback)"""
+        last = history[-1]
+        error = last["output_data"]["EC_đo_được"] - self.target_ec
+        previous_error = (history[-2]["output_data"]["EC_đo_được"] - self.target_ec
+                          if len(history) > 1 else error)
+        et0 = min(max(current_env["et0"], self.et0_range[0]), self.et0_range[1])
+        scale = REFERENCE_ET0 / et0
+        step = -scale * (self.kp * (error - previous_error) + self.ki * error)
+        step = max(-self.max_step, min(self.max_step, step))
+        last_wait = last["input_data"]["T_chờ_phút"]
+        wait_time = int(round(max(MIN_WAIT, min(MAX_WAIT, last_wait + step))))
+        return {
+            "T_chờ_đề_xuất": wait_time,
+            "lý_do": (f"Bộ điều khiển PI: sai số EC {error:+.2f}, ET0 {current_env['et0']}, "
+                      f"điều chỉnh {wait_time - last_wait:+.0f} phút")
+        }
+
+    def stats(self) -> Dict:
+        escalated = sum(self.escalations.values())
+        total = self.decisions + escalated
+        return {
+            "fast_path": self.decisions,
+            "escalated": escalated,
+            "escalation_reasons": dict(self.escalations),
+            "fast_path_rate": self.decisions / total if total else 0.0,
+        }
@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+"""
+Bộ lập lịch nhiều vùng tưới trên một event loop
+Mỗi vùng là một IrrigationSystem riêng (EC mục tiêu, Controller, Database);
+hàng đợi ưu tiên theo thời điểm tưới kế tiếp, số tác vụ đồng thời có giới hạn
+"""
+
+import asyncio
+import contextlib
+import heapq
+import io
+import itertools
+import os
+import tempfile
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Set
+
+from clock import SimulatedClock, create_clock
+from components import CyclePlan, Database
+from main import IrrigationSystem
+
+# Thời gian chờ trước khi thử lại một vùng vừa gặp lỗi
+RETRY_DELAY = timedelta(minutes=5)
+
+
+@dataclass(slots=True)
+class ZoneState:
+    """Trạng thái lập lịch của một vùng"""
+    name: str
+    system: IrrigationSystem
+    action: str = "start"            # start | plan | irrigate | done
+    next_due: Optional[datetime] = None
+    plan: Optional[CyclePlan] = None
+    cycles: int = 0
+    errors: int = 0
+
+
+class ZoneScheduler:
+    """
+    Điều phối N vùng: lập kế hoạch -> chờ (trong hàng đợi) -> tưới/phản tư/lưu
+
+    Thời gian chờ của mỗi vùng không chiếm tác vụ nào: vùng nằm trong heap
+    đến khi đến hạn, nên một tiến trình phục vụ được hàng trăm vùng.
+    """
+
+    def __init__(self, clock=None, max_concurrency: Optional[int] = None):
+        """
+        clock: đồng hồ dùng chung cho mọi vùng (mặc định theo CLOCK_MODE)
+        max_concurrency: số bước plan/tưới/phản tư chạy cùng lúc tối đa, tính cả
+                         phản tư/lưu trữ chạy nền sau khi tưới
+        """
+        self.clock = clock or create_clock()
+        self.max_concurrency = max_concurrency or int(os.getenv("SCHEDULER_MAX_CONCURRENCY", "16"))
+        self.zones: Dict[str, ZoneState] = {}
+        self._queue: List = []  # heap (thời điểm đến hạn, thứ tự, tên vùng)
+        self._sequence = itertools.count()
+        self._until: Optional[datetime] = None
+        self._max_cycles: Optional[int] = None
+        # Phản tư/lưu trữ nền (system._pending) vẫn chiếm một suất đồng thời
+        self._background: Set[asyncio.Task] = set()
+
+    def add_zone(self, name: str, system: IrrigationSystem):
+        """Thêm một vùng; vùng phải dùng chung đồng hồ với bộ lập lịch"""
+        if name in self.zones:
+            raise ValueError(f"Vùng đã tồn tại: {name}")
+        if system.clock is not self.clock:
+            raise ValueError(f"Vùng {name} phải dùng chung đồng hồ với bộ lập lịch")
+        state = ZoneState(name=name, system=system)
+        self.zones[name] = state
+        self._push(state, self.clock.now(), "start")
+
+    # ---------- Hàng đợi ----------
+
+    def _push(self, state: ZoneState, due: datetime, action: str, plan: Optional[CyclePlan] = None):
+        state.action, state.plan = action, plan
+        if self._until is not None and due > self._until:
+            state.action, state.next_due = "done", None
+            return
+        state.next_due = due
+        heapq.heappush(self._queue, (due, next(self._sequence), state.name))
+
+    def _schedule_plan(self, state: ZoneState, plan: CyclePlan):
+        """Vùng chờ T_chờ trong hàng đợi rồi mới tưới"""
+        due = self.clock.now() + timedelta(minutes=plan.T_chờ_phút)
+        self._push(state, due, "irrigate", plan)
+
+    async def _step(self, state: ZoneState):
+        """Chạy một bước của vùng và xếp lịch bước tiếp theo"""
+        system = state.system
+        try:
+            if state.action == "start":
+                # Hiệu chỉnh chạy song song giữa các vùng chưa có dữ liệu
+                if system.database.get_last_record() is None:
+                    self._schedule_plan(state, await system.aplan_calibration())
+                else:
+                    self._schedule_plan(state, await system.aplan_cycle())
+            elif state.action == "plan":
+                self._schedule_plan(state, await system.aplan_cycle())
+            else:
+                await system.afinish_cycle(state.plan)
+                if system._pending is not None:
+                    self._background.add(system._pending)
+                state.cycles += 1
+                if self._max_cycles is None or state.cycles < self._max_cycles:
+                    self._push(state, self.clock.now(), "plan")
+                else:
+                    state.action, state.next_due = "done", None
+        except Exception as e:
+            state.errors += 1
+            print(f"❌ Lỗi vùng {state.name} ({state.action}): {e}")
+            retry = "start" if state.action == "start" else "plan"
+            self._push(state, self.clock.now() + RETRY_DELAY, retry)
+
+    # ---------- Vòng lặp chính ----------
+
+    async def run(self, until: Optional[datetime] = None, max_cycles: Optional[int] = None):
+        """
+        Chạy đến khi không còn việc: mọi vùng đã qua `until` hoặc đủ `max_cycles`
+        chu trình vận hành (None = không giới hạn)
+        """
+        self._until, self._max_cycles = until, max_cycles
+        if until is not None:
+            self._queue = [entry for entry in self._queue if entry[0] <= until]
+            heapq.heapify(self._queue)
+
+        virtual = isinstance(self.clock, SimulatedClock)
+        if virtual:
+            self.clock.set_driven(True)
+        running: Set[asyncio.Task] = set()
+        background = self._background
+        try:
+            while self._queue or running or background:
+                now = self.clock.now()
+                while (self._queue and len(running) + len(background) < self.max_concurrency
+                       and self._queue[0][0] <= now):
+                    _, _, name = heapq.heappop(self._queue)
+                    running.add(asyncio.create_task(self._step(self.zones[name])))
+
+                # Khi đã đủ tác vụ đồng thời thì chỉ chờ tác vụ xong, không chờ hạn kế tiếp
+                busy = len(running) + len(background)
+                due = self._queue[0][0] if self._queue and busy < self.max_concurrency else None
+                if virtual:
+                    done = await self._wait_virtual(running | background, due)
+                else:
+                    done = await self._wait_real(running | background, due)
+                running.difference_update(done)
+                background.difference_update(done)
+            # Phản tư/lưu trữ nền của chu trình cuối mỗi vùng
+            await asyncio.gather(*(state.system.aflush() for state in self.zones.values()))
+        finally:
+            for task in running:
+                task.cancel()
+            if virtual:
+                self.clock.set_driven(False)
+
+    async def _wait_real(self, running: Set[asyncio.Task], due: Optional[datetime]) -> Set[asyncio.Task]:
+        """Chờ một tác vụ xong hoặc đến hạn vùng kế tiếp, tùy cái nào trước; trả về các tác vụ đã xong"""
+        waiters = set(running)
+        timer = None
+        if due is not None:
+            timer = asyncio.create_task(self.clock.asleep((due - self.clock.now()).total_seconds()))
+            waiters.add(timer)
+        done, _ = await asyncio.wait(waiters, return_when=asyncio.FIRST_COMPLETED)
+        if timer is not None and not timer.done():
+            timer.cancel()
+        return done
+
+    async def _wait_virtual(self, running: Set[asyncio.Task], due: Optional[datetime]) -> Set[asyncio.Task]:
+        """
+        Đồng hồ sự kiện rời rạc: chỉ nhảy thời gian khi mọi tác vụ đang chạy
+        đều chờ đồng hồ, ngược lại chờ chúng (LLM, I/O) tiến triển
+        Returns: các tác vụ đã xong
+        """
+        if running and self.clock.waiting < len(running):
+            signal = asyncio.create_task(self.clock.wait_for_waiter())
+            done, _ = await asyncio.wait(running | {signal}, return_when=asyncio.FIRST_COMPLETED)
+            signal.cancel()
+            return done
+        candidates = [moment for moment in (due, self.clock.next_wakeup()) if moment is not None]
+        if candidates:
+            self.clock.advance_to(min(candidates))
+        await asyncio.sleep(0)
+        return set()
+
+    # ---------- Giám sát ----------
+
+    def status(self) -> List[Dict]:
+        """Trạng thái từng vùng: EC mục tiêu, bước kế tiếp, số chu trình, lỗi, EC gần nhất"""
+        rows = []
+        for state in self.zones.values():
+            aggregates = state.system.database.aggregates
+            rows.append({
+                "zone": state.name,
+                "target_ec": state.system.target_ec,
+                "action": state.action,
+                "next_due": state.next_due.isoformat() if state.next_due else None,
+                "cycles": state.cycles,
+                "errors": state.errors,
+                "last_ec": aggregates.rolling["EC"].values[-1] if aggregates.count else None,
+            })
+        return rows
+
+
+def main():
+    """Chạy thử: hàng trăm vùng mô phỏng với EC mục tiêu khác nhau trên đồng hồ sự kiện rời rạc"""
+    from simulator import (RulePlanAgent, SimulatedController, SimulatedEnvironmentSensor,
+                           TemplateReflectionAgent, ZoneSimulator)
+
+    n_zones, days = 50, 7
+    directory = tempfile.mkdtemp(prefix="irrigation_zones_")
+    clock = SimulatedClock(datetime(2025, 1, 1, 7, 0))
+    simulator = ZoneSimulator(n_zones=n_zones, seed=7)
+    scheduler = ZoneScheduler(clock=clock, max_concurrency=32)
+
+    for zone in range(n_zones):
+        target_ec = round(3.5 + (zone % 5) * 0.25, 2)
+        scheduler.add_zone(f"zone_{zone:03d}", IrrigationSystem(
+            controller=SimulatedController(simulator, zone, time_source=clock.time),
+            sensor=SimulatedEnvironmentSensor(simulator, zone),
+            clock=clock,
+            database=Database(file_path=os.path.join(directory, f"zone_{zone:03d}.jsonl"),
+                              storage="jsonl", fsync_every=0, target_ec=target_ec),
+            reflection_agent=TemplateReflectionAgent(target_ec),
+            plan_agent=RulePlanAgent(target_ec),
+            target_ec=target_ec,
+        ))
+
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        asyncio.run(scheduler.run(until=clock.now() + timedelta(days=days)))
+    elapsed = time.perf_counter() - started
+
+    status = scheduler.status()
+    cycles = sum(row["cycles"] for row in status)
+    errors = sum(abs(row["last_ec"] - row["target_ec"]) for row in status) / len(status)
+    print(f"🌱 {n_zones} vùng x {days} ngày: {cycles} chu trình trong {elapsed:.2f}s")
+    print(f"🕐 Đồng hồ mô phỏng: {clock.now():%Y-%m-%d %H:%M}")
+    print(f"🎯 Sai số EC cuối trung bình: {errors:.2f}")
+
+
+if __name__ == "__main__":
+    main()